@@ -0,0 +1,86 @@
+"""
+Benchmark `bzfunds.analytics` against a naive per-fund `groupby().apply` baseline.
+
+Usage::
+
+    python -m benchmarks.analytics --funds 2000 --days 1250
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from bzfunds import analytics
+
+
+def make_panel(n_funds: int, n_days: int, missing: float = 0.05) -> pd.DataFrame:
+    """Random-walk `nav` panel with a fraction of `missing` observations"""
+    rng = np.random.default_rng(0)
+    values = np.cumprod(1 + rng.normal(0, 0.01, (n_days, n_funds)), axis=0)
+    values[rng.random(values.shape) < missing] = np.nan
+
+    return pd.DataFrame(
+        values,
+        index=pd.bdate_range("2017-01-02", periods=n_days, name="date"),
+        columns=pd.Index([f"{i:014d}" for i in range(n_funds)], name="fund_cnpj"),
+    )
+
+
+def naive(long: pd.DataFrame) -> pd.DataFrame:
+    """Per-fund loop, as typically written against `get_data`'s output"""
+
+    def stats(df: pd.DataFrame) -> pd.Series:
+        nav = df.set_index("date")["nav"].dropna()
+        rets = nav.pct_change()
+        return pd.Series(
+            {
+                "cum_return": nav.iloc[-1] / nav.iloc[0] - 1,
+                "volatility": rets.rolling(21).std().iloc[-1] * np.sqrt(252),
+                "max_drawdown": (nav / nav.cummax() - 1).min(),
+            }
+        )
+
+    return long.groupby("fund_cnpj").apply(stats)
+
+
+def vectorized(panel: pd.DataFrame) -> pd.DataFrame:
+    rets = analytics.returns(panel)
+    return pd.DataFrame(
+        {
+            "cum_return": analytics.cumulative_returns(panel).ffill().iloc[-1],
+            "volatility": analytics.rolling_volatility(rets, 21).iloc[-1],
+            "max_drawdown": analytics.max_drawdown(panel),
+        }
+    )
+
+
+def timeit(fn, *args, repeat: int = 3) -> float:
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--funds", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=1250)
+    args = parser.parse_args()
+
+    panel = make_panel(args.funds, args.days)
+    long = panel.stack().rename("nav").reset_index()
+
+    t_naive = timeit(naive, long, repeat=1)
+    t_vectorized = timeit(vectorized, panel)
+    print(f"{args.funds} funds x {args.days} days")
+    print(f"  groupby.apply : {t_naive:8.3f}s")
+    print(f"  analytics     : {t_vectorized:8.3f}s ({t_naive / t_vectorized:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
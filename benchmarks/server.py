@@ -0,0 +1,58 @@
+"""
+Local stand-in for CVM's endpoint, serving files generated by `benchmarks.synthetic`.
+
+While running, `bzfunds.settings.API_ENDPOINT` points to the local server, so
+`get_url_from_date` (and thus `get_history`) requests files from it.
+
+Usage::
+
+    python -m benchmarks.server /tmp/cvm --port 8000
+"""
+
+import argparse
+import threading
+from contextlib import contextmanager
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator
+
+from bzfunds import settings
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@contextmanager
+def serve(root: str, port: int = 0) -> Iterator[str]:
+    """Serve `root` on a background thread and yield its base `url`"""
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", port), partial(QuietHandler, directory=root)
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    endpoint = settings.API_ENDPOINT
+    settings.API_ENDPOINT = f"http://127.0.0.1:{server.server_port}"
+    try:
+        yield settings.API_ENDPOINT
+    finally:
+        settings.API_ENDPOINT = endpoint
+        server.shutdown()
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    with serve(args.root, args.port) as url:
+        print(f"Serving {args.root} at {url} (set `API_ENDPOINT={url}`)")
+        threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Timed ingestion and query scenarios over synthetic data, at several sizes.
+
+Each scenario is run `--repeat` times (keeping the best wall time) for each #
+of `--funds`, along with the stage report of its best run (see
+`bzfunds.metrics`). Results are saved as JSON, and can be compared against a
+previous run with `--compare`.
+
+Scenarios writing data use either MongoDB (`settings.MONGODB`, on a separate
+`bench_funds` collection, dropped after each run) or a temporary Parquet
+dataset (requires `pyarrow`). Queries run thru `bzfunds.api.get_data`, both
+without and with (i.e. `*_cached`, served from memory) a `QueryCache`.
+
+Usage::
+
+    python -m benchmarks.suite --funds 500 2000 --backend parquet --output new.json
+    python -m benchmarks.suite --funds 500 2000 --backend parquet --compare new.json
+"""
+
+import argparse
+import io
+import json
+import platform
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+from bzfunds import api, metrics, settings
+from bzfunds.cache import QueryCache
+from bzfunds.data import get_history
+from bzfunds.storage import Storage
+from bzfunds.utils import parse_csv
+
+from .server import serve
+from .synthetic import generate, month_csv
+
+
+# Globals
+# ----
+SCENARIOS = (
+    "parse_csv",
+    "get_history",
+    "get_history_commit",
+    "write_df",
+    "get_data",
+)
+START, END = "2016-01", "2017-06"
+
+
+def make_manager(backend: str, root: str) -> Storage:
+    if backend == "parquet":
+        from bzfunds.parquet import ParquetManager
+
+        return ParquetManager(root)
+
+    from bzfunds.dbm import Manager
+
+    manager = Manager(**{**settings.MONGODB, "collection": "bench_funds"})
+    manager.collection.drop()
+    manager.ensure_indexes()
+
+    return manager
+
+
+def query(manager: Storage, **kwargs) -> int:
+    return len(api.get_data(manager=manager, **kwargs))
+
+
+def drop(manager: Storage):
+    if hasattr(manager, "collection"):
+        manager.collection.drop()
+
+
+def run(
+    fn: Callable[[], int],
+    repeat: int,
+    setup: Callable = None,
+    teardown: Callable = None,
+) -> Dict:
+    """Return the best wall time of `fn` (which returns its # of rows) over
+    `repeat` runs, along with its metrics report
+
+    If provided, `setup` returns the argument of each run of `fn`, which is then
+    passed to `teardown`.
+    """
+    best = None
+    for _ in range(repeat):
+        state = setup() if setup else None
+        with metrics.collect() as collected:
+            start = time.perf_counter()
+            rows = fn(state) if setup else fn()
+            seconds = time.perf_counter() - start
+        if teardown:
+            teardown(state)
+        if best is None or seconds < best["seconds"]:
+            best = {"seconds": seconds, "rows": rows, "metrics": collected.report()}
+
+    best["rows_per_second"] = best["rows"] / best["seconds"]
+
+    return best
+
+
+def bench(n_funds: int, backend: str, scenarios: List[str], repeat: int) -> List[Dict]:
+    results = []
+    start_dt, end_dt = pd.Timestamp(START), pd.Timestamp(END) + pd.offsets.MonthEnd(0)
+    with tempfile.TemporaryDirectory() as root:
+        generate(f"{root}/cvm", START, END, n_funds)
+        with serve(f"{root}/cvm"):
+            if "parse_csv" in scenarios:
+                data = month_csv(n_funds).getvalue()
+                results.append(
+                    {
+                        "scenario": "parse_csv",
+                        **run(lambda: len(parse_csv(io.BytesIO(data))), repeat),
+                    }
+                )
+
+            if "get_history" in scenarios:
+                results.append(
+                    {
+                        "scenario": "get_history",
+                        **run(
+                            lambda: len(get_history(start_dt, end_dt, commit=False)),
+                            repeat,
+                        ),
+                    }
+                )
+
+            if "get_history_commit" in scenarios:
+
+                def commit(manager: Storage) -> int:
+                    get_history(start_dt, end_dt, commit=True, manager=manager)
+                    return len(manager.read_df(columns=["date"]))
+
+                def setup() -> Storage:
+                    return make_manager(backend, tempfile.mkdtemp(dir=root))
+
+                results.append(
+                    {
+                        "scenario": "get_history_commit",
+                        **run(commit, repeat, setup, drop),
+                    }
+                )
+
+            df = get_history(start_dt, end_dt, commit=False).reset_index()
+
+        if "write_df" in scenarios:
+
+            def write(manager: Storage) -> int:
+                manager.write_df(df)
+                return len(df)
+
+            def setup() -> Storage:
+                return make_manager(backend, tempfile.mkdtemp(dir=root))
+
+            results.append({"scenario": "write_df", **run(write, repeat, setup, drop)})
+
+        if "get_data" in scenarios:
+            manager = make_manager(backend, tempfile.mkdtemp(dir=root))
+            manager.write_df(df)
+            funds = df["fund_cnpj"].drop_duplicates().iloc[:10].tolist()
+            queries = {
+                "get_data": {},
+                "get_data_funds": {"funds": funds},
+                "get_data_month": {"start_dt": "2017-03-01", "end_dt": "2017-03-31"},
+            }
+            for cached in (False, True):
+                manager.query_cache = QueryCache() if cached else None
+                for name, kwargs in queries.items():
+                    fn = partial(query, manager, **kwargs)
+                    if cached:
+                        name = f"{name}_cached"
+                        fn()  # i.e. timed runs are all served from the cache
+                    results.append({"scenario": name, **run(fn, repeat)})
+            drop(manager)
+
+    for res in results:
+        res["funds"] = n_funds
+
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict]):
+    """Print the change in wall time of each scenario against `baseline`"""
+    previous = {(r["scenario"], r["funds"]): r["seconds"] for r in baseline}
+    print(f"{'scenario':<22}{'funds':>8}{'seconds':>10}{'baseline':>10}{'change':>9}")
+    for res in results:
+        key = (res["scenario"], res["funds"])
+        line = f"{key[0]:<22}{key[1]:>8}{res['seconds']:>10.3f}"
+        if key in previous:
+            change = res["seconds"] / previous[key] - 1
+            line += f"{previous[key]:>10.3f}{change:>+9.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--funds", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--backend", choices=("mongodb", "parquet"), default="mongodb")
+    parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS)
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="path to save results (JSON)")
+    parser.add_argument("--compare", help="path of previous results (JSON)")
+    args = parser.parse_args()
+
+    results = []
+    for n_funds in args.funds:
+        results.extend(bench(n_funds, args.backend, args.scenarios, args.repeat))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "backend": args.backend,
+            "months": f"{START}:{END}",
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(report, fp, indent=2)
+
+    baseline = []
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+    compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
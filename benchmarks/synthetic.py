@@ -0,0 +1,124 @@
+"""
+Synthetic raw files matching CVM's schema (i.e. `constants.API_COLUMNS_MAP`).
+
+Files are written with the same names (and relative paths) as those requested
+by `utils.get_url_from_date`, i.e. monthly `csv` files at the root and yearly
+`zip` archives under `HIST/`, so a directory of generated files can be served
+as is (see `benchmarks.server`).
+
+Usage::
+
+    python -m benchmarks.synthetic /tmp/cvm --funds 2000 --start 2016-01 --end 2017-06
+"""
+
+import argparse
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from bzfunds.constants import (
+    API_COLUMNS_MAP,
+    API_DATE_FORMAT,
+    API_FILENAME_PREFIX,
+    API_LAST_ZIPPED_DATE,
+)
+
+
+# Globals
+# ----
+FUND_TYPES = ("FI", "FIF", "FIC-FI", "FACFIF")
+
+
+def make_cnpj(i: int) -> str:
+    digits = f"{i:08d}0001{i % 100:02d}"
+    return f"{digits[:2]}.{digits[2:5]}.{digits[5:8]}/{digits[8:12]}-{digits[12:]}"
+
+
+def make_month(date: pd.Timestamp, n_funds: int, seed: int = 0) -> pd.DataFrame:
+    """Return one month of raw (business) daily rows for `n_funds` funds"""
+    rng = np.random.default_rng([seed, date.year, date.month])
+    dates = pd.bdate_range(date, date + pd.offsets.MonthEnd(0))
+    n_rows = len(dates) * n_funds
+
+    navs = np.cumprod(1 + rng.normal(0, 0.005, (len(dates), n_funds)), axis=0)
+    equity = rng.lognormal(16, 2, n_funds) * navs
+    df = pd.DataFrame(
+        {
+            "TP_FUNDO": np.tile(
+                np.array(FUND_TYPES)[np.arange(n_funds) % 4], len(dates)
+            ),
+            "CNPJ_FUNDO": np.tile([make_cnpj(i) for i in range(n_funds)], len(dates)),
+            "DT_COMPTC": np.repeat(dates.strftime("%Y-%m-%d"), n_funds),
+            "VL_TOTAL": (equity * 1.01).ravel(),
+            "VL_QUOTA": navs.ravel(),
+            "VL_PATRIM_LIQ": equity.ravel(),
+            "CAPTC_DIA": np.where(
+                rng.random(n_rows) < 0.2, rng.lognormal(12, 2, n_rows), 0
+            ),
+            "RESG_DIA": np.where(
+                rng.random(n_rows) < 0.2, rng.lognormal(12, 2, n_rows), 0
+            ),
+            "NR_COTST": rng.integers(1, 10_000, n_rows),
+        }
+    )
+
+    return df[list(API_COLUMNS_MAP)]
+
+
+def to_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(sep=";", index=False, float_format="%.6f").encode("latin-1")
+
+
+def generate(root: str, start: str, end: str, n_funds: int, seed: int = 0) -> int:
+    """Write all files from `start` to `end` (monthly) into `root`, and return
+    their total size in bytes
+
+    Months up to `API_LAST_ZIPPED_DATE` are written as yearly archives (with
+    one member per month), as published by CVM.
+    """
+    os.makedirs(os.path.join(root, "HIST"), exist_ok=True)
+    months = pd.period_range(start, end, freq="M").to_timestamp()
+
+    size = 0
+    for year, dates in pd.Series(months, index=months.year).groupby(level=0):
+        if dates.iloc[0] <= API_LAST_ZIPPED_DATE:
+            path = os.path.join(root, "HIST", f"{API_FILENAME_PREFIX}{year}.zip")
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                for date in dates:
+                    name = f"{API_FILENAME_PREFIX}{date.strftime(API_DATE_FORMAT)}.csv"
+                    archive.writestr(name, to_csv(make_month(date, n_funds, seed)))
+            size += os.path.getsize(path)
+        else:
+            for date in dates:
+                name = f"{API_FILENAME_PREFIX}{date.strftime(API_DATE_FORMAT)}.csv"
+                path = os.path.join(root, name)
+                with open(path, "wb") as fp:
+                    fp.write(to_csv(make_month(date, n_funds, seed)))
+                size += os.path.getsize(path)
+
+    return size
+
+
+def month_csv(n_funds: int, date: str = "2021-01-01", seed: int = 0) -> io.BytesIO:
+    """Return a single monthly `csv` file as an in-memory buffer"""
+    return io.BytesIO(to_csv(make_month(pd.Timestamp(date), n_funds, seed)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("root")
+    parser.add_argument("--funds", type=int, default=2000)
+    parser.add_argument("--start", default="2016-01")
+    parser.add_argument("--end", default="2017-06")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    size = generate(args.root, args.start, args.end, args.funds, args.seed)
+    print(f"Wrote {size / 1024**2:.1f} MB to {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,24 @@
-from .api import *
+import importlib
 
 
+__all__ = (
+    "download_data",
+    "get_aggregates",
+    "get_data",
+    "get_default_manager",
+    "get_panel",
+    "get_snapshot",
+    "iter_data",
+)
 __version__ = "0.1"
+
+
+def __getattr__(name: str):
+    # `bzfunds.api` (and thus pandas, pymongo, etc) is only imported on first use
+    if name in __all__:
+        return getattr(importlib.import_module(".api", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted({*globals(), *__all__})
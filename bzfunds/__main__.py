@@ -0,0 +1,54 @@
+"""
+Command line interface, e.g.::
+
+    python -m bzfunds sync --interval 300 --port 8000
+"""
+
+import argparse
+import signal
+import threading
+
+from .sync import DEFAULT_INTERVAL, DEFAULT_MONTHS
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="bzfunds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync_parser = commands.add_parser(
+        "sync", help="keep recent months in sync with CVM (see `bzfunds.sync`)"
+    )
+    sync_parser.add_argument(
+        "--interval", type=float, default=DEFAULT_INTERVAL, help="seconds between polls"
+    )
+    sync_parser.add_argument(
+        "--months", type=int, default=DEFAULT_MONTHS, help="# of months polled"
+    )
+    sync_parser.add_argument(
+        "--port", type=int, help="port to serve `/health` and `/metrics` on"
+    )
+    sync_parser.add_argument("--once", action="store_true", help="poll only once")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        from .api import DEFAULT_CACHE, get_default_manager
+        from .sync import sync
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            sync(
+                get_default_manager(),
+                interval=args.interval,
+                months=args.months,
+                port=args.port,
+                once=args.once,
+                cache=DEFAULT_CACHE,
+                stop=stop,
+            )
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
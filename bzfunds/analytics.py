@@ -0,0 +1,233 @@
+"""
+bzfunds.analytics
+~~~~~~~~~~~~~~~~~
+
+This module implements common funds' analytics over wide (dates x funds)
+panels, such as those returned by `get_panel`.
+
+All functions are vectorized across funds (i.e. there are no per-fund loops)
+and handle missing observations, which are common as funds report on
+different days: returns are always measured between consecutive *valid*
+observations of each fund.
+"""
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+__all__ = (
+    "returns",
+    "period_returns",
+    "cumulative_returns",
+    "net_flows",
+    "rolling_volatility",
+    "drawdowns",
+    "max_drawdown",
+)
+
+
+# Globals
+# ----
+TRADING_DAYS = 252
+ROLLING_BLOCK_SIZE = 2**22  # Max # of values held by each block of windows
+
+
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """Forward-fill `NaN`'s along the first axis of a 2D array"""
+    idx = np.where(np.isnan(values), 0, np.arange(values.shape[0])[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+
+    return values[idx, np.arange(values.shape[1])]
+
+
+def _lag(values: np.ndarray) -> np.ndarray:
+    """Return the last valid observation strictly before each row"""
+    lagged = np.full_like(values, np.nan)
+    lagged[1:] = _ffill(values)[:-1]
+
+    return lagged
+
+
+def returns(nav: pd.DataFrame) -> pd.DataFrame:
+    """Return each fund's return since its previous valid `nav`
+
+    Returns are only defined on dates where `nav` is observed (i.e. a return
+    spanning a gap is assigned to the first date after the gap), and from a
+    non-zero `nav` (i.e. they are never infinite).
+
+    ...
+
+    Parameters
+    ----------
+    nav : pd.DataFrame
+        (dates x funds) panel
+    """
+    values = nav.to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = values / _lag(values) - 1
+    res[np.isinf(res)] = np.nan
+
+    return pd.DataFrame(res, index=nav.index, columns=nav.columns)
+
+
+def period_returns(nav: pd.DataFrame, freq: str = "M") -> pd.DataFrame:
+    """Return each fund's return over calendar periods of `freq`
+
+    Computed from the last valid `nav` of each period, i.e. the first period
+    of each fund is `NaN`.
+
+    ...
+
+    Parameters
+    ----------
+    nav : pd.DataFrame
+        (dates x funds) panel with a `DatetimeIndex`
+    freq : `str`
+        any `pandas` period alias, e.g. `M` (monthly) or `Y` (yearly)
+    """
+    last = nav.groupby(nav.index.to_period(freq)).last()
+
+    return returns(last)
+
+
+def cumulative_returns(nav: pd.DataFrame) -> pd.DataFrame:
+    """Return each fund's cumulative return since its first valid `nav`
+
+    ...
+
+    Parameters
+    ----------
+    nav : pd.DataFrame
+        (dates x funds) panel
+    """
+    values = nav.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    first = values[valid.argmax(axis=0), np.arange(values.shape[1])]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = values / first - 1
+
+    return pd.DataFrame(res, index=nav.index, columns=nav.columns)
+
+
+def net_flows(
+    subscriptions: pd.DataFrame,
+    redemptions: pd.DataFrame,
+    total_equity: pd.DataFrame,
+) -> pd.DataFrame:
+    """Return each fund's net flows as a fraction of its previous `total_equity`
+
+    All panels must share the same labels (e.g. query them with the same
+    arguments). Missing flows are treated as zero on dates where either
+    `subscriptions` or `redemptions` is observed.
+
+    ...
+
+    Parameters
+    ----------
+    subscriptions : pd.DataFrame
+    redemptions : pd.DataFrame
+    total_equity : pd.DataFrame
+    """
+    subs = subscriptions.to_numpy(dtype=float)
+    reds = redemptions.to_numpy(dtype=float)
+    flows = np.where(
+        np.isnan(subs) & np.isnan(reds),
+        np.nan,
+        np.nan_to_num(subs) - np.nan_to_num(reds),
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = flows / _lag(total_equity.to_numpy(dtype=float))
+    res[~np.isfinite(res)] = np.nan
+
+    return pd.DataFrame(res, index=total_equity.index, columns=total_equity.columns)
+
+
+def rolling_volatility(
+    rets: pd.DataFrame,
+    window: int = 21,
+    *,
+    min_periods: Optional[int] = None,
+    annualize: bool = True,
+) -> pd.DataFrame:
+    """Return each fund's (sample) rolling volatility of `rets`
+
+    `NaN`'s are skipped, so each window's volatility is computed from its
+    valid observations only (if there are at least `min_periods` of them).
+    Windows are computed from their deviations from their own mean (as in
+    `pandas`), in blocks of rows bounded by `ROLLING_BLOCK_SIZE` values.
+
+    ...
+
+    Parameters
+    ----------
+    rets : pd.DataFrame
+        (dates x funds) panel of returns, e.g. from `returns`
+    window : `int`
+        # of rows per window
+    min_periods : `int`
+        min # of valid observations per window. Defaults to `window`
+    annualize : `bool`
+        if True, will scale by `sqrt(TRADING_DAYS)`
+    """
+    min_periods = window if min_periods is None else min_periods
+    values = rets.to_numpy(dtype=float)
+    padded = np.vstack([np.full((window - 1, values.shape[1]), np.nan), values])
+    # (dates x funds x window) view, i.e. windows ending at each date
+    windows = sliding_window_view(padded, window, axis=0)
+
+    var = np.empty_like(values)
+    step = max(ROLLING_BLOCK_SIZE // max(values.shape[1] * window, 1), 1)
+    for i in range(0, len(values), step):
+        block = windows[i : i + step]
+        valid = ~np.isnan(block)
+        n = valid.sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(valid, block, 0.0).sum(axis=-1) / n
+            dev = np.where(valid, block - mean[..., None], 0.0)
+            res = (dev**2).sum(axis=-1) / (n - 1)
+        res[n < max(min_periods, 2)] = np.nan
+        var[i : i + step] = res
+    vol = np.sqrt(var)
+    if annualize:
+        vol *= np.sqrt(TRADING_DAYS)
+
+    return pd.DataFrame(vol, index=rets.index, columns=rets.columns)
+
+
+def drawdowns(nav: pd.DataFrame) -> pd.DataFrame:
+    """Return each fund's drawdown from its running peak `nav`
+
+    ...
+
+    Parameters
+    ----------
+    nav : pd.DataFrame
+        (dates x funds) panel
+    """
+    values = nav.to_numpy(dtype=float)
+    peak = np.fmax.accumulate(values, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = values / peak - 1
+
+    return pd.DataFrame(res, index=nav.index, columns=nav.columns)
+
+
+def max_drawdown(nav: pd.DataFrame) -> pd.Series:
+    """Return each fund's maximum drawdown (as a negative fraction)
+
+    ...
+
+    Parameters
+    ----------
+    nav : pd.DataFrame
+        (dates x funds) panel
+    """
+    dd = drawdowns(nav).to_numpy()
+    res = np.full(dd.shape[1], np.nan)
+    has_data = ~np.isnan(dd).all(axis=0)
+    res[has_data] = np.nanmin(dd[:, has_data], axis=0)
+
+    return pd.Series(res, index=nav.columns, name="max_drawdown")
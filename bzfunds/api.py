@@ -8,20 +8,30 @@ funds' data.
 
 import logging
 import sys
+import threading
 from datetime import datetime
-from typing import Optional, Union
+from typing import Iterator, Optional, Union
 
+import numpy as np
 import pandas as pd
-import pymongo
 from typeguard import typechecked
 
-from . import settings
-from .constants import API_FIRST_VALID_DATE
-from .data import get_history
-from .dbm import Manager
+from . import metrics, settings
+from .cache import DownloadCache, QueryCache
+from .constants import API_FIRST_VALID_DATE, API_INDEX_COLUMNS
+from .rollups import FREQS, LEVELS, rollup_name
+from .storage import DEFAULT_CHUNKSIZE, Storage
 
 
-__all__ = ("download_data", "get_data")
+__all__ = (
+    "download_data",
+    "get_aggregates",
+    "get_data",
+    "get_default_manager",
+    "get_panel",
+    "get_snapshot",
+    "iter_data",
+)
 
 
 logging.basicConfig(
@@ -34,7 +44,51 @@ logger = logging.getLogger(__name__)
 
 # Globals
 # ----
-DEFAULT_DB_MANAGER = Manager(**settings.MONGODB)
+_default_manager = None
+_default_manager_lock = threading.Lock()
+DEFAULT_CACHE = DownloadCache(**settings.CACHE) if settings.CACHE["path"] else None
+PANEL_FIELDS = (
+    "total_portfolio",
+    "nav",
+    "total_equity",
+    "subscriptions",
+    "redemptions",
+    "n_shareholders",
+)
+SNAPSHOT_LOOKBACK_DAYS = 31
+
+
+def get_default_manager() -> Storage:
+    """Return the storage backend configured in `settings`, used by default by
+    every function of this module
+
+    It is only created on first use (and thereafter reused), such that neither
+    importing `bzfunds` nor instantiating it requires a reachable database.
+    """
+    global _default_manager
+
+    with _default_manager_lock:
+        if _default_manager is None:
+            if settings.STORAGE_BACKEND == "parquet":
+                from .parquet import ParquetManager
+
+                manager = ParquetManager(**settings.PARQUET)
+            else:
+                from .dbm import Manager
+
+                manager = Manager(**settings.MONGODB)
+            if settings.QUERY_CACHE["max_size"]:
+                manager.query_cache = QueryCache(**settings.QUERY_CACHE)
+            _default_manager = manager
+
+    return _default_manager
+
+
+def __getattr__(name: str):
+    # `DEFAULT_DB_MANAGER` is kept as an alias of the (lazy) default manager
+    if name == "DEFAULT_DB_MANAGER":
+        return get_default_manager()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @typechecked
@@ -42,7 +96,8 @@ def download_data(
     *,
     start_year: Optional[Union[str, float]] = None,
     update_only: bool = True,
-    manager: Manager = DEFAULT_DB_MANAGER,
+    manager: Optional[Storage] = None,
+    cache: Optional[DownloadCache] = DEFAULT_CACHE,
 ):
     """Download available data and insert it into the database.
 
@@ -54,24 +109,42 @@ def download_data(
     Parameters
     ----------
     start_year : `str` or `float`
-        starting year to query data. If not provided, defaults to last 5 years
+        starting year to query data. If not provided, defaults to last 5 years.
+        Runs as a resumable backfill, i.e. months already downloaded by a
+        previous (e.g. interrupted) call are skipped (see `bzfunds.backfill`)
     update_only : `bool`
-        if True, will use the last available date in `manager` as the starting
-        query date (this is not a `diff` against the database!)
-    manager : `Manager`
-        loaded instance of database manager
+        if True, will query data starting `settings.UPDATE_LOOKBACK_MONTHS` before
+        the last available date in `manager`, and only write rows that are
+        either new or restated (i.e. a `diff` against the database). Either way,
+        rollups of all months downloaded are updated (see `get_aggregates`)
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    cache : `DownloadCache`
+        if provided, raw files are only re-downloaded if changed since cached
     """
     if not (start_year or update_only):
         raise ValueError("Must provide a `start_year` or `update_only` flag")
     elif start_year and update_only:
         raise ValueError("Conflicting arguments")
 
+    # Only needed to download data (i.e. not to query it)
+    from .backfill import backfill
+    from .data import get_history
+
+    if manager is None:
+        manager = get_default_manager()
+
     if update_only:
-        cursor = manager.collection.find().limit(1).sort("date", pymongo.DESCENDING)
-        try:
-            start_dt = cursor[0]["date"]
-        except (IndexError, KeyError):
+        last_dt = manager.last_date()
+        if last_dt is None:
             logger.warning("No previous data found. Querying all available history.")
+            start_dt = API_FIRST_VALID_DATE
+        else:
+            lookback = pd.DateOffset(months=settings.UPDATE_LOOKBACK_MONTHS)
+            start_dt = max(
+                (pd.Timestamp(last_dt) - lookback).replace(day=1), API_FIRST_VALID_DATE
+            )
     else:
         # Defaults to last 5 years if not provided
         if not start_year:
@@ -79,12 +152,21 @@ def download_data(
         start_dt = pd.to_datetime(f"{start_year}-01-01")
 
     try:
-        _ = get_history(
-            start_dt=start_dt,
-            end_dt=datetime.today(),
-            commit=True,
-            manager=manager,
-        )
+        if update_only:
+            _ = get_history(
+                start_dt=start_dt,
+                end_dt=datetime.today(),
+                commit=True,
+                manager=manager,
+                chunksize=settings.INGESTION_CHUNKSIZE,
+                cache=cache,
+                incremental=True,
+                rollups=True,
+            )
+        else:
+            _ = backfill(
+                start_dt, datetime.today(), manager, cache=cache, incremental=False
+            )
     except ValueError as e:
         logger.error(e)
 
@@ -94,10 +176,18 @@ def get_data(
     funds: Optional[Union[str, list]] = None,
     start_dt: Optional[Union[str, datetime]] = None,
     end_dt: Optional[Union[str, datetime]] = None,
-    manager: Manager = DEFAULT_DB_MANAGER,
+    manager: Optional[Storage] = None,
+    *,
+    columns: Optional[list] = None,
+    dtype: Optional[dict] = None,
 ) -> Optional[pd.DataFrame]:
     """Easily query the database.
 
+    If `manager` has a `query_cache` attached, results are served from it when
+    available and cached otherwise. Cached results are returned as (shallow)
+    copies, i.e. columns can be added or replaced, but values must not be
+    modified in place (e.g. thru `df.loc[...] = ...`).
+
     ...
 
     Parameters
@@ -107,25 +197,291 @@ def get_data(
         string must be in YYYY-MM-DD format
     end_dt : `str` or `datetime`
         string must be in YYYY-MM-DD format
-    manager : `Manager`
-        loaded instance of database manager
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    columns : `list`
+        columns to fetch (`date` is always included). Defaults to all columns
+    dtype : `dict`
+        optional (column -> dtype) map, e.g. `{"nav": "float32"}`
     """
     if isinstance(funds, str):
         funds = [funds]
+    if columns is not None and "date" not in columns:
+        columns = ["date", *columns]
+    if manager is None:
+        manager = get_default_manager()
 
-    search = {}
-    if funds:
-        search["fund_cnpj"] = {"$in": funds}
+    cache = manager.query_cache
+    if cache is not None:
+        key = cache.make_key(funds, start_dt, end_dt, columns=columns, dtype=dtype)
+        df = cache.get(key)
+        if df is not None:
+            metrics.incr("query_cache_hits")
+            return df.copy(deep=False) if not df.empty else None
+        metrics.incr("query_cache_misses")
+        token = cache.snapshot()
 
-    if start_dt or end_dt:
-        search["date"] = {}
-        if start_dt:
-            search["date"]["$gte"] = pd.to_datetime(start_dt)
-        if end_dt:
-            search["date"]["$lte"] = pd.to_datetime(end_dt)
-
-    cursor = list(manager.collection.find(search))
-    if cursor:
-        df = pd.DataFrame(cursor).set_index("date").sort_index().drop("_id", axis=1)
+    with metrics.timer("get_data"):
+        df = manager.read_df(funds, start_dt, end_dt, columns=columns, dtype=dtype)
+        df = df.set_index("date").sort_index(kind="stable")
+    if cache is not None:
+        cache.put(key, df, token)
+        df = df.copy(deep=False)
 
+    if not df.empty:
         return df
+
+
+@typechecked
+def iter_data(
+    funds: Optional[Union[str, list]] = None,
+    start_dt: Optional[Union[str, datetime]] = None,
+    end_dt: Optional[Union[str, datetime]] = None,
+    manager: Optional[Storage] = None,
+    *,
+    columns: Optional[list] = None,
+    dtype: Optional[dict] = None,
+    chunksize: int = DEFAULT_CHUNKSIZE,
+    monthly: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """Query the database in chunks, e.g. to export results larger than memory.
+
+    Yields `DataFrame`s formatted as those of `get_data` (i.e. indexed by `date`),
+    in `date` order, of up to `chunksize` rows or one per calendar month. Rows
+    are streamed from the database as they are consumed, so the first chunk is
+    available right away and peak memory is bounded by a single chunk (results
+    aren't cached).
+
+    ...
+
+    Parameters
+    ----------
+    funds : `str` or `list`
+    start_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    end_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    columns : `list`
+        columns to fetch (`date` is always included). Defaults to all columns
+    dtype : `dict`
+        optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+    chunksize : `int`
+        max # of rows per chunk (ignored if `monthly=True`)
+    monthly : `bool`
+        if True, will yield a single chunk per calendar month
+    """
+    if chunksize < 1:
+        raise ValueError("`chunksize` must be positive")
+
+    if isinstance(funds, str):
+        funds = [funds]
+    if columns is not None and "date" not in columns:
+        columns = ["date", *columns]
+    if manager is None:
+        manager = get_default_manager()
+
+    chunks = manager.iter_df(
+        funds,
+        start_dt,
+        end_dt,
+        columns=columns,
+        dtype=dtype,
+        chunksize=chunksize,
+        monthly=monthly,
+    )
+
+    return (df.set_index("date") for df in chunks)
+
+
+@typechecked
+def get_panel(
+    field: str,
+    funds: Optional[Union[str, list]] = None,
+    start_dt: Optional[Union[str, datetime]] = None,
+    end_dt: Optional[Union[str, datetime]] = None,
+    manager: Optional[Storage] = None,
+    *,
+    dtype: str = "float64",
+) -> Optional[pd.DataFrame]:
+    """Query a single `field` as a wide (dates x funds) panel.
+
+    Equivalent to pivoting the output of `get_data`, but only `field` is fetched
+    and values are placed directly into a preallocated array (i.e. without a
+    generic `pivot`). Missing observations are `NaN`.
+
+    ...
+
+    Parameters
+    ----------
+    field : `str`
+        any numeric column, e.g. `nav` or `total_equity`
+    funds : `str` or `list`
+    start_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    end_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    dtype : `str`
+        float dtype of the panel, e.g. `float32` to halve its memory usage
+    """
+    if field not in PANEL_FIELDS:
+        raise ValueError(f"`field` must be one of {PANEL_FIELDS}")
+
+    if isinstance(funds, str):
+        funds = [funds]
+    if manager is None:
+        manager = get_default_manager()
+
+    df = manager.read_df(
+        funds,
+        start_dt,
+        end_dt,
+        columns=["date", "fund_cnpj", field],
+        dtype={field: dtype},
+    )
+    if df.empty:
+        return
+
+    date_idx, unique_dates = pd.factorize(df["date"], sort=True)
+    fund_idx, unique_funds = pd.factorize(df["fund_cnpj"], sort=True)
+
+    values = np.full((len(unique_dates), len(unique_funds)), np.nan, dtype=dtype)
+    values[date_idx, fund_idx] = df[field].values
+
+    return pd.DataFrame(
+        values,
+        index=pd.DatetimeIndex(unique_dates, name="date"),
+        columns=pd.Index(np.asarray(unique_funds), name="fund_cnpj"),
+    )
+
+
+@typechecked
+def get_snapshot(
+    as_of: Union[str, datetime],
+    funds: Optional[Union[str, list]] = None,
+    manager: Optional[Storage] = None,
+    *,
+    columns: Optional[list] = None,
+    dtype: Optional[dict] = None,
+    lookback: Optional[int] = SNAPSHOT_LOOKBACK_DAYS,
+) -> Optional[pd.DataFrame]:
+    """Query the latest observation of each fund as of a given date.
+
+    As funds report on different days, each fund's row is its last one dated
+    at or before `as_of`, as long as it is not older than `lookback` days. Rows
+    are resolved by the storage backend (see `Storage.read_snapshot`), i.e.
+    without reading every row in range. E.g. the latest nav of every fund is
+    `get_snapshot("2021-06-30", columns=["nav"])`.
+
+    Returns one row per fund, indexed by `fund_cnpj`, along with the `date` of
+    each observation.
+
+    ...
+
+    Parameters
+    ----------
+    as_of : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    funds : `str` or `list`
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    columns : `list`
+        columns to fetch (`date` and `fund_cnpj` are always included). Defaults
+        to all columns
+    dtype : `dict`
+        optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+    lookback : `int`
+        max age (in days) of observations. If None, will consider all history
+    """
+    if lookback is not None and lookback < 0:
+        raise ValueError("`lookback` must be >= 0")
+
+    if isinstance(funds, str):
+        funds = [funds]
+    if columns is not None:
+        columns = [
+            *API_INDEX_COLUMNS,
+            *(c for c in columns if c not in API_INDEX_COLUMNS),
+        ]
+    if manager is None:
+        manager = get_default_manager()
+
+    as_of = pd.to_datetime(as_of)
+    start_dt = as_of - pd.Timedelta(days=lookback) if lookback is not None else None
+
+    with metrics.timer("get_snapshot"):
+        df = manager.read_snapshot(as_of, funds, start_dt, columns=columns, dtype=dtype)
+    if df.empty:
+        return
+
+    return df.sort_values("fund_cnpj").set_index("fund_cnpj")
+
+
+@typechecked
+def get_aggregates(
+    freq: str = "monthly",
+    by: str = "fund_type",
+    keys: Optional[Union[str, list]] = None,
+    start_dt: Optional[Union[str, datetime]] = None,
+    end_dt: Optional[Union[str, datetime]] = None,
+    manager: Optional[Storage] = None,
+    *,
+    columns: Optional[list] = None,
+) -> Optional[pd.DataFrame]:
+    """Query precomputed monthly or yearly aggregates, per fund or `fund_type`.
+
+    Aggregates are maintained as data is downloaded (see `bzfunds.rollups`), so
+    querying them doesn't require scanning daily data. E.g. total equity per fund
+    type per month is `get_aggregates(columns=["total_equity_last"])`. Rows are
+    indexed by the start `date` of each period.
+
+    ...
+
+    Parameters
+    ----------
+    freq : `str`
+        either `monthly` or `yearly`
+    by : `str`
+        either `fund` or `fund_type`
+    keys : `str` or `list`
+        optional funds' CNPJ (if `by="fund"`) or fund types (if `by="fund_type"`)
+    start_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    end_dt : `str` or `datetime`
+        string must be in YYYY-MM-DD format
+    manager : `Storage`
+        loaded instance of database manager (or any other storage backend).
+        Defaults to `get_default_manager()`
+    columns : `list`
+        aggregates to fetch, e.g. `nav_last` (`date` and the key are always
+        included). Defaults to all aggregates
+    """
+    if freq not in FREQS:
+        raise ValueError(f"`freq` must be one of {FREQS}")
+    elif by not in LEVELS:
+        raise ValueError(f"`by` must be one of {tuple(LEVELS)}")
+
+    key = LEVELS[by]
+    if isinstance(keys, str):
+        keys = [keys]
+    if columns is not None:
+        columns = ["date", key, *(c for c in columns if c not in ("date", key))]
+    if manager is None:
+        manager = get_default_manager()
+
+    df = manager.read_rollup(
+        rollup_name(freq, by),
+        start_dt,
+        end_dt,
+        where={key: keys} if keys else None,
+        columns=columns,
+    )
+    if not df.empty:
+        return df.sort_values(["date", key]).set_index("date")
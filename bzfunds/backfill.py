@@ -0,0 +1,551 @@
+"""
+bzfunds.backfill
+~~~~~~~~~~~~~~~~
+
+Resumable (historical) backfills, tracked by a job ledger persisted by the
+storage backend.
+
+Each job downloads, parses and commits a single file, i.e. a month (or, for
+old-format dates, a whole year, which is published as a single archive). Jobs
+move thru `pending -> downloaded -> parsed -> committed`, parsing and committing
+files in chunks (of `settings.INGESTION_CHUNKSIZE` rows), and once committed are
+recorded along with the checksum (SHA-256) of their file and their # of rows. Jobs
+that fail are retried with exponential backoff before being marked `failed`,
+and files not found (or without any rows) are marked `empty`.
+
+Jobs already `committed` (or `empty`) are skipped by subsequent backfills, such
+that an interrupted backfill resumes where it stopped. Recent months (which may
+still be restated by CVM) are always downloaded again, but only parsed and
+committed if their file has changed since.
+
+Jobs can also be run by any # of worker processes (e.g. on several hosts)
+sharing the same storage backend: `enqueue` marks jobs as `queued`, and each
+`work`er atomically claims queued jobs thru leases (see `Storage.claim_job`),
+which are renewed while running. Jobs of crashed workers are taken over once
+their lease expires.
+"""
+
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+import requests
+from typeguard import typechecked
+
+from . import metrics, settings
+from .cache import DownloadCache
+from .constants import API_LAST_ZIPPED_DATE
+from .data import (
+    DEFAULT_MAX_PER_HOST,
+    DEFAULT_N_JOBS,
+    _effective_n_jobs,
+    _fetch_file,
+    _make_session,
+    _parse_stream,
+    _plan_jobs,
+    _select_zip_members,
+)
+from .rollups import update_rollups
+from .storage import Storage
+from .utils import get_url_from_date
+
+
+__all__ = ("backfill", "enqueue", "get_ledger", "work")
+
+
+logger = logging.getLogger(__name__)
+
+
+# Globals
+# ----
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+PARSED = "parsed"
+COMMITTED = "committed"
+EMPTY = "empty"
+FAILED = "failed"
+DONE_STATES = (COMMITTED, EMPTY)
+
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 2.0  # Seconds before the first retry, doubled at each retry
+MAX_BACKOFF = 300.0
+DEFAULT_LEASE = 600.0  # Seconds, renewed every third of it while running
+HASH_CHUNK_SIZE = 1024**2
+
+
+def job_name(date: datetime, full_year: bool) -> str:
+    """Return the ledger name of a job, e.g. `2021-01` or `2005` (i.e. a whole year)"""
+    return str(date.year) if full_year else date.strftime("%Y-%m")
+
+
+def _parse_job_name(name: str) -> Tuple[datetime, bool]:
+    """Return the (date, full_year) of a job from its ledger name (see `job_name`)"""
+    if len(name) == 4:
+        return datetime(int(name), 1, 1), True
+    return datetime.strptime(name, "%Y-%m"), False
+
+
+def _file_checksum(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+
+    return hasher.hexdigest()
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+@typechecked
+def backfill(
+    start_dt: datetime,
+    end_dt: datetime,
+    manager: Storage,
+    *,
+    n_jobs: int = DEFAULT_N_JOBS,
+    cache: Optional[DownloadCache] = None,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    incremental: bool = True,
+    rollups: bool = True,
+    force: bool = False,
+) -> pd.DataFrame:
+    """Download and commit all files from `start_dt` to `end_dt`, resuming from
+    the job ledger stored in `manager`
+
+    Jobs run concurrently on up to `n_jobs` threads, sharing a pool of HTTP
+    connections. Returns the ledger entries of all jobs in the range (see
+    `get_ledger`), and logs those which are `empty` or `failed`.
+
+    ...
+
+    Parameters
+    ----------
+    start_dt : `datetime`
+    end_dt : `datetime`
+    manager : `Storage`
+    n_jobs : `int`
+        max # of jobs run concurrently (negative values are relative to the # of CPUs)
+    cache : `DownloadCache`
+        if provided, raw files are downloaded thru (and stored in) the cache
+    retries : `int`
+        max # of retries of each job
+    backoff : `float`
+        seconds before the first retry of a job, doubled at each retry
+    incremental : `bool`
+        if True, will only write rows that are either new or differ from those
+        already stored in `manager` (see `Storage.update_df`)
+    rollups : `bool`
+        if True, will update `manager`'s rollups of all months committed
+    force : `bool`
+        if True, will run all jobs, even those already `committed`
+    """
+    jobs, ledger, pending = _plan_pending(start_dt, end_dt, manager, force)
+    logger.info(f"Running {len(pending)} of {len(jobs)} jobs")
+
+    n_jobs = _effective_n_jobs(n_jobs)
+    with TemporaryDirectory() as temp_dir, _make_session(
+        DEFAULT_MAX_PER_HOST, block=True
+    ) as session:
+        with ThreadPoolExecutor(n_jobs) as executor:
+            futures = [
+                executor.submit(
+                    _run_job,
+                    name,
+                    *job,
+                    manager=manager,
+                    previous=ledger.get(name, {}),
+                    temp_dir=temp_dir,
+                    cache=cache,
+                    session=session,
+                    retries=retries,
+                    backoff=backoff,
+                    incremental=incremental,
+                    rollups=rollups,
+                )
+                for name, job in pending.items()
+            ]
+            for future in futures:
+                future.result()
+
+    report = get_ledger(manager, list(jobs))
+    for state in (EMPTY, FAILED):
+        names = report.index[report["state"] == state].tolist()
+        if names:
+            logger.warning(f"{len(names)} jobs {state}: {', '.join(names)}")
+
+    return report
+
+
+def _plan_pending(
+    start_dt: datetime, end_dt: datetime, manager: Storage, force: bool
+) -> Tuple[Dict[str, tuple], Dict[str, dict], Dict[str, tuple]]:
+    """Return all jobs from `start_dt` to `end_dt`, their ledger entries, and
+    those to be run, which are marked `pending` unless already done
+    """
+    if start_dt >= end_dt:
+        raise ValueError("`start_dt` must be < `end_dt`")
+
+    jobs = {job_name(*job): job for job in _plan_jobs(start_dt, end_dt)}
+    ledger = manager.read_jobs(list(jobs))
+
+    # Recent months are always checked for restatements
+    recent = pd.Timestamp.today().to_period("M") - settings.UPDATE_LOOKBACK_MONTHS
+    pending = {
+        name: job
+        for name, job in jobs.items()
+        if force
+        or ledger.get(name, {}).get("state") not in DONE_STATES
+        or pd.Timestamp(job[0]).to_period("M") >= recent
+    }
+
+    for name, (date, full_year) in pending.items():
+        if ledger.get(name, {}).get("state") not in DONE_STATES:
+            manager.write_job(
+                name,
+                {
+                    "state": PENDING,
+                    "url": get_url_from_date(date, zipped=date <= API_LAST_ZIPPED_DATE),
+                    "updated_at": _now(),
+                },
+            )
+
+    return jobs, ledger, pending
+
+
+@typechecked
+def enqueue(
+    start_dt: datetime, end_dt: datetime, manager: Storage, *, force: bool = False
+) -> List[str]:
+    """Queue all jobs from `start_dt` to `end_dt` to be run by `work`ers, and
+    return their names
+
+    Jobs are selected as by `backfill`, i.e. those already `committed` (or
+    `empty`) are skipped, unless recent or `force=True`.
+
+    ...
+
+    Parameters
+    ----------
+    start_dt : `datetime`
+    end_dt : `datetime`
+    manager : `Storage`
+    force : `bool`
+        if True, will queue all jobs, even those already `committed`
+    """
+    _, _, pending = _plan_pending(start_dt, end_dt, manager, force)
+    for name in pending:
+        manager.write_job(name, {"queued": True})
+    logger.info(f"Queued {len(pending)} jobs")
+
+    return list(pending)
+
+
+@typechecked
+def work(
+    manager: Storage,
+    *,
+    names: Optional[list] = None,
+    worker: Optional[str] = None,
+    lease: float = DEFAULT_LEASE,
+    n_jobs: int = 1,
+    cache: Optional[DownloadCache] = None,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    incremental: bool = True,
+    rollups: bool = True,
+) -> List[str]:
+    """Claim and run queued jobs (see `enqueue`) until none is left, and return
+    the names of those run
+
+    Any # of workers (i.e. processes, on any host) can share the same queue,
+    i.e. `manager`'s job ledger. Each job is leased by a single worker at a
+    time, and its lease is renewed while it runs, such that jobs of crashed
+    workers are taken over by others once their lease expires. Jobs are
+    dequeued once run, even if `failed` (i.e. they must be queued again).
+
+    ...
+
+    Parameters
+    ----------
+    manager : `Storage`
+    names : `list`
+        if provided, will only claim jobs of `names`
+    worker : `str`
+        unique worker id. Defaults to `<hostname>:<pid>`
+    lease : `float`
+        seconds a claimed job is leased for (before other workers can take it over)
+    n_jobs : `int`
+        max # of jobs run concurrently by this worker (i.e. threads)
+    cache : `DownloadCache`
+        if provided, raw files are downloaded thru (and stored in) the cache
+    retries : `int`
+        max # of retries of each job
+    backoff : `float`
+        seconds before the first retry of a job, doubled at each retry
+    incremental : `bool`
+        if True, will only write rows that are either new or differ from those
+        already stored in `manager` (see `Storage.update_df`)
+    rollups : `bool`
+        if True, will update `manager`'s rollups of all months committed
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    n_jobs = _effective_n_jobs(n_jobs)
+
+    held = set()
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def heartbeat():
+        while not stop.wait(lease / 3):
+            with lock:
+                running = list(held)
+            for name in running:
+                if not manager.renew_lease(name, worker, lease):
+                    with lock:
+                        lost = name in held  # i.e. not just released
+                    if lost:
+                        logger.warning(f"Job {name} - lease lost to another worker")
+
+    def run_jobs(temp_dir: str, session: requests.Session) -> List[str]:
+        done = []
+        while not stop.is_set():
+            claimed = manager.claim_job(names, worker, lease)
+            if claimed is None:
+                break
+
+            name, previous = claimed
+            with lock:
+                held.add(name)
+            try:
+                _run_job(
+                    name,
+                    *_parse_job_name(name),
+                    manager=manager,
+                    previous=previous,
+                    temp_dir=temp_dir,
+                    cache=cache,
+                    session=session,
+                    retries=retries,
+                    backoff=backoff,
+                    incremental=incremental,
+                    rollups=rollups,
+                )
+            finally:
+                with lock:
+                    held.discard(name)
+                manager.write_job(
+                    name, {"queued": False, "worker": None, "lease_until": None}
+                )
+            metrics.incr("jobs_run")
+            done.append(name)
+
+        return done
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        with TemporaryDirectory() as temp_dir, _make_session(
+            DEFAULT_MAX_PER_HOST, block=True
+        ) as session:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                futures = [
+                    executor.submit(run_jobs, temp_dir, session) for _ in range(n_jobs)
+                ]
+                done = [name for future in futures for name in future.result()]
+    finally:
+        stop.set()
+        heartbeat_thread.join()
+
+    logger.info(f"Worker {worker} ran {len(done)} jobs")
+
+    return sorted(done)
+
+
+def _run_job(
+    name: str,
+    date: datetime,
+    full_year: bool,
+    *,
+    manager: Storage,
+    previous: dict,
+    retries: int,
+    backoff: float,
+    **kwargs,
+):
+    """Run a single job, retrying on failures (never raises)"""
+    for attempt in range(retries + 1):
+        try:
+            _process_file(
+                name, date, full_year, manager=manager, previous=previous, **kwargs
+            )
+            return
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                logger.warning(f"Job {name} - file not found")
+                manager.write_job(
+                    name, {"state": EMPTY, "rows": 0, "updated_at": _now()}
+                )
+                return
+            error = e
+        except Exception as e:
+            error = e
+
+        failed = attempt == retries
+        manager.write_job(
+            name,
+            {
+                "state": FAILED if failed else PENDING,
+                "attempts": attempt + 1,
+                "error": f"{type(error).__name__}: {error}",
+                "updated_at": _now(),
+            },
+        )
+        metrics.incr("jobs_failed" if failed else "jobs_retried")
+        if failed:
+            logger.error(f"Job {name} failed after {attempt + 1} attempts - {error}")
+        else:
+            delay = min(backoff * 2**attempt, MAX_BACKOFF)
+            logger.warning(f"Job {name} failed - retrying in {delay:.0f}s ({error})")
+            time.sleep(delay)
+
+
+def _process_file(
+    name: str,
+    date: datetime,
+    full_year: bool,
+    *,
+    manager: Storage,
+    previous: dict,
+    temp_dir: str,
+    cache: Optional[DownloadCache],
+    session: requests.Session,
+    incremental: bool,
+    rollups: bool,
+):
+    """Download, parse and commit a single job's file, recording each stage"""
+    zipped = date <= API_LAST_ZIPPED_DATE
+    url = get_url_from_date(date, zipped=zipped)
+    path = _fetch_file(
+        url, temp_dir=temp_dir, cache=cache, session=session, immutable=zipped
+    )
+    try:
+        checksum = _file_checksum(path)
+        if (
+            previous.get("state") in DONE_STATES
+            and previous.get("checksum") == checksum
+        ):
+            logger.debug(f"Job {name} - file unchanged")
+            manager.write_job(name, {"state": previous["state"], "updated_at": _now()})
+            return
+
+        # Only recorded once committed, i.e. an interrupted job is never skipped
+        manager.write_job(
+            name,
+            {"state": DOWNLOADED, "size": os.path.getsize(path), "updated_at": _now()},
+        )
+
+        # Archives are parsed (and committed) one member at a time
+        if zipped:
+            with zipfile.ZipFile(path) as archive:
+                members = _select_zip_members(archive, date, full_year)
+        else:
+            members = [None]
+
+        rows = 0
+        counts = {}
+        months = set()
+        for member in members:
+            for df in _iter_file(path, member, None if full_year else date.month):
+                if df.empty:
+                    continue
+
+                rows += len(df)
+                manager.write_job(
+                    name, {"state": PARSED, "rows": rows, "updated_at": _now()}
+                )
+
+                df = df.reset_index()
+                with metrics.timer("write"):
+                    res = manager.update_df(df) if incremental else manager.write_df(df)
+                for k, v in res.items():
+                    counts[k] = counts.get(k, 0) + v
+                if any(res.get(k) for k in ("inserted", "upserted", "modified")):
+                    months.update(df["date"].dt.to_period("M").unique())
+
+        if rollups and months:
+            with metrics.timer("rollups"):
+                update_rollups(manager, [month.start_time for month in months])
+
+        manager.write_job(
+            name,
+            {
+                "state": COMMITTED if rows else EMPTY,
+                "checksum": checksum,
+                "rows": rows,
+                "written": counts,
+                "error": None,
+                "updated_at": _now(),
+            },
+        )
+    finally:
+        if cache is None:
+            os.remove(path)
+
+
+def _iter_file(
+    path: str, member: Optional[str], month: Optional[int]
+) -> Iterator[pd.DataFrame]:
+    """Parse a downloaded `csv` file, or a `member` of a downloaded `zip` archive,
+    in chunks of up to `settings.INGESTION_CHUNKSIZE` rows (only of `month`, if provided)
+    """
+    with ExitStack() as stack:
+        fp = path
+        if member is not None:
+            archive = stack.enter_context(zipfile.ZipFile(path))
+            fp = stack.enter_context(archive.open(member))
+
+        for df in _parse_stream(fp, settings.INGESTION_CHUNKSIZE):
+            yield df if month is None else df.loc[df.index.month == month]
+
+
+@typechecked
+def get_ledger(manager: Storage, names: Optional[list] = None) -> pd.DataFrame:
+    """Return the job ledger stored in `manager` as a `DataFrame` indexed by job name
+
+    ...
+
+    Parameters
+    ----------
+    manager : `Storage`
+    names : `list`
+        optional job names, e.g. `["2005", "2021-01"]`. Defaults to all jobs
+    """
+    jobs = manager.read_jobs(names)
+    columns = [
+        "state",
+        "rows",
+        "attempts",
+        "error",
+        "checksum",
+        "url",
+        "queued",
+        "worker",
+        "updated_at",
+    ]
+    df = pd.DataFrame.from_dict(jobs, orient="index").reindex(columns=columns)
+    df.index.name = "job"
+
+    return df.sort_index()
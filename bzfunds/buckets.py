@@ -0,0 +1,167 @@
+"""
+bzfunds.buckets
+~~~~~~~~~~~~~~~
+
+Bucketed document layout, i.e. a single document per fund per month holding
+parallel arrays of its daily rows, e.g.:
+
+    {
+        "fund_cnpj": 13001211000190,
+        "month": datetime(2021, 1, 1),
+        "date": [datetime(2021, 1, 4), datetime(2021, 1, 5), ...],
+        "nav": [1.0213, 1.0215, ...],
+        ...
+        "checksum": [...],
+    }
+
+Arrays are sorted by `date`. Buckets are built and merged (i.e. rows inserted
+or replaced) on the client side, and unbucketed back into rows when read (see
+`bzfunds.dbm.Manager`).
+"""
+
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .constants import CHECKSUM_COLUMN
+
+
+__all__ = ("buckets_to_df", "iter_buckets", "merge_bucket", "month_start")
+
+
+# Globals
+# ----
+BUCKET_KEYS = ("fund_cnpj", "month")
+
+
+def month_start(dt: Union[str, datetime]) -> datetime:
+    """Return the `month` of the bucket holding date `dt`"""
+    return pd.Timestamp(dt).to_period("M").start_time.to_pydatetime()
+
+
+def iter_buckets(
+    df: pd.DataFrame, batch_size: int
+) -> Iterator[List[Tuple[Tuple[int, datetime], Dict[str, list]]]]:
+    """Split rows into buckets, yielding batches of ((`fund_cnpj`, `month`), rows)
+    pairs of about `batch_size` rows, where rows are (column -> values) lists
+    sorted by `date`
+
+    `df` must have `fund_cnpj` as (integer) ids, and values are converted into
+    native types (e.g. `datetime` rather than `np.datetime64`).
+    """
+    months = df["date"].dt.to_period("M").dt.start_time
+    df = df.assign(month=months).sort_values(
+        ["month", "fund_cnpj", "date"], kind="stable", ignore_index=True
+    )
+
+    keys = list(zip(df["fund_cnpj"].tolist(), df["month"].dt.to_pydatetime()))
+    values = {
+        c: (
+            list(df[c].dt.to_pydatetime())
+            if c == "date"
+            else df[c].astype(object).where(df[c].notna(), None).tolist()
+        )
+        for c in df.columns
+        if c not in BUCKET_KEYS
+    }
+
+    # Start of each bucket's rows
+    starts = np.flatnonzero(
+        np.r_[True, (df["fund_cnpj"].values[1:] != df["fund_cnpj"].values[:-1])]
+        | np.r_[True, (df["month"].values[1:] != df["month"].values[:-1])]
+    )
+    bounds = np.r_[starts, len(df)]
+
+    batch, n_rows = [], 0
+    for i, j in zip(bounds[:-1], bounds[1:]):
+        batch.append((keys[i], {c: v[i:j] for c, v in values.items()}))
+        n_rows += j - i
+        if n_rows >= batch_size:
+            yield batch
+            batch, n_rows = [], 0
+    if batch:
+        yield batch
+
+
+def merge_bucket(
+    doc: Optional[dict], rows: Dict[str, list], upsert: bool
+) -> Tuple[Optional[dict], Counter]:
+    """Merge `rows` (of a single bucket) into its stored bucket `doc`, if any
+
+    Rows whose `date` is already in `doc` are skipped, unless `upsert=True`, in
+    which case they are replaced if their `CHECKSUM_COLUMN` differs. Returns
+    the merged bucket (or None if unchanged) along with the # of rows
+    `inserted`, `upserted`, `modified` and `skipped`.
+    """
+    counts = Counter()
+    if doc is None:
+        counts["upserted" if upsert else "inserted"] += len(rows["date"])
+        return {**rows, "n": len(rows["date"])}, counts
+
+    columns = [c for c in {**doc, **rows} if c not in ("_id", "n", *BUCKET_KEYS)]
+    stored = {
+        d: {c: (doc.get(c) or [None] * len(doc["date"]))[i] for c in columns}
+        for i, d in enumerate(doc["date"])
+    }
+
+    changed = False
+    for i, d in enumerate(rows["date"]):
+        row = {c: rows[c][i] if c in rows else None for c in columns}
+        if d not in stored:
+            counts["upserted" if upsert else "inserted"] += 1
+        elif not upsert:
+            counts["skipped"] += 1
+            continue
+        elif stored[d].get(CHECKSUM_COLUMN) != row.get(CHECKSUM_COLUMN):
+            counts["modified"] += 1
+        else:
+            continue
+        stored[d] = row
+        changed = True
+
+    if not changed:
+        return None, counts
+
+    dates = sorted(stored)
+    merged = {c: [stored[d][c] for d in dates] for c in columns}
+
+    return {**merged, "n": len(dates)}, counts
+
+
+def buckets_to_df(
+    docs: Iterable[dict],
+    columns: Sequence[str],
+    dtype: Dict[str, str],
+    start_dt: Optional[Union[str, datetime]] = None,
+    end_dt: Optional[Union[str, datetime]] = None,
+) -> pd.DataFrame:
+    """Unbucket `docs` into a `DataFrame` of their rows dated from `start_dt` to
+    `end_dt` (as buckets span whole months)
+    """
+    values = {c: [] for c in {*columns, "date"}}
+    for doc in docs:
+        n_rows = len(doc["date"])
+        for c in values:
+            if c in BUCKET_KEYS:
+                values[c].extend([doc[c]] * n_rows)
+            else:
+                values[c].extend(doc.get(c) or [None] * n_rows)
+
+    df = pd.DataFrame(
+        {c: pd.Series(values[c], dtype=dtype.get(c)) for c in values},
+        columns=list(values),
+    )
+    if df.empty:
+        return df.reindex(columns=columns)
+
+    df["date"] = pd.to_datetime(df["date"])
+    mask = np.ones(len(df), dtype=bool)
+    if start_dt:
+        mask &= (df["date"] >= pd.to_datetime(start_dt)).values
+    if end_dt:
+        mask &= (df["date"] <= pd.to_datetime(end_dt)).values
+
+    return df.loc[mask, list(columns)].reset_index(drop=True)
@@ -0,0 +1,556 @@
+"""
+bzfunds.cache
+~~~~~~~~~~~~~
+
+Caches for raw files downloaded from CVM's endpoint (`DownloadCache`) and for
+query results (`QueryCache`).
+
+Files are stored by the SHA-256 of their contents (so identical files are only
+stored once) and indexed by the SHA-256 of their `url`. Each index entry
+records the `ETag`/`Last-Modified` validators returned by the server, which are
+sent back as `If-None-Match`/`If-Modified-Since` on subsequent requests, such
+that unchanged files cost a single `304 Not Modified` round trip.
+
+Query results are cached in memory (and optionally on disk), and invalidated
+per month whenever a storage backend writes rows dated within that month.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from itertools import count
+from tempfile import NamedTemporaryFile
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Hashable,
+    Iterable,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+
+from . import metrics
+
+
+if TYPE_CHECKING:
+    # Only imported on first download (i.e. not by `bzfunds.api`), as it is slow
+    import requests
+
+
+__all__ = ("DownloadCache", "QueryCache")
+
+
+logger = logging.getLogger(__name__)
+
+
+# Globals
+# ----
+CHUNK_SIZE = 1024**2
+DEFAULT_MAX_SIZE = 10 * 1024**3
+DEFAULT_QUERY_MAX_SIZE = 512 * 1024**2
+DEFAULT_QUERY_MAX_ENTRIES = 1024
+DEFAULT_QUERY_TTL = 300.0  # Seconds, only without a `path`
+
+
+class DownloadCache:
+    """Content-addressed cache of raw downloads with conditional revalidation
+
+    ...
+
+    Parameters
+    ----------
+    path : `str`
+        root directory of the cache (created if missing)
+    max_size : `int`
+        max # of bytes stored. Least recently used files are evicted first
+    session : `requests.Session`
+        optional session used for all requests (a new one is created on first use otherwise)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+        *,
+        session: Optional["requests.Session"] = None,
+    ):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.max_size = max_size
+        self.session = session
+
+        self._lock = threading.Lock()
+        self._index_dir = os.path.join(self.path, "index")
+        self._objects_dir = os.path.join(self.path, "objects")
+        os.makedirs(self._index_dir, exist_ok=True)
+        os.makedirs(self._objects_dir, exist_ok=True)
+
+    def _entry_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self._index_dir, f"{key}.json")
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self._objects_dir, digest)
+
+    def get_entry(self, url: str) -> Optional[dict]:
+        """Return the index entry for `url`, if its file is still cached"""
+        try:
+            with open(self._entry_path(url)) as fp:
+                entry = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+
+        if os.path.exists(self._object_path(entry["digest"])):
+            return entry
+
+    def fetch(
+        self,
+        url: str,
+        *,
+        immutable: bool = False,
+        session: Optional["requests.Session"] = None,
+    ) -> str:
+        """Return the path to a local copy of `url`, downloading it if required
+
+        Cached files are revalidated with a conditional request, unless
+        `immutable=True`, in which case any cached copy is returned as is
+        (e.g. for historical archives, which are no longer updated). Requests
+        are sent thru `session` if provided, or the cache's own session otherwise.
+
+        Raises the same `requests.exceptions` as `requests.get`.
+        """
+        entry = self.get_entry(url)
+        if entry is not None and immutable:
+            metrics.incr("download_cache_hits")
+            return self._touch(url, entry)
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        if session is None:
+            import requests
+
+            with self._lock:
+                if self.session is None:
+                    self.session = requests.Session()
+            session = self.session
+
+        with session.get(url, headers=headers, stream=True) as res:
+            if entry is not None and res.status_code == 304:
+                logger.debug(f"Cache hit - {url}")
+                metrics.incr("download_cache_hits")
+                return self._touch(url, entry)
+
+            res.raise_for_status()
+            logger.debug(f"Cache miss - {url}")
+            metrics.incr("download_cache_misses")
+            entry = {
+                "url": url,
+                "etag": res.headers.get("ETag"),
+                "last_modified": res.headers.get("Last-Modified"),
+            }
+            entry.update(self._store(res))
+
+        with open(self._entry_path(url), "w") as fp:
+            json.dump(entry, fp)
+        self._touch(url, entry)
+        self.evict(keep=url)
+
+        return self._object_path(entry["digest"])
+
+    def _store(self, res: "requests.Response") -> dict:
+        """Stream `res`'s body into the cache and return its digest and size"""
+        hasher = hashlib.sha256()
+        size = 0
+        with NamedTemporaryFile(dir=self._objects_dir, delete=False) as fp:
+            try:
+                for chunk in res.iter_content(chunk_size=CHUNK_SIZE):
+                    hasher.update(chunk)
+                    fp.write(chunk)
+                    size += len(chunk)
+            except BaseException:
+                fp.close()
+                os.remove(fp.name)
+                raise
+
+        digest = hasher.hexdigest()
+        os.replace(fp.name, self._object_path(digest))
+        metrics.incr("download_bytes", size)
+
+        return {"digest": digest, "size": size}
+
+    def _touch(self, url: str, entry: dict) -> str:
+        """Mark `entry` as recently used and return its file's path"""
+        # Explicit timestamps, as the filesystem's own clock may be too coarse
+        now = time.time_ns()
+        try:
+            os.utime(self._entry_path(url), ns=(now, now))
+        except FileNotFoundError:
+            pass
+
+        return self._object_path(entry["digest"])
+
+    def evict(self, keep: Optional[str] = None):
+        """Remove least recently used files until the cache fits `max_size`
+
+        The entry for `url=keep`, if provided, is never evicted.
+        """
+        keep_path = self._entry_path(keep) if keep else None
+        with self._lock:
+            entries = []
+            for name in os.listdir(self._index_dir):
+                path = os.path.join(self._index_dir, name)
+                try:
+                    with open(path) as fp:
+                        entry = json.load(fp)
+                    entries.append((os.stat(path).st_mtime_ns, path, entry))
+                except (FileNotFoundError, json.JSONDecodeError):
+                    continue
+
+            # Objects may be shared by multiple `url`'s
+            sizes = {e["digest"]: e["size"] for *_, e in entries}
+            refs = {}
+            for *_, e in entries:
+                refs[e["digest"]] = refs.get(e["digest"], 0) + 1
+
+            total = sum(sizes.values())
+            for _, path, entry in sorted(entries, key=lambda x: x[0]):
+                if total <= self.max_size:
+                    break
+                elif path == keep_path:
+                    continue
+                os.remove(path)
+                refs[entry["digest"]] -= 1
+                if not refs[entry["digest"]]:
+                    total -= sizes[entry["digest"]]
+                    try:
+                        os.remove(self._object_path(entry["digest"]))
+                    except FileNotFoundError:
+                        pass
+                logger.debug(f"Evicted {entry['url']}")
+
+    def clear(self):
+        """Remove all cached files"""
+        with self._lock:
+            for directory in (self._index_dir, self._objects_dir):
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+
+
+def _month(date: Union[str, datetime]) -> int:
+    """Return a (monotonic) integer id of `date`'s month"""
+    date = pd.Timestamp(date)
+    return date.year * 12 + date.month - 1
+
+
+class QueryCache:
+    """LRU cache of query results, invalidated per month on writes
+
+    Results are keyed on the normalized query (see `make_key`) and held in
+    memory up to `max_size` bytes / `max_entries` results. If a `path` is
+    provided, results are also persisted there, such that they outlive the
+    process (e.g. across dashboard restarts).
+
+    Storage backends call `invalidate` with the dates of every row they write,
+    which evicts all results whose date range overlaps any of those months.
+    On disk, each invalidated month is also marked with a timestamp, so results
+    (whether persisted or held in memory) are never served if read before such
+    a month was last invalidated by any process sharing the same `path`. Without
+    a `path`, writes by other processes (e.g. a separate `download_data` run)
+    can't be detected, so results also expire `ttl` seconds after being read.
+    Note that results are shared with the cache, i.e. must not be modified in
+    place.
+
+    ...
+
+    Parameters
+    ----------
+    max_size : `int`
+        max # of bytes held in memory
+    max_entries : `int`
+        max # of results held in memory
+    path : `str`
+        optional root directory to persist results (created if missing)
+    max_disk_size : `int`
+        max # of bytes stored in `path`. Least recently used results are evicted first
+    ttl : `float`
+        seconds after which results expire if no `path` is provided (`None` for never)
+    """
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_QUERY_MAX_SIZE,
+        *,
+        max_entries: int = DEFAULT_QUERY_MAX_ENTRIES,
+        path: Optional[str] = None,
+        max_disk_size: int = DEFAULT_MAX_SIZE,
+        ttl: Optional[float] = DEFAULT_QUERY_TTL,
+    ):
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_size
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+
+        # Each invalidation gets a sequence #, such that results read while a
+        # month was being written (i.e. possibly stale) are never stored
+        self._seq = count(1)
+        self._last_seq = 0
+        self._invalidated = {}
+
+        self.path = None
+        if path is not None:
+            self.path = os.path.abspath(os.path.expanduser(path))
+            self._results_dir = os.path.join(self.path, "results")
+            self._months_dir = os.path.join(self.path, "months")
+            self._generation_path = os.path.join(self.path, "generation")
+            os.makedirs(self._results_dir, exist_ok=True)
+            os.makedirs(self._months_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+    ) -> Tuple[Hashable, ...]:
+        """Return a normalized (hashable) key of a query
+
+        The first 3 items are always the `funds`, `start_dt` and `end_dt`.
+        """
+        return (
+            tuple(sorted(set(funds))) if funds else None,
+            pd.Timestamp(start_dt).isoformat() if start_dt else None,
+            pd.Timestamp(end_dt).isoformat() if end_dt else None,
+            tuple(columns) if columns else None,
+            tuple(sorted((k, str(v)) for k, v in dtype.items())) if dtype else None,
+        )
+
+    @staticmethod
+    def _months(key: Tuple[Hashable, ...]) -> Tuple[float, float]:
+        """Return the (inclusive) range of months spanned by `key`"""
+        _, start_dt, end_dt, *_ = key
+        lo = _month(start_dt) if start_dt else float("-inf")
+        hi = _month(end_dt) if end_dt else float("inf")
+
+        return lo, hi
+
+    def snapshot(self) -> Tuple[int, int]:
+        """Return a token to be taken *before* reading a result to `put`"""
+        with self._lock:
+            return self._last_seq, time.time_ns()
+
+    def get(self, key: Tuple[Hashable, ...]) -> Optional[pd.DataFrame]:
+        """Return the cached result of `key`, if any"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+        if entry is not None:
+            df, _, started_ns = entry
+            if self.path is None:
+                if self.ttl is None or time.time_ns() - started_ns < self.ttl * 1e9:
+                    return df
+            elif not self._is_stale(key, started_ns):
+                return df
+
+            # Expired, or invalidated by another process sharing `path`
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._size -= self._entries.pop(key)[1]
+            if self.path is not None:
+                self._remove(self._result_path(key))
+            return
+
+        if self.path is not None:
+            seq, _ = self.snapshot()
+            loaded = self._load(key)
+            if loaded is not None:
+                df, started_ns = loaded
+                self.put(key, df, (seq, started_ns), persist=False)
+                return df
+
+    def put(
+        self,
+        key: Tuple[Hashable, ...],
+        df: pd.DataFrame,
+        token: Tuple[int, int],
+        *,
+        persist: bool = True,
+    ):
+        """Cache `df` as the result of `key`, read after `token = snapshot()`
+
+        Nothing is stored if any month spanned by `key` was invalidated since.
+        """
+        lo, hi = self._months(key)
+        seq, started_ns = token
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self._lock:
+            if any(
+                lo <= month <= hi and last > seq
+                for month, last in self._invalidated.items()
+            ):
+                return
+            elif size > self.max_size:
+                return
+
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            self._entries[key] = (df, size, started_ns)
+            self._size += size
+            while self._size > self.max_size or len(self._entries) > self.max_entries:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+        if persist and self.path is not None:
+            self._dump(key, df, started_ns)
+
+    def invalidate(self, dates: Iterable[Union[str, datetime]]):
+        """Evict all results spanning any month of `dates` (e.g. just written)"""
+        dates = pd.DatetimeIndex(pd.to_datetime(pd.Series(dates)).dropna())
+        months = set(map(int, (dates.year * 12 + dates.month - 1).unique()))
+        if not months:
+            return
+
+        with self._lock:
+            seq = next(self._seq)
+            self._last_seq = seq
+            for month in months:
+                self._invalidated[month] = seq
+            for key in list(self._entries):
+                lo, hi = self._months(key)
+                if any(lo <= month <= hi for month in months):
+                    self._size -= self._entries.pop(key)[1]
+
+        if self.path is not None:
+            now = time.time_ns()
+            for month in months:
+                marker = os.path.join(self._months_dir, str(month))
+                open(marker, "a").close()
+                os.utime(marker, ns=(now, now))
+            open(self._generation_path, "a").close()
+            os.utime(self._generation_path, ns=(now, now))
+            for name in os.listdir(self._results_dir):
+                lo, hi = self._range_from_name(name)
+                if any(lo <= month <= hi for month in months):
+                    self._remove(os.path.join(self._results_dir, name))
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+        if self.path is not None:
+            for name in os.listdir(self._results_dir):
+                self._remove(os.path.join(self._results_dir, name))
+
+    def _result_path(self, key: Tuple[Hashable, ...]) -> str:
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        lo, hi = ("" if abs(m) == float("inf") else str(m) for m in self._months(key))
+
+        return os.path.join(self._results_dir, f"{lo}_{hi}_{digest}.pkl")
+
+    @staticmethod
+    def _range_from_name(name: str) -> Tuple[float, float]:
+        lo, hi, _ = name.split("_", 2)
+
+        return (
+            int(lo) if lo else float("-inf"),
+            int(hi) if hi else float("inf"),
+        )
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _is_stale(self, key: Tuple[Hashable, ...], started_ns: int) -> bool:
+        """Return whether any month spanned by `key` was invalidated (by any
+        process sharing `path`) since `started_ns`
+        """
+        # Nothing was invalidated since if the last invalidation is older
+        try:
+            if os.stat(self._generation_path).st_mtime_ns < started_ns:
+                return False
+        except FileNotFoundError:
+            return False
+
+        lo, hi = self._months(key)
+        for name in os.listdir(self._months_dir):
+            marker = os.path.join(self._months_dir, name)
+            try:
+                if lo <= int(name) <= hi and os.stat(marker).st_mtime_ns >= started_ns:
+                    return True
+            except FileNotFoundError:
+                continue
+
+        return False
+
+    def _load(self, key: Tuple[Hashable, ...]) -> Optional[Tuple[pd.DataFrame, int]]:
+        """Return a persisted result, along with the time its query started,
+        unless any of its months was invalidated since
+        """
+        path = self._result_path(key)
+        try:
+            with open(path, "rb") as fp:
+                started_ns, df = pickle.load(fp)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return
+
+        if self._is_stale(key, started_ns):
+            self._remove(path)
+            return
+
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            pass
+
+        return df, started_ns
+
+    def _dump(self, key: Tuple[Hashable, ...], df: pd.DataFrame, started_ns: int):
+        """Persist a result, along with the time its query started"""
+        with NamedTemporaryFile(dir=self._results_dir, delete=False) as fp:
+            pickle.dump((started_ns, df), fp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(fp.name, self._result_path(key))
+
+        # Evict least recently used results
+        with self._lock:
+            results = []
+            for name in os.listdir(self._results_dir):
+                path = os.path.join(self._results_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                results.append((stat.st_mtime_ns, stat.st_size, path))
+
+            total = sum(size for _, size, _ in results)
+            for _, size, path in sorted(results):
+                if total <= self.max_disk_size:
+                    break
+                self._remove(path)
+                total -= size
@@ -40,3 +40,30 @@ API_COLUMNS_MAP = {
     "RESG_DIA": "redemptions",
     "NR_COTST": "n_shareholders",
 }
+
+# Columns renamed by CVM over time, mapped to their original names
+API_COLUMNS_ALIASES = {
+    "TP_FUNDO_CLASSE": "TP_FUNDO",
+    "CNPJ_FUNDO_CLASSE": "CNPJ_FUNDO",
+}
+
+# Explicit dtypes used when parsing raw files (`DT_COMPTC` is parsed as dates).
+# `NR_COTST` is kept as `float64` (i.e. even without missing values), so that
+# every file (and chunk) is parsed into the same dtypes
+API_COLUMNS_DTYPES = {
+    "TP_FUNDO": "category",
+    "CNPJ_FUNDO": "category",
+    "VL_TOTAL": "float64",
+    "VL_QUOTA": "float64",
+    "VL_PATRIM_LIQ": "float64",
+    "CAPTC_DIA": "float64",
+    "RESG_DIA": "float64",
+    "NR_COTST": "float64",
+}
+
+# Fields uniquely identifying each stored row
+API_INDEX_COLUMNS = ("date", "fund_cnpj")
+
+# Each stored row also holds a fingerprint of its values (see `utils.hash_rows`),
+# used to only write rows that are new or restated by CVM
+CHECKSUM_COLUMN = "checksum"
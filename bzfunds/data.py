@@ -14,80 +14,214 @@ daily funds database_.
 .. _database: http://dados.cvm.gov.br/dataset/fi-doc-inf_diario
 """
 
-import glob
+import asyncio
+import logging
 import os
 import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
-from io import StringIO
-from tempfile import TemporaryDirectory
-from typing import Optional
+from functools import partial
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile, TemporaryDirectory
+from typing import Any, BinaryIO, Coroutine, Iterable, Iterator, List, Optional, Tuple
 
 import pandas as pd
 import requests
-from joblib import Parallel, delayed
+import urllib3
 from typeguard import typechecked
 
-from .constants import API_FIRST_VALID_DATE, API_LAST_ZIPPED_DATE
-from .dbm import Manager
-from .utils import get_url_from_date, parse_csv
+from . import metrics
+from .cache import DownloadCache
+from .constants import API_DATE_FORMAT, API_FIRST_VALID_DATE, API_LAST_ZIPPED_DATE
+from .rollups import update_rollups
+from .storage import Storage
+from .utils import get_url_from_date, iter_csv, parse_csv
 
 
 __all__ = ("get_monthly_data", "get_history")
 
 
+logger = logging.getLogger(__name__)
+
+
 # Globals
 # ----
-FILENAME = "temp.zip"
+SPOOL_MAX_SIZE = 64 * 1024**2  # Larger downloads are spooled to disk
 TOMORROW = datetime.today() + pd.Timedelta("1d")
+DEFAULT_N_JOBS = -2
+DEFAULT_MAX_PER_HOST = 8
+DEFAULT_QUEUE_SIZE = 4
+
+
+@contextmanager
+def _open_url(
+    url: str,
+    *,
+    cache: Optional[DownloadCache] = None,
+    immutable: bool = False,
+    seekable: bool = False,
+    session: Optional[requests.Session] = None,
+) -> Iterator[BinaryIO]:
+    """Open `url` for (binary) reading, either directly or through `cache`
+
+    Without a `cache`, the response body is streamed directly off the socket,
+    unless `seekable=True`, in which case it's first spooled in memory up to
+    `SPOOL_MAX_SIZE` bytes (and to disk beyond that), such that the connection is
+    released before the body is read. Requests are sent thru `session` if
+    provided. Raises the same `requests.exceptions` as `requests.get`,
+    including for errors while reading the body (e.g. a dropped connection).
+    """
+    if cache is not None:
+        with metrics.timer("download"):
+            path = cache.fetch(url, immutable=immutable, session=session)
+        with open(path, "rb") as fp:
+            yield fp
+        return
+
+    get = session.get if session is not None else requests.get
+    with metrics.timer("download"):
+        res = get(url, stream=True)
+    with res:
+        try:
+            res.raise_for_status()
+            res.raw.decode_content = True  # Handle gzip'ed transfers
+            if not seekable:
+                # Streamed (i.e. downloaded while parsed)
+                yield res.raw
+                return
+
+            fp = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            try:
+                with metrics.timer("download"):
+                    shutil.copyfileobj(res.raw, fp)
+            except BaseException:
+                fp.close()
+                raise
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e, response=res) from e
+        except urllib3.exceptions.HTTPError as e:
+            # i.e. raised by `res.raw` while streamed, which `requests` doesn't wrap
+            raise requests.exceptions.ConnectionError(e, response=res) from e
+        finally:
+            metrics.incr("download_bytes", res.raw.tell())
+
+    with fp:
+        fp.seek(0)
+        yield fp
+
+
+def _parse_stream(fp, chunksize: Optional[int]) -> Iterator[pd.DataFrame]:
+    """Parse an open `csv` stream, in chunks of `chunksize` rows if provided"""
+    if not chunksize:
+        with metrics.timer("parse"):
+            df = parse_csv(fp)
+        metrics.incr("rows_parsed", len(df))
+        yield df
+        return
+
+    frames = iter_csv(fp, chunksize=chunksize)
+    while True:
+        # Includes reading (i.e. downloading, decompressing) streams
+        with metrics.timer("parse"):
+            df = next(frames, None)
+        if df is None:
+            return
+
+        metrics.incr("rows_parsed", len(df))
+        yield df
 
 
 @typechecked
-def _handle_csv_request(date: datetime) -> Optional[pd.DataFrame]:
-    """Takes a `date`, requests a monthly `csv` file and return a parsed `DataFrame`"""
+def _handle_csv_request(
+    date: datetime,
+    chunksize: Optional[int] = None,
+    cache: Optional[DownloadCache] = None,
+    session: Optional[requests.Session] = None,
+) -> Iterator[pd.DataFrame]:
+    """Takes a `date`, requests a monthly `csv` file and yield parsed `DataFrame`'s
+
+    The response body is parsed directly off the socket (or `cache`) as it
+    arrives (i.e. it is never fully buffered/decoded in memory). If `chunksize`
+    is provided, will yield `DataFrame`'s of up to `chunksize` rows, otherwise
+    a single `DataFrame` for the whole month (yielded only once the connection
+    is released).
+    """
     url = get_url_from_date(date, zipped=False)
     try:
-        response = requests.get(url)
-        response.raise_for_status()
+        with _open_url(url, cache=cache, session=session) as fp:
+            if chunksize:
+                yield from _parse_stream(fp, chunksize)
+                return
+
+            frames = list(_parse_stream(fp, chunksize))
+        yield from frames
     except requests.exceptions.ConnectionError as e:
+        metrics.incr("download_errors")
         logger.error("Connection error")
     except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+        metrics.incr("download_errors")
         logger.error("Service unavailable. Try again later")
-    else:
-        # pd.to_pickle(response, f"tests/sample_responseponse_{url[-10:-4]}.pkl")
-        if response is not None:
-            csv_buffer = StringIO(response.content.decode("utf-8"))
-            return parse_csv(csv_buffer)
+
+
+def _select_zip_members(
+    archive: zipfile.ZipFile, date: datetime, full_year: bool
+) -> List[str]:
+    """Return the names of the monthly `csv` files in `archive` required for `date`"""
+    members = [n for n in archive.namelist() if n.lower().endswith(".csv")]
+    if not full_year:
+        # Archives hold one file per month (e.g. `inf_diario_fi_200501.csv`)
+        date_str = date.strftime(API_DATE_FORMAT)
+        monthly = [n for n in members if date_str in os.path.basename(n)]
+        if monthly:
+            return monthly
+
+    return sorted(members)
 
 
 @typechecked
-def _handle_zip_request(date: datetime) -> Optional[pd.DataFrame]:
-    """Takes a `date`, requests an annual `zip` file, unzips it, and return a
-    parsed `DataFrame (with annual data)`
+def _handle_zip_request(
+    date: datetime,
+    *,
+    full_year: bool = False,
+    chunksize: Optional[int] = None,
+    cache: Optional[DownloadCache] = None,
+    session: Optional[requests.Session] = None,
+) -> Iterator[pd.DataFrame]:
+    """Takes a `date`, requests an annual `zip` file and yield parsed `DataFrame`'s
+
+    Monthly files are parsed directly from the archive members, i.e. nothing is
+    extracted to disk and only the members required are read. Unless read from
+    `cache` (where historical archives are treated as immutable), the
+    (compressed) archive itself is spooled in memory up to `SPOOL_MAX_SIZE` bytes.
+
+    If `full_year=False`, only rows for `date.month` are yielded.
     """
     url = get_url_from_date(date, zipped=True)
-    with TemporaryDirectory() as temp_dir:
-        filepath = os.path.join(temp_dir, FILENAME)
-
-        # 1. Download bulk/zipped file
-        try:
-            with requests.get(url, stream=True) as res:
-                res.raise_for_status()
-                with open(filepath, "wb") as fp:
-                    shutil.copyfileobj(res.raw, fp)
-        except requests.exceptions.ConnectionError as e:
-            logger.error("Connection error")
-        except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
-            logger.error("Service unavailable. Try again later")
-
-        # 2. Unzip and parse monthly files
-        try:
-            shutil.unpack_archive(filepath, temp_dir)
-        except FileNotFoundError:
-            logger.error("Failed to download bulk file")
-        else:
-            df_list = [parse_csv(p) for p in glob.glob(f"{temp_dir}/*.csv")]
-            if df_list:
-                return pd.concat(df_list, axis=0).sort_index()
+    try:
+        with _open_url(
+            url, cache=cache, immutable=True, seekable=True, session=session
+        ) as fp:
+            try:
+                archive = zipfile.ZipFile(fp)
+            except zipfile.BadZipFile:
+                metrics.incr("download_errors")
+                logger.error("Failed to download bulk file")
+                return
+
+            with archive:
+                for name in _select_zip_members(archive, date, full_year):
+                    with archive.open(name) as member:
+                        for df in _parse_stream(member, chunksize):
+                            if not full_year:
+                                df = df.loc[df.index.month == date.month]
+                            yield df
+    except requests.exceptions.ConnectionError as e:
+        metrics.incr("download_errors")
+        logger.error("Connection error")
+    except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+        metrics.incr("download_errors")
+        logger.error("Service unavailable. Try again later")
 
 
 @typechecked
@@ -96,7 +230,12 @@ def get_monthly_data(
     *,
     full_year: bool = False,
     commit: bool = True,
-    manager: Optional[Manager] = None,
+    manager: Optional[Storage] = None,
+    chunksize: Optional[int] = None,
+    cache: Optional[DownloadCache] = None,
+    incremental: bool = False,
+    rollups: bool = False,
+    session: Optional[requests.Session] = None,
 ) -> Optional[pd.DataFrame]:
     """Get data for a single month.
 
@@ -109,6 +248,20 @@ def get_monthly_data(
         if `True` and `date < API_LAST_ZIPPED_DATE`, will return data for the whole year
     commit : `bool`
         if True, will write data to provided `manager` and return `None`
+    chunksize : `int`
+        if provided, data is parsed and committed in chunks of up to `chunksize`
+        rows as it is downloaded, keeping memory usage flat regardless of the size
+        of the month. Has no effect on the returned `DataFrame` when `commit=False`
+    cache : `DownloadCache`
+        if provided, raw files are downloaded thru (and stored in) the cache
+    incremental : `bool`
+        if True, will only write rows that are either new or differ from those
+        already stored in `manager` (see `Storage.update_df`)
+    rollups : `bool`
+        if True, will update `manager`'s rollups of all months committed (see
+        `bzfunds.rollups`)
+    session : `requests.Session`
+        if provided, requests are sent thru `session` (i.e. reusing connections)
     """
     if (date < API_FIRST_VALID_DATE) or (date >= TOMORROW):
         # Don't bother
@@ -116,20 +269,66 @@ def get_monthly_data(
 
     if date > API_LAST_ZIPPED_DATE:
         # New-format dates, i.e. directly thru single-month `csv` file
-        df = _handle_csv_request(date)
+        frames = _handle_csv_request(
+            date, chunksize=chunksize, cache=cache, session=session
+        )
     else:
         # Old-format dates, i.e. zipped file with whole-year data
-        df = _handle_zip_request(date)
-        if df is not None:
-            if not full_year:
-                df = df.loc[df.index.month == date.month]
-
-    if df is not None and not df.empty:
+        frames = _handle_zip_request(
+            date,
+            full_year=full_year,
+            chunksize=chunksize,
+            cache=cache,
+            session=session,
+        )
+
+    metrics.incr("months")
+    with metrics.timer("get_monthly_data"):
+        return _consume_frames(
+            frames,
+            commit=commit,
+            manager=manager,
+            incremental=incremental,
+            rollups=rollups,
+        )
+
+
+def _consume_frames(
+    frames: Iterable[pd.DataFrame],
+    *,
+    commit: bool,
+    manager: Optional[Storage],
+    incremental: bool = False,
+    rollups: bool = False,
+) -> Optional[pd.DataFrame]:
+    """Write each of `frames` as soon as it's available or concat them all"""
+    df_list = []
+    months = set()
+    for df in frames:
+        if df.empty:
+            continue
         if commit:
             assert manager is not None, "Requires a `manager` to `commit`"
-            manager.write_df(df.reset_index())  # `date` must be a column
+
+            # `date` must be a column
+            with metrics.timer("write"):
+                if incremental:
+                    counts = manager.update_df(df.reset_index())
+                else:
+                    counts = manager.write_df(df.reset_index())
+
+            # Rollups of months left unchanged (e.g. by updates) aren't recomputed
+            if any(counts.get(k) for k in ("inserted", "upserted", "modified")):
+                months.update(df.index.to_period("M").unique())
         else:
-            return df
+            df_list.append(df)
+
+    if rollups and months:
+        with metrics.timer("rollups"):
+            update_rollups(manager, [month.start_time for month in months])
+
+    if df_list:
+        return pd.concat(df_list, axis=0) if len(df_list) > 1 else df_list[0]
 
 
 @typechecked
@@ -138,23 +337,61 @@ def get_history(
     end_dt: datetime,
     *,
     commit: bool = True,
-    manager: Optional[Manager] = None,
-    n_jobs: int = -2,
+    manager: Optional[Storage] = None,
+    n_jobs: int = DEFAULT_N_JOBS,
+    max_per_host: int = DEFAULT_MAX_PER_HOST,
+    chunksize: Optional[int] = None,
+    cache: Optional[DownloadCache] = None,
+    incremental: bool = False,
+    rollups: bool = False,
+    parse_processes: int = 0,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
 ) -> Optional[pd.DataFrame]:
     """Get all monthly data available from `start_dt` to `end_dt`
 
+    Months (or years, for old-format dates) are scheduled on a single `asyncio`
+    queue and processed concurrently, sharing a pool of up to `max_per_host`
+    HTTP connections per host (i.e. requests wait for a free connection, while
+    parsing and writing aren't limited).
+    Blocking work (i.e. downloading, parsing and writing) runs on a pool of
+    worker threads, so the event loop only schedules jobs.
+
+    If `parse_processes > 0`, will instead run a staged pipeline: files are
+    downloaded by worker threads, parsed by a pool of `parse_processes`
+    processes (one task per monthly file, including each member of yearly
+    archives) and written by a single writer. Stages are connected by queues
+    of up to `queue_size` items, such that downloads are throttled whenever
+    parsing or writing fall behind.
+
     ...
 
     Parameters
     ----------
     start_dt : `datetime`
     end_dt : `datetime`
-    manager : `Manager`
+    manager : `Storage`
     commit : bool
         if True, will write data to provided `manager`
     n_jobs : `int`
-        # of jobs forwarded to `joblib.Parallel` call. Defaults to
-        all CPUs but one.
+        max # of months processed concurrently. Negative values are relative
+        to the # of CPUs, as in `joblib` (e.g. `-2` for all CPUs but one)
+    max_per_host : `int`
+        max # of concurrent requests to any single host. Note that with
+        `chunksize`, monthly files are streamed, i.e. their connection is held
+        until the whole month is committed
+    chunksize : `int`
+        forwarded to `get_monthly_data`
+    cache : `DownloadCache`
+        forwarded to `get_monthly_data`
+    incremental : `bool`
+        forwarded to `get_monthly_data`
+    rollups : `bool`
+        forwarded to `get_monthly_data`
+    parse_processes : `int`
+        if > 0, # of processes used to parse files. Note that files are then
+        parsed whole (i.e. `chunksize` is ignored)
+    queue_size : `int`
+        max # of items waiting between stages when `parse_processes > 0`
     """
     if start_dt >= end_dt:
         raise ValueError("`start_dt` must be < `end_dt`")
@@ -164,23 +401,38 @@ def get_history(
     if not commit:
         logger.warning("Running without committing might require a lot of memory!")
 
-    dates = pd.period_range(start_dt, end_dt, freq="m").to_timestamp().to_series()
-
-    # Redundant to get one month at a time with old-format (already parses whole year)
-    pre_dates = dates.loc[:API_LAST_ZIPPED_DATE].resample("y").last().index
-    pre_queue = Parallel(n_jobs=n_jobs, backend="threading")(
-        delayed(get_monthly_data)(date, full_year=True, commit=commit, manager=manager)
-        for date in pre_dates
-    )
-
-    post_dates = dates.loc[API_LAST_ZIPPED_DATE:].index
-    post_queue = Parallel(n_jobs=n_jobs, backend="threading")(
-        delayed(get_monthly_data)(date, full_year=False, commit=commit, manager=manager)
-        for date in post_dates
-    )
+    jobs = _plan_jobs(start_dt, end_dt)
+
+    if parse_processes > 0:
+        runner = _run_pipeline(
+            jobs,
+            n_jobs=_effective_n_jobs(n_jobs),
+            max_per_host=max_per_host,
+            parse_processes=parse_processes,
+            queue_size=queue_size,
+            commit=commit,
+            manager=manager,
+            cache=cache,
+            incremental=incremental,
+            rollups=rollups,
+        )
+    else:
+        runner = _run_jobs(
+            jobs,
+            n_jobs=_effective_n_jobs(n_jobs),
+            max_per_host=max_per_host,
+            commit=commit,
+            manager=manager,
+            chunksize=chunksize,
+            cache=cache,
+            incremental=incremental,
+            rollups=rollups,
+        )
+    with metrics.timer("get_history"):
+        results = _run_sync(runner)
 
     # List will be empty when `commit=True`
-    df_list = [df for df in (*pre_queue, *post_queue) if df is not None]
+    df_list = [df for df in results if df is not None]
     if df_list:
         df = pd.concat(df_list, axis=0).sort_index()
 
@@ -190,3 +442,280 @@ def get_history(
         end_month = end_dt.strftime("%Y-%m")
 
         return df.loc[start_month:end_month]
+
+
+def _plan_jobs(start_dt: datetime, end_dt: datetime) -> List[Tuple[datetime, bool]]:
+    """Return the (`date`, `full_year`) of each file required from `start_dt` to `end_dt`"""
+    dates = pd.period_range(start_dt, end_dt, freq="M").to_timestamp()
+    dates = dates[(dates >= API_FIRST_VALID_DATE) & (dates < TOMORROW)]
+
+    # Redundant to get one month at a time with old-format (already parses whole
+    # year). Bulk files are the slowest, so they are scheduled first
+    pre_dates = dates[dates <= API_LAST_ZIPPED_DATE]
+    pre_dates = pre_dates[~pre_dates.year.duplicated()]
+    post_dates = dates[dates > API_LAST_ZIPPED_DATE]
+
+    return [(date, True) for date in pre_dates] + [(date, False) for date in post_dates]
+
+
+async def _run_jobs(
+    jobs: List[Tuple[datetime, bool]],
+    *,
+    n_jobs: int,
+    max_per_host: int,
+    **kwargs,
+) -> List[Optional[pd.DataFrame]]:
+    """Run `get_monthly_data` for each (`date`, `full_year`) in `jobs`
+
+    Jobs run on `n_jobs` threads, whose requests share a single `requests.Session`
+    limited to `max_per_host` concurrent requests per host (see `_make_session`).
+    """
+    loop = asyncio.get_running_loop()
+    session = _make_session(max_per_host, block=True)
+
+    async def run(date: datetime, full_year: bool) -> Optional[pd.DataFrame]:
+        return await loop.run_in_executor(
+            executor,
+            partial(
+                get_monthly_data,
+                date,
+                full_year=full_year,
+                session=session,
+                **kwargs,
+            ),
+        )
+
+    with session, ThreadPoolExecutor(n_jobs) as executor:
+        return await asyncio.gather(*(run(*job) for job in jobs))
+
+
+async def _run_pipeline(
+    jobs: List[Tuple[datetime, bool]],
+    *,
+    n_jobs: int,
+    max_per_host: int,
+    parse_processes: int,
+    queue_size: int,
+    commit: bool,
+    manager: Optional[Storage],
+    cache: Optional[DownloadCache],
+    incremental: bool,
+    rollups: bool,
+) -> List[Optional[pd.DataFrame]]:
+    """Run `jobs` thru a (download -> parse -> write) pipeline
+
+    Downloads run on `n_jobs` workers (i.e. threads), parsing on
+    `parse_processes` processes, and writing on a single thread. Stages are
+    connected by bounded queues (i.e. with backpressure): each download worker
+    only starts its next download once its file is queued for parsing, so at
+    most `queue_size + n_jobs` files are ever downloaded but not yet parsed.
+    """
+    loop = asyncio.get_running_loop()
+    downloaded = asyncio.Queue(maxsize=queue_size)
+    parsed = asyncio.Queue(maxsize=queue_size)
+    errors = []
+
+    pending = iter(jobs)  # Shared by all download workers
+
+    async def download():
+        for date, full_year in pending:
+            zipped = date <= API_LAST_ZIPPED_DATE
+            url = get_url_from_date(date, zipped=zipped)
+            path = await loop.run_in_executor(
+                io_executor,
+                partial(
+                    _download_file,
+                    url,
+                    temp_dir=temp_dir,
+                    cache=cache,
+                    session=session,
+                    immutable=zipped,
+                ),
+            )
+            if path is not None:
+                # Only temporary files are removed after being parsed
+                await downloaded.put((path, date, full_year, cache is None))
+
+    async def parse():
+        while True:
+            item = await downloaded.get()
+            if item is None:
+                break
+
+            path, date, full_year, cleanup = item
+            try:
+                if date <= API_LAST_ZIPPED_DATE:
+                    with zipfile.ZipFile(path) as archive:
+                        members = _select_zip_members(archive, date, full_year)
+                    month = None if full_year else date.month
+                else:
+                    members, month = [None], None
+
+                for member in members:
+                    with metrics.timer("parse"):
+                        df = await loop.run_in_executor(
+                            process_executor, _parse_file, path, member, month
+                        )
+                    if df is not None and not df.empty:
+                        metrics.incr("rows_parsed", len(df))
+                        await parsed.put(df)
+            except Exception as e:
+                metrics.incr("parse_errors")
+                logger.error(f"Failed to parse {os.path.basename(path)} - {e}")
+            finally:
+                if cleanup:
+                    os.remove(path)
+
+    async def write() -> List[pd.DataFrame]:
+        df_list = []
+        while True:
+            df = await parsed.get()
+            if df is None:
+                return df_list
+            elif errors:
+                continue  # Drain the queue so upstream stages can finish
+
+            try:
+                res = await loop.run_in_executor(
+                    writer_executor,
+                    partial(
+                        _consume_frames,
+                        [df],
+                        commit=commit,
+                        manager=manager,
+                        incremental=incremental,
+                        rollups=rollups,
+                    ),
+                )
+            except Exception as e:
+                errors.append(e)
+            else:
+                if res is not None:
+                    df_list.append(res)
+
+    with ExitStack() as stack:
+        temp_dir = stack.enter_context(TemporaryDirectory())
+        session = stack.enter_context(_make_session(max_per_host, block=True))
+        io_executor = stack.enter_context(ThreadPoolExecutor(n_jobs))
+        process_executor = stack.enter_context(ProcessPoolExecutor(parse_processes))
+        writer_executor = stack.enter_context(ThreadPoolExecutor(1))
+
+        parsers = [asyncio.ensure_future(parse()) for _ in range(parse_processes)]
+        writer = asyncio.ensure_future(write())
+
+        await asyncio.gather(*(download() for _ in range(min(n_jobs, len(jobs)))))
+        for _ in parsers:
+            await downloaded.put(None)
+        await asyncio.gather(*parsers)
+        await parsed.put(None)
+        df_list = await writer
+
+    if errors:
+        raise errors[0]
+
+    return df_list
+
+
+def _download_file(
+    url: str,
+    *,
+    temp_dir: str,
+    cache: Optional[DownloadCache],
+    session: requests.Session,
+    immutable: bool,
+) -> Optional[str]:
+    """Download `url` into `cache` (or a temporary file) and return its path"""
+    try:
+        return _fetch_file(
+            url, temp_dir=temp_dir, cache=cache, session=session, immutable=immutable
+        )
+    except requests.exceptions.ConnectionError as e:
+        metrics.incr("download_errors")
+        logger.error("Connection error")
+    except (requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+        metrics.incr("download_errors")
+        logger.error("Service unavailable. Try again later")
+
+
+def _fetch_file(
+    url: str,
+    *,
+    temp_dir: str,
+    cache: Optional[DownloadCache],
+    session: requests.Session,
+    immutable: bool,
+) -> str:
+    """Same as `_download_file`, but raises the same `requests.exceptions` as `requests.get`"""
+    with metrics.timer("download"):
+        if cache is not None:
+            return cache.fetch(url, immutable=immutable, session=session)
+
+        with session.get(url, stream=True) as res:
+            res.raise_for_status()
+            res.raw.decode_content = True
+            with NamedTemporaryFile(dir=temp_dir, delete=False) as fp:
+                try:
+                    shutil.copyfileobj(res.raw, fp)
+                except BaseException:
+                    fp.close()
+                    os.remove(fp.name)
+                    raise
+            metrics.incr("download_bytes", res.raw.tell())
+            return fp.name
+
+
+def _parse_file(
+    path: str, member: Optional[str] = None, month: Optional[int] = None
+) -> pd.DataFrame:
+    """Parse a downloaded `csv` file, or a `member` of a downloaded `zip` archive
+
+    Runs on worker processes, so it must be a module-level function (note that
+    metrics recorded on worker processes are lost).
+    """
+    with metrics.timer("parse"):
+        if member is None:
+            df = parse_csv(path)
+        else:
+            with zipfile.ZipFile(path) as archive, archive.open(member) as fp:
+                df = parse_csv(fp)
+    metrics.incr("rows_parsed", len(df))
+
+    if month is not None:
+        df = df.loc[df.index.month == month]
+
+    return df
+
+
+def _make_session(pool_size: int, *, block: bool = False) -> requests.Session:
+    """Return a `requests.Session` able to keep `pool_size` connections per host
+
+    If `block=True`, at most `pool_size` requests are sent to each host at once,
+    i.e. further requests wait (on their thread) until a connection is released.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size, pool_block=block)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    return session
+
+
+def _run_sync(coro: Coroutine) -> Any:
+    """Run `coro` to completion, even if called from a running event loop
+    (e.g. a notebook), in which case it runs on a separate thread
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def _effective_n_jobs(n_jobs: int) -> int:
+    """Resolve `joblib`-like (i.e. possibly negative) `n_jobs`"""
+    if n_jobs < 0:
+        return max((os.cpu_count() or 1) + 1 + n_jobs, 1)
+
+    return max(n_jobs, 1)
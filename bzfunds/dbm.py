@@ -6,11 +6,29 @@ Database manager to persist data requests.
 """
 
 import logging
-from typing import Optional
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 import pandas as pd
 import pymongo
 
+from . import metrics
+from .buckets import buckets_to_df, iter_buckets, merge_bucket, month_start
+from .constants import (
+    API_COLUMNS_DTYPES,
+    API_COLUMNS_MAP,
+    API_INDEX_COLUMNS,
+    CHECKSUM_COLUMN,
+)
+from .rollups import FREQS, rollup_name
+from .storage import DEFAULT_CHUNKSIZE, Storage, _rechunk
+from .utils import decode_cnpj, encode_cnpj, hash_rows
+
 
 __all__ = ("Manager",)
 
@@ -20,6 +38,30 @@ logger = logging.getLogger(__name__)
 
 # Globals
 # ----
+FLAT = "flat"
+BUCKETED = "bucketed"
+LAYOUTS = (FLAT, BUCKETED)
+DUPLICATE_KEY_ERROR = 11000
+DEFAULT_BATCH_SIZE = 10_000
+DEFAULT_COLUMNS = tuple(API_COLUMNS_MAP.values())
+# Numeric columns are always read with their parsed dtypes, e.g. even if missing
+# from all rows read (such as `n_shareholders` in older files)
+STORED_DTYPES = {
+    API_COLUMNS_MAP[c]: t for c, t in API_COLUMNS_DTYPES.items() if t != "category"
+}
+# Rows are read as documents of column arrays, one per date and partition of
+# funds, which bounds their size (i.e. 16MB) however many funds report per date
+COLUMNAR_PARTS = 4
+# `get_data`'s query patterns, checked by `Manager.check_indexes`
+QUERY_PATTERNS = {
+    "funds": {"funds": ["00.000.000/0000-00"]},
+    "dates": {"start_dt": datetime(2021, 1, 1), "end_dt": datetime(2021, 12, 31)},
+    "funds_dates": {
+        "funds": ["00.000.000/0000-00"],
+        "start_dt": datetime(2021, 1, 1),
+        "end_dt": datetime(2021, 12, 31),
+    },
+}
 DEFAULT_CLIENT_SETTINGS = {
     "connectTimeoutMS": 2500,
     "serverSelectionTimeoutMS": 2500,
@@ -27,7 +69,45 @@ DEFAULT_CLIENT_SETTINGS = {
 }
 
 
-class Manager:
+class Manager(Storage):
+    """MongoDB storage backend
+
+    Funds are stored by their compact (`int64`) ids rather than their formatted
+    CNPJ (see `utils.encode_cnpj`), which are translated back when reading, so
+    documents and indexes are smaller. Collections written by previous versions
+    must be converted with `migrate_fund_ids`.
+
+    The connection (and index setup) is deferred until the first operation, so
+    instantiating a `Manager` doesn't require a reachable server.
+
+    Rows are stored either as one document per (`date`, `fund_cnpj`), i.e. the
+    `flat` layout, or as one document per fund per month holding arrays of its
+    rows, i.e. the `bucketed` layout (see `bzfunds.buckets`), which has ~20x
+    fewer documents (and index entries). Either way, rows are read back as is.
+    Data can be moved between layouts (i.e. collections) with `copy_from`.
+
+    ...
+
+    Parameters
+    ----------
+    host : `str`
+    port : `int`
+    db : `str`
+        database name
+    collection : `str`
+        collection name
+    username : `str`
+    password : `str`
+    covered_indexes : `list`
+        optional projections (i.e. lists of columns) to be served by covered
+        queries, e.g. `[["nav"]]` for `get_panel("nav", ...)`. Requires the
+        `flat` layout
+    layout : `str`
+        either `flat` (default) or `bucketed`
+    client_settings
+        forwarded to `pymongo.MongoClient`
+    """
+
     def __init__(
         self,
         host: str = "localhost",
@@ -37,14 +117,23 @@ class Manager:
         collection: str = "funds",
         username: Optional[str] = None,
         password: Optional[str] = None,
+        covered_indexes: Sequence[Sequence[str]] = (),
+        layout: str = FLAT,
         **client_settings,
     ):
+        if layout not in LAYOUTS:
+            raise ValueError(f"`layout` must be one of {LAYOUTS}")
+        elif covered_indexes and layout != FLAT:
+            raise ValueError("`covered_indexes` require the `flat` layout")
+
         self.host = self.parse_host(host)
         self.port = port
-        self.db = db
-        self.collection = collection
+        self.db_name = db
+        self.collection_name = collection
         self.username = username
         self.password = password
+        self.covered_indexes = [list(fields) for fields in covered_indexes]
+        self.layout = layout
 
         self.client_settings = {
             **DEFAULT_CLIENT_SETTINGS,
@@ -55,7 +144,8 @@ class Manager:
             **client_settings,
         }
 
-        self.setup()
+        self._client = None
+        self._setup_lock = threading.RLock()
 
     @staticmethod
     def parse_host(host: str) -> str:
@@ -70,43 +160,739 @@ class Manager:
             # Single host
             return f"mongodb://{host}"
 
+    @property
+    def client(self) -> pymongo.MongoClient:
+        if self._client is None:
+            self.setup()
+        return self._client
+
+    @property
+    def db(self) -> pymongo.database.Database:
+        return self.client[self.db_name]
+
+    @property
+    def collection(self) -> pymongo.collection.Collection:
+        return self.client[self.db_name][self.collection_name]
+
     def setup(self):
-        """Connect to the server and setup collection indexes"""
-        try:
-            self.client = pymongo.MongoClient(**self.client_settings)
-        except pymongo.errors.ServerSelectionTimeoutError as e:
-            logger.error(f"Failed to setup to database - {e}")
-        else:
-            self.db = self.client[self.db]
-            self.collection = self.db[self.collection]
+        """Connect to the server and setup collection indexes
 
-            # Required to speed up query
-            self.collection.create_index("date")
-            self.collection.create_index("fund_cnpj")
+        Called once, on first use (i.e. not when instantiating `Manager`).
+        """
+        with self._setup_lock:
+            if self._client is not None:
+                return
 
-            # Required to ensure uniqueness on (date, cnpj) pair
-            self.collection.create_index(
-                [
-                    ("date", pymongo.DESCENDING),
-                    ("fund_cnpj", pymongo.ASCENDING),
-                ],
-                unique=True,
+            self._client = pymongo.MongoClient(**self.client_settings)
+            try:
+                self.ensure_indexes()
+            except pymongo.errors.PyMongoError as e:
+                logger.error(f"Failed to setup database - {e}")
+                self._client = None
+                raise
+
+    def index_specs(self) -> List[Tuple[List[Tuple[str, int]], dict]]:
+        """Return the (keys, options) of every index managed by `Manager`
+
+        - (`date`, `fund_cnpj`): ensures uniqueness and serves date range scans
+        - (`fund_cnpj`, `date`): serves per-fund (range) scans
+        - (`fund_cnpj`, `date`, *columns): one per `covered_indexes`, which also
+          serves per-fund scans (i.e. replaces the previous one)
+
+        With the `bucketed` layout, buckets are indexed by `month` instead of `date`.
+        """
+        field = self._date_field
+        specs = [
+            (
+                [(field, pymongo.DESCENDING), ("fund_cnpj", pymongo.ASCENDING)],
+                {"unique": True},
+            )
+        ]
+        fund_keys = [("fund_cnpj", pymongo.ASCENDING), (field, pymongo.ASCENDING)]
+        for fields in self.covered_indexes or [[]]:
+            extra_keys = [
+                (c, pymongo.ASCENDING) for c in fields if c not in ("date", "fund_cnpj")
+            ]
+            specs.append(([*fund_keys, *extra_keys], {}))
+
+        return specs
+
+    @property
+    def _date_field(self) -> str:
+        return "month" if self.layout == BUCKETED else "date"
+
+    def _build_search(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+    ) -> dict:
+        """Build a query filter of the documents holding rows matching `get_data`'s
+        arguments (i.e. of the buckets spanning them, with the `bucketed` layout)
+        """
+        if self.layout == BUCKETED:
+            return _build_search(
+                funds,
+                start_dt and month_start(start_dt),
+                end_dt and month_start(end_dt),
+                field="month",
             )
 
-    def write_df(self, df: pd.DataFrame):
+        return _build_search(funds, start_dt, end_dt)
+
+    def ensure_indexes(self):
+        """Create all managed indexes and drop redundant ones
+
+        An index is redundant if its fields are a (strict) prefix of a managed
+        index, e.g. single-field indexes on `date` or `fund_cnpj`, as they only
+        slow down writes. Unique and unrelated indexes are never dropped.
+        """
+        specs = self.index_specs()
+        for keys, options in specs:
+            self.collection.create_index(keys, **options)
+
+        managed = [[field for field, _ in keys] for keys, _ in specs]
+        for name, info in self.collection.index_information().items():
+            if name == "_id_" or info.get("unique"):
+                continue
+            fields = [field for field, _ in info["key"]]
+            if any(
+                len(fields) < len(m) and m[: len(fields)] == fields for m in managed
+            ):
+                logger.info(f"Dropping redundant index `{name}`")
+                self.collection.drop_index(name)
+
+    def check_indexes(self) -> Dict[str, dict]:
+        """Report whether `get_data`'s query patterns are served by index scans
+
+        Each pattern (see `QUERY_PATTERNS`, plus one per `covered_indexes`) is run
+        thru `explain`, and its winning plan's `stages`, `indexes` used, and
+        whether it is `indexed` (i.e. no collection scan) and `covered` (i.e. no
+        documents fetched) are returned. Patterns not `indexed` are logged.
+        """
+        patterns = {
+            name: (self._build_search(**query), None)
+            for name, query in QUERY_PATTERNS.items()
+        }
+        for fields in self.covered_indexes:
+            projection = {"_id": 0, **{c: 1 for c in ["date", "fund_cnpj", *fields]}}
+            patterns[f"covered_{'_'.join(fields)}"] = (
+                self._build_search(**QUERY_PATTERNS["funds_dates"]),
+                projection,
+            )
+
+        report = {}
+        for name, (search, projection) in patterns.items():
+            plan = self.collection.find(search, projection).explain()
+            stages, indexes = _plan_stages(plan["queryPlanner"]["winningPlan"])
+            report[name] = {
+                "stages": stages,
+                "indexes": indexes,
+                "indexed": "IXSCAN" in stages and "COLLSCAN" not in stages,
+                "covered": "IXSCAN" in stages and "FETCH" not in stages,
+            }
+            if not report[name]["indexed"]:
+                logger.warning(f"Query pattern `{name}` is not served by an index")
+
+        return report
+
+    def migrate_fund_ids(self) -> int:
+        """Convert funds' CNPJ stored as strings (i.e. by previous versions) into
+        their ids, in both the collection and its per-fund rollups, and return
+        the # of documents converted
+
+        Conversion runs on the server (requires MongoDB 4.4+) and is idempotent.
+        Malformed CNPJs (i.e. not convertible into an id) are left as is.
+        """
+        digits = "$fund_cnpj"
+        for char in (".", "/", "-"):
+            digits = {"$replaceAll": {"input": digits, "find": char, "replacement": ""}}
+        fund_id = {"$convert": {"input": digits, "to": "long", "onError": "$fund_cnpj"}}
+        update = [{"$set": {"fund_cnpj": fund_id}}]
+
+        collections = [self.collection] + [
+            self.rollup_collection(rollup_name(freq, "fund")) for freq in FREQS
+        ]
+        n_docs = 0
+        for collection in collections:
+            res = collection.update_many({"fund_cnpj": {"$type": "string"}}, update)
+            n_docs += res.modified_count
+            logger.info(
+                f"Converted {res.modified_count} documents in `{collection.name}`"
+            )
+            n_malformed = collection.count_documents({"fund_cnpj": {"$type": "string"}})
+            if n_malformed:
+                logger.warning(
+                    f"Left {n_malformed} documents with malformed CNPJs in "
+                    f"`{collection.name}`"
+                )
+        if n_docs and self.query_cache is not None:
+            self.query_cache.clear()
+
+        return n_docs
+
+    def write_df(
+        self,
+        df: pd.DataFrame,
+        *,
+        upsert: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        n_threads: int = 1,
+    ) -> Dict[str, int]:
         """Write a `DataFrame` retrieved from `get_monthly_data` into the database
 
+        Rows are stored along with their `CHECKSUM_COLUMN` (computed if missing).
+        By default, rows are inserted and those already stored are skipped (i.e.
+        fail the unique index). If `upsert=True`, stored rows are overwritten.
+
+        Records are built and sent in (unordered) batches of `batch_size` rows, so
+        only a few batches are ever materialized at once, regardless of the size
+        of `df`. Batches can be written concurrently by up to `n_threads` threads.
+
+        Returns the # of rows `inserted`, `upserted`, `modified` and `skipped`.
+
         ...
 
         Parameters
         ----------
         df : pd.DataFrame
+        upsert : `bool`
+            if True, will replace any existing rows with the same (date, fund_cnpj)
+        batch_size : `int`
+            max # of rows per request
+        n_threads : `int`
+            max # of batches written concurrently
         """
         assert df.size, "Empty `DataFrame`"
         assert "date" in df.columns, "Must `reset_index()` before writing"
 
+        if CHECKSUM_COLUMN not in df.columns:
+            df = df.assign(**{CHECKSUM_COLUMN: hash_rows(df)})
+        df = df.assign(fund_cnpj=encode_cnpj(df["fund_cnpj"]))
+
+        if self.layout == BUCKETED:
+            batches, write = iter_buckets(df, batch_size), self._write_buckets
+        else:
+            batches = (
+                df.iloc[i : i + batch_size] for i in range(0, len(df), batch_size)
+            )
+            write = self._write_batch
+
+        counts = Counter()
+        try:
+            if n_threads > 1:
+                with ThreadPoolExecutor(n_threads) as executor:
+                    pending = set()
+                    for batch in batches:
+                        # Bound the # of batches in memory
+                        if len(pending) >= 2 * n_threads:
+                            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                counts.update(future.result())
+                        pending.add(executor.submit(write, batch, upsert))
+                    for future in pending:
+                        counts.update(future.result())
+            else:
+                for batch in batches:
+                    counts.update(write(batch, upsert))
+        finally:
+            # Even partial writes make cached results stale
+            self._invalidate(df["date"])
+
+        counts = {k: counts[k] for k in ("inserted", "upserted", "modified", "skipped")}
+        for k, v in counts.items():
+            metrics.incr(f"rows_{k}", v)
+        if counts["skipped"]:
+            logger.warning(f"Skipped {counts['skipped']} rows already stored")
+
+        return counts
+
+    def _write_batch(self, df: pd.DataFrame, upsert: bool) -> Counter:
+        """Write a single batch of rows and return the # of rows affected"""
+        metrics.incr("write_batches")
+        with metrics.timer("write.to_dict"):
+            records = df.to_dict(orient="records")
+            if upsert:
+                operations = [
+                    pymongo.UpdateOne(
+                        {k: r[k] for k in API_INDEX_COLUMNS}, {"$set": r}, upsert=True
+                    )
+                    for r in records
+                ]
+
+        counts = Counter()
         try:
-            self.collection.insert_many(df.to_dict(orient="records"), ordered=False)
+            with metrics.timer("write.insert"):
+                if upsert:
+                    res = self.collection.bulk_write(operations, ordered=False)
+                    counts["upserted"] += res.upserted_count
+                    counts["modified"] += res.modified_count
+                else:
+                    res = self.collection.insert_many(records, ordered=False)
+                    counts["inserted"] += len(res.inserted_ids)
         except pymongo.errors.BulkWriteError as e:
+            counts["inserted"] += e.details.get("nInserted", 0)
+            counts["upserted"] += e.details.get("nUpserted", 0)
+            counts["modified"] += e.details.get("nModified", 0)
             for err_obj in e.details["writeErrors"]:
+                if err_obj.get("code") == DUPLICATE_KEY_ERROR:
+                    counts["skipped"] += 1
+                    metrics.incr("duplicate_key_errors")
+                else:
+                    metrics.incr("write_errors")
+                    logger.error(err_obj["errmsg"])
+
+        return counts
+
+    def _write_buckets(
+        self, buckets: List[Tuple[Tuple[int, datetime], Dict[str, list]]], upsert: bool
+    ) -> Counter:
+        """Merge a single batch of buckets into those stored (i.e. replace them)
+        and return the # of rows affected
+
+        **Note**: buckets are merged on the client, so concurrent writes of rows
+        of the same fund and month (e.g. of the same file) may be lost.
+        """
+        metrics.incr("write_batches")
+        funds = list({fund for (fund, _), _ in buckets})
+        months = list({month for (_, month), _ in buckets})
+        docs = self.collection.find(
+            {"fund_cnpj": {"$in": funds}, "month": {"$in": months}}
+        )
+        stored = {(doc["fund_cnpj"], doc["month"]): doc for doc in docs}
+
+        counts = Counter()
+        operations, op_counts = [], []
+        with metrics.timer("write.merge"):
+            for (fund, month), rows in buckets:
+                doc, res = merge_bucket(stored.get((fund, month)), rows, upsert)
+                counts.update(res)
+                if doc is not None:
+                    key = {"fund_cnpj": fund, "month": month}
+                    operations.append(
+                        pymongo.ReplaceOne(key, {**key, **doc}, upsert=True)
+                    )
+                    op_counts.append(res)
+
+        if not operations:
+            return counts
+
+        try:
+            with metrics.timer("write.insert"):
+                self.collection.bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            for err_obj in e.details["writeErrors"]:
+                counts.subtract(op_counts[err_obj["index"]])
+                metrics.incr("write_errors")
                 logger.error(err_obj["errmsg"])
+
+        return counts
+
+    def read_df(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+    ) -> pd.DataFrame:
+        search = self._build_search(funds, start_dt, end_dt)
+
+        return self.find_df(
+            search, columns=columns, dtype=dtype, start_dt=start_dt, end_dt=end_dt
+        )
+
+    def iter_df(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        monthly: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> Iterator[pd.DataFrame]:
+        """Stream matching rows sorted (server-side) by `date`, in frames of up
+        to `chunksize` rows (or one per month)
+
+        Rows are read from a single cursor, as documents of column arrays (see
+        `find_df`) sorted by date, so only the current frame is ever held in
+        memory. With the `bucketed` layout, months are read one at a time
+        instead. See `Storage.iter_df`.
+        """
+        if self.layout == BUCKETED:
+            yield from super().iter_df(
+                funds,
+                start_dt,
+                end_dt,
+                columns=columns,
+                dtype=dtype,
+                chunksize=chunksize,
+                monthly=monthly,
+            )
+            return
+
+        columns = list(columns or DEFAULT_COLUMNS)
+        dtype = dtype or {}
+
+        pipeline = [
+            {"$match": self._build_search(funds, start_dt, end_dt)},
+            *_columnar_stages(columns),
+            {"$sort": {"_id.date": pymongo.ASCENDING}},
+        ]
+        cursor = self.collection.aggregate(pipeline, allowDiskUse=True)
+        if monthly:
+            chunks = (
+                docs
+                for _, docs in groupby(
+                    cursor, key=lambda doc: doc["_id"]["date"].strftime("%Y%m")
+                )
+            )
+        else:
+            chunks = _take_rows(cursor, columns[0], chunksize)
+
+        def frames() -> Iterator[pd.DataFrame]:
+            for docs in chunks:
+                with metrics.timer("read"):
+                    df = _columns_to_df(docs, columns, dtype, batch_size)
+                    if "fund_cnpj" in df.columns:
+                        df["fund_cnpj"] = decode_cnpj(df["fund_cnpj"])
+                metrics.incr("rows_read", len(df))
+                yield df
+
+        with cursor:
+            yield from frames() if monthly else _rechunk(frames(), chunksize)
+
+    def read_snapshot(
+        self,
+        as_of: Union[str, datetime],
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> pd.DataFrame:
+        """Resolve the last row of each fund dated at or before `as_of` server-side
+
+        Rows are sorted by (`fund_cnpj`, `date`) descending, i.e. a backward scan
+        of the (`fund_cnpj`, `date`) index, and grouped by fund keeping their
+        first row, which the server can run as a `DISTINCT_SCAN` (i.e. a single
+        index seek per fund) rather than reading every row in range. With the
+        `bucketed` layout, rows are reduced client-side instead. See
+        `Storage.read_snapshot`.
+        """
+        if self.layout == BUCKETED:
+            return super().read_snapshot(
+                as_of, funds, start_dt, columns=columns, dtype=dtype
+            )
+
+        columns = list(columns or DEFAULT_COLUMNS)
+        dtype = dtype or {}
+
+        pipeline = [
+            {"$match": self._build_search(funds, start_dt, as_of)},
+            {"$sort": {"fund_cnpj": pymongo.DESCENDING, "date": pymongo.DESCENDING}},
+            {
+                "$group": {
+                    "_id": "$fund_cnpj",
+                    **{c: {"$first": f"${c}"} for c in columns if c != "fund_cnpj"},
+                }
+            },
+            {"$project": {"_id": 0, **{c: 1 for c in columns}, "fund_cnpj": "$_id"}},
+            *_columnar_stages(columns, by_date=False),
+        ]
+        with metrics.timer("read"):
+            cursor = self.collection.aggregate(pipeline, allowDiskUse=True)
+            df = _columns_to_df(cursor, columns, dtype, batch_size)
+            if "fund_cnpj" in df.columns:
+                df["fund_cnpj"] = decode_cnpj(df["fund_cnpj"])
+        metrics.incr("rows_read", len(df))
+
+        return df
+
+    def last_date(self) -> Optional[datetime]:
+        field = self._date_field
+        cursor = self.collection.find().limit(1).sort(field, pymongo.DESCENDING)
+        try:
+            last = cursor[0][field]
+        except (IndexError, KeyError):
+            return
+
+        if self.layout == BUCKETED:
+            # Last date within any bucket of the last month
+            res = self.collection.aggregate(
+                [
+                    {"$match": {"month": last}},
+                    {"$group": {"_id": None, "date": {"$max": {"$max": "$date"}}}},
+                ]
+            )
+            last = next(res)["date"]
+
+        return last
+
+    def rollup_collection(self, name: str) -> pymongo.collection.Collection:
+        """Return the collection storing rollup `name` (see `bzfunds.rollups`)"""
+        return self.db[f"{self.collection.name}_{name}"]
+
+    def write_rollup(self, name: str, df: pd.DataFrame, dates: Sequence[datetime]):
+        collection = self.rollup_collection(name)
+        collection.create_index("date")
+
+        dates = [pd.Timestamp(d).to_pydatetime() for d in dates]
+        collection.delete_many({"date": {"$in": dates}})
+        if not df.empty:
+            if "fund_cnpj" in df.columns:
+                df = df.assign(fund_cnpj=encode_cnpj(df["fund_cnpj"]))
+            collection.insert_many(df.to_dict(orient="records"), ordered=False)
+
+    def read_rollup(
+        self,
+        name: str,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        where: Optional[Dict[str, Sequence[str]]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        search = _build_search(None, start_dt, end_dt)
+        for column, values in (where or {}).items():
+            if column == "fund_cnpj":
+                values = encode_cnpj(values, errors="coerce").tolist()
+            search[column] = {"$in": list(values)}
+
+        projection = {"_id": 0, **{c: 1 for c in columns or []}}
+        docs = self.rollup_collection(name).find(search, projection)
+        df = pd.DataFrame(list(docs), columns=columns)
+        if "fund_cnpj" in df.columns:
+            df["fund_cnpj"] = decode_cnpj(df["fund_cnpj"])
+
+        return df
+
+    @property
+    def jobs_collection(self) -> pymongo.collection.Collection:
+        """Collection storing the job ledger (see `bzfunds.backfill`)"""
+        return self.db[f"{self.collection.name}_jobs"]
+
+    def read_jobs(self, names: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        search = {"_id": {"$in": list(names)}} if names is not None else {}
+        docs = self.jobs_collection.find(search)
+
+        return {doc.pop("_id"): doc for doc in docs}
+
+    def write_job(self, name: str, fields: dict):
+        self.jobs_collection.update_one({"_id": name}, {"$set": fields}, upsert=True)
+
+    def claim_job(
+        self, names: Optional[Sequence[str]], worker: str, lease: float
+    ) -> Optional[Tuple[str, dict]]:
+        now = time.time()
+        search = {
+            "queued": True,
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}],
+        }
+        if names is not None:
+            search["_id"] = {"$in": list(names)}
+
+        doc = self.jobs_collection.find_one_and_update(
+            search,
+            {"$set": {"worker": worker, "lease_until": now + lease}},
+            sort=[("_id", pymongo.ASCENDING)],
+        )
+        if doc is not None:
+            return doc.pop("_id"), doc
+
+    def renew_lease(self, name: str, worker: str, lease: float) -> bool:
+        res = self.jobs_collection.update_one(
+            {"_id": name, "queued": True, "worker": worker},
+            {"$set": {"lease_until": time.time() + lease}},
+        )
+
+        return res.matched_count > 0
+
+    def find_df(
+        self,
+        search: dict,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+    ) -> pd.DataFrame:
+        """Query the collection and return a `DataFrame` with the matching rows
+
+        Only `columns` are fetched (`_id` is always excluded), and funds' ids are
+        translated back into their CNPJ (as a `Categorical`). Rather than a
+        document per row, the server packs matching rows into documents of
+        column arrays (see `_columnar_stages`), which the driver decodes (in C)
+        straight into lists, so no dict is ever built per row. Values are
+        converted to arrays every `batch_size` rows. Rows are returned in no
+        particular order.
+
+        ...
+
+        Parameters
+        ----------
+        search : `dict`
+            MongoDB query filter
+        columns : `list`
+            columns to return. Defaults to all columns in `API_COLUMNS_MAP`
+        dtype : `dict`
+            optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+        batch_size : `int`
+            # of rows converted to arrays at a time (or of buckets per cursor
+            batch, with the `bucketed` layout)
+        start_dt : `str` or `datetime`
+        end_dt : `str` or `datetime`
+            optional bounds of rows' dates with the `bucketed` layout (i.e. on top
+            of `search`, which matches whole buckets)
+        """
+        columns = list(columns or DEFAULT_COLUMNS)
+        dtype = dtype or {}
+
+        with metrics.timer("read"):
+            if self.layout == BUCKETED:
+                projection = {"_id": 0, **{c: 1 for c in {*columns, "date"}}}
+                cursor = self.collection.find(search, projection, batch_size=batch_size)
+                dtype = {**STORED_DTYPES, **dtype}
+                df = buckets_to_df(cursor, columns, dtype, start_dt, end_dt)
+            else:
+                cursor = self.collection.aggregate(
+                    [{"$match": search}, *_columnar_stages(columns)],
+                    allowDiskUse=True,
+                )
+                df = _columns_to_df(cursor, columns, dtype, batch_size)
+            if "fund_cnpj" in df.columns:
+                df["fund_cnpj"] = decode_cnpj(df["fund_cnpj"])
+        metrics.incr("rows_read", len(df))
+
+        return df
+
+
+def _build_search(
+    funds: Optional[Sequence[str]] = None,
+    start_dt: Optional[Union[str, datetime]] = None,
+    end_dt: Optional[Union[str, datetime]] = None,
+    field: str = "date",
+) -> dict:
+    """Build a MongoDB query filter from `get_data`'s arguments"""
+    search = {}
+    if funds:
+        search["fund_cnpj"] = {"$in": encode_cnpj(funds, errors="coerce").tolist()}
+
+    if start_dt or end_dt:
+        search[field] = {}
+        if start_dt:
+            search[field]["$gte"] = pd.to_datetime(start_dt)
+        if end_dt:
+            search[field]["$lte"] = pd.to_datetime(end_dt)
+
+    return search
+
+
+def _plan_stages(plan: dict) -> Tuple[List[str], List[str]]:
+    """Return all stages and index names of an `explain` plan (depth-first)"""
+    stages, indexes = [], []
+    nodes = [plan.get("queryPlan", plan)]
+    while nodes:
+        node = nodes.pop()
+        stages.append(node.get("stage"))
+        if node.get("indexName"):
+            indexes.append(node["indexName"])
+        if "inputStage" in node:
+            nodes.append(node["inputStage"])
+        nodes.extend(node.get("inputStages", []))
+
+    return stages, indexes
+
+
+def _columnar_stages(columns: Sequence[str], by_date: bool = True) -> List[dict]:
+    """Return the aggregation stages packing rows into documents of (aligned)
+    arrays of `columns`, one per date (if `by_date`) and partition of funds
+
+    Funds are partitioned by their id (see `COLUMNAR_PARTS`), or all in the
+    first partition if stored by their CNPJ.
+    """
+    fund_id = {
+        "$convert": {"input": "$fund_cnpj", "to": "long", "onError": 0, "onNull": 0}
+    }
+    key = {"part": {"$mod": [fund_id, COLUMNAR_PARTS]}}
+    if by_date:
+        key["date"] = "$date"
+
+    # Missing fields are pushed as `null`, keeping arrays aligned
+    return [
+        {
+            "$group": {
+                "_id": key,
+                **{c: {"$push": {"$ifNull": [f"${c}", None]}} for c in columns},
+            }
+        }
+    ]
+
+
+def _take_rows(docs: Iterable[dict], column: str, n_rows: int) -> Iterator[list]:
+    """Yield lists of consecutive (columnar) `docs` of at least `n_rows` rows
+    (i.e. items of their `column` array), but for the last one
+    """
+    pending, n_pending = [], 0
+    for doc in docs:
+        pending.append(doc)
+        n_pending += len(doc[column])
+        if n_pending >= n_rows:
+            yield pending
+            pending, n_pending = [], 0
+
+    if pending:
+        yield pending
+
+
+def _columns_to_df(
+    docs: Iterable[dict],
+    columns: Sequence[str],
+    dtype: Dict[str, str],
+    batch_size: int,
+) -> pd.DataFrame:
+    """Build a `DataFrame` from `docs` of column arrays (see `_columnar_stages`)
+
+    Numeric columns are cast to their `STORED_DTYPES`, unless given in `dtype`.
+    """
+    dtype = {**STORED_DTYPES, **dtype}
+    arrays = {c: [] for c in columns}
+    values = {c: [] for c in columns}
+
+    def flush():
+        # Called every `batch_size` rows
+        if values[columns[0]]:
+            metrics.incr("cursor_batches")
+        for c in columns:
+            if values[c]:
+                arrays[c].append(pd.Series(values[c], dtype=dtype.get(c)))
+                values[c] = []
+
+    n_values = 0
+    for doc in docs:
+        for c in columns:
+            values[c].extend(doc[c])
+        n_values += len(doc[columns[0]])
+        if n_values >= batch_size:
+            flush()
+            n_values = 0
+    flush()
+
+    data = {}
+    for c in columns:
+        if not arrays[c]:
+            data[c] = pd.Series([], dtype=dtype.get(c, object))
+        elif len(arrays[c]) == 1:
+            data[c] = arrays[c][0]
+        else:
+            data[c] = pd.concat(arrays[c], ignore_index=True)
+            if c in dtype:
+                data[c] = data[c].astype(dtype[c])  # e.g. union of categories
+
+    return pd.DataFrame(data, columns=columns)
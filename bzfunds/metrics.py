@@ -0,0 +1,173 @@
+"""
+bzfunds.metrics
+~~~~~~~~~~~~~~~
+
+Lightweight instrumentation of ingestion and queries, i.e. counters (e.g. bytes
+downloaded or rows inserted) and per-stage timers (e.g. `download`, `parse`,
+`write.insert`).
+
+All measurements are accumulated in a process-wide registry (`REGISTRY`), as
+well as in any active `collect()` block, which is the simplest way to get a
+report of a single run:
+
+    with metrics.collect() as run:
+        download_data(update_only=True)
+    run.report()
+
+Measurements can also be exported as they happen thru hooks (see `add_hook`),
+or in the Prometheus text format (see `Metrics.to_prometheus`).
+
+**Note**: `collect()` blocks are process-wide (i.e. measurements from worker
+threads are included), so concurrent runs are reported together.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+
+__all__ = ("Metrics", "REGISTRY", "add_hook", "collect", "incr", "remove_hook", "timer")
+
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Thread-safe registry of counters and timers"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def incr(self, name: str, value: float = 1):
+        """Increment counter `name` by `value`"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        """Record a single (wall time) measurement of timer `name`"""
+        with self._lock:
+            count, total, max_ = self.timers.get(name, (0, 0.0, 0.0))
+            self.timers[name] = (count + 1, total + seconds, max(max_, seconds))
+
+    def report(self) -> Dict[str, dict]:
+        """Return all `counters`, and the `count`, `total`, `mean` and `max`
+        seconds of all `timers`
+        """
+        with self._lock:
+            return {
+                "counters": dict(sorted(self.counters.items())),
+                "timers": {
+                    name: {
+                        "count": count,
+                        "total": total,
+                        "mean": total / count,
+                        "max": max_,
+                    }
+                    for name, (count, total, max_) in sorted(self.timers.items())
+                },
+            }
+
+    def to_prometheus(self, prefix: str = "bzfunds") -> str:
+        """Return all metrics in the Prometheus text exposition format
+
+        Counters are exported as `<prefix>_<name>_total`, and timers as summaries
+        (i.e. `<prefix>_<name>_seconds_count` and `<prefix>_<name>_seconds_sum`).
+        """
+        report = self.report()
+        lines = []
+        for name, value in report["counters"].items():
+            metric = f"{prefix}_{_sanitize(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, timer_ in report["timers"].items():
+            metric = f"{prefix}_{_sanitize(name)}_seconds"
+            lines += [
+                f"# TYPE {metric} summary",
+                f"{metric}_count {timer_['count']}",
+                f"{metric}_sum {timer_['total']}",
+            ]
+
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+
+def _sanitize(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+# Globals
+# ----
+REGISTRY = Metrics()
+
+_lock = threading.Lock()
+_collectors = []
+_hooks = []
+
+
+def add_hook(hook: Callable[[str, str, float], None]):
+    """Call `hook(kind, name, value)` on every measurement, where `kind` is
+    either `counter` or `timer` (in which case `value` is in seconds)
+
+    E.g. to forward measurements to a `prometheus_client` registry or StatsD.
+    Exceptions raised by hooks are logged and ignored.
+    """
+    with _lock:
+        _hooks.append(hook)
+
+
+def remove_hook(hook: Callable[[str, str, float], None]):
+    with _lock:
+        _hooks.remove(hook)
+
+
+def _emit(kind: str, name: str, value: float):
+    with _lock:
+        registries = [REGISTRY, *_collectors]
+        hooks = list(_hooks)
+
+    for registry in registries:
+        if kind == "counter":
+            registry.incr(name, value)
+        else:
+            registry.observe(name, value)
+
+    for hook in hooks:
+        try:
+            hook(kind, name, value)
+        except Exception as e:
+            logger.error(f"Metrics hook failed - {e}")
+
+
+def incr(name: str, value: float = 1):
+    """Increment counter `name` by `value`"""
+    _emit("counter", name, value)
+
+
+@contextmanager
+def timer(name: str) -> Iterator[None]:
+    """Measure the wall time of a block as timer `name` (even if it raises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _emit("timer", name, time.perf_counter() - start)
+
+
+@contextmanager
+def collect() -> Iterator[Metrics]:
+    """Collect all measurements within a block into a new `Metrics` (i.e. a run report)"""
+    metrics = Metrics()
+    with _lock:
+        _collectors.append(metrics)
+    try:
+        yield metrics
+    finally:
+        with _lock:
+            _collectors.remove(metrics)
@@ -0,0 +1,362 @@
+"""
+bzfunds.parquet
+~~~~~~~~~~~~~~~
+
+Local (columnar) storage backend, as an alternative to MongoDB.
+
+Data is stored as a Parquet dataset partitioned by `year` and `month`, i.e. one
+file per month (`<path>/year=2021/month=1/data.parquet`), sorted by
+(`fund_cnpj`, `date`). Reads only touch the partitions and columns required,
+and filters on `date`/`fund_cnpj` are pushed down to the Parquet reader.
+
+Rollups (see `bzfunds.rollups`) are stored as one file each, under
+`<path>/_rollups`, and the job ledger (see `bzfunds.backfill`) as a single JSON
+file, `<path>/_jobs.json`. Partitions, rollups and the ledger are each locked
+(thru files under `<path>/_locks`) while written, such that several processes
+can share the dataset, e.g. as workers.
+
+Requires `pyarrow`.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:  # i.e. Windows, where files are only locked within a process
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError as e:
+    raise ImportError("`bzfunds.parquet` requires `pyarrow`") from e
+
+from . import metrics
+from .constants import API_COLUMNS_MAP, API_INDEX_COLUMNS, CHECKSUM_COLUMN
+from .storage import Storage
+from .utils import hash_rows
+
+
+__all__ = ("ParquetManager",)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Globals
+# ----
+FILENAME = "data.parquet"
+ROLLUPS_DIR = "_rollups"  # `_`-prefixed paths are ignored by `pyarrow.dataset`
+JOBS_FILENAME = "_jobs.json"
+LOCKS_DIR = "_locks"
+DEFAULT_COLUMNS = tuple(API_COLUMNS_MAP.values())
+SCHEMA = pa.schema(
+    [
+        ("fund_type", pa.string()),
+        ("fund_cnpj", pa.string()),
+        ("date", pa.timestamp("us")),
+        ("total_portfolio", pa.float64()),
+        ("nav", pa.float64()),
+        ("total_equity", pa.float64()),
+        ("subscriptions", pa.float64()),
+        ("redemptions", pa.float64()),
+        ("n_shareholders", pa.float64()),  # i.e. as parsed (see `API_COLUMNS_DTYPES`)
+        (CHECKSUM_COLUMN, pa.int64()),
+    ]
+)
+PARTITION_SCHEMA = pa.schema([("year", pa.int16()), ("month", pa.int8())])
+PARTITIONING = ds.partitioning(PARTITION_SCHEMA, flavor="hive")
+DATASET_SCHEMA = pa.unify_schemas([SCHEMA, PARTITION_SCHEMA])
+
+
+class ParquetManager(Storage):
+    """Parquet dataset storage backend
+
+    ...
+
+    Parameters
+    ----------
+    path : `str`
+        root directory of the dataset (created if missing)
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+        os.makedirs(self.path, exist_ok=True)
+
+        self._locks = defaultdict(threading.Lock)
+        self._locks_lock = threading.Lock()
+
+    def _partition_path(self, year: int, month: int) -> str:
+        return os.path.join(self.path, f"year={year}", f"month={month}", FILENAME)
+
+    def _partitions(self) -> Sequence[Tuple[int, int]]:
+        """Return all stored (`year`, `month`) partitions, sorted"""
+        partitions = []
+        for year_dir in os.listdir(self.path):
+            if not year_dir.startswith("year="):
+                continue
+            for month_dir in os.listdir(os.path.join(self.path, year_dir)):
+                year, month = int(year_dir[5:]), int(month_dir[6:])
+                if os.path.exists(self._partition_path(year, month)):
+                    partitions.append((year, month))
+
+        return sorted(partitions)
+
+    def write_df(
+        self, df: pd.DataFrame, *, upsert: bool = False, **kwargs
+    ) -> Dict[str, int]:
+        """Write a `DataFrame` retrieved from `get_monthly_data` into the dataset
+
+        Each affected monthly partition is rewritten as a whole, so writing
+        larger chunks is considerably cheaper than many small ones.
+        """
+        assert df.size, "Empty `DataFrame`"
+        assert "date" in df.columns, "Must `reset_index()` before writing"
+
+        if CHECKSUM_COLUMN not in df.columns:
+            df = df.assign(**{CHECKSUM_COLUMN: hash_rows(df)})
+        df = df.reindex(columns=SCHEMA.names)
+
+        counts = Counter()
+        dates = pd.DatetimeIndex(df["date"])
+        for (year, month), part in df.groupby([dates.year, dates.month]):
+            with self._lock(year, month):
+                try:
+                    counts.update(self._write_partition(year, month, part, upsert))
+                finally:
+                    self._invalidate(part["date"])
+
+        counts = {k: counts[k] for k in ("inserted", "upserted", "modified", "skipped")}
+        for k, v in counts.items():
+            metrics.incr(f"rows_{k}", v)
+        if counts["skipped"]:
+            logger.warning(f"Skipped {counts['skipped']} rows already stored")
+
+        return counts
+
+    @contextmanager
+    def _lock(self, *key) -> Iterator[None]:
+        """Lock `key` (e.g. a partition) across threads and (where supported)
+        processes
+        """
+        with self._locks_lock:
+            lock = self._locks[key]
+
+        os.makedirs(os.path.join(self.path, LOCKS_DIR), exist_ok=True)
+        path = os.path.join(self.path, LOCKS_DIR, "-".join(map(str, key)) + ".lock")
+        with lock, open(path, "a") as fp:
+            if fcntl is not None:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            yield
+
+    def _write_partition(
+        self, year: int, month: int, df: pd.DataFrame, upsert: bool
+    ) -> Counter:
+        """Merge `df` into a single monthly partition"""
+        keys = list(API_INDEX_COLUMNS)
+        df = df.drop_duplicates(keys, keep="last" if upsert else "first")
+        path = self._partition_path(year, month)
+
+        counts = Counter()
+        if os.path.exists(path):
+            stored = pq.read_table(path).to_pandas()
+            stored_idx = pd.MultiIndex.from_frame(stored[keys])
+            new_idx = pd.MultiIndex.from_frame(
+                df[keys].astype({"date": stored["date"].dtype})
+            )
+            exists = new_idx.isin(stored_idx)
+            if upsert:
+                counts["modified"] += int(exists.sum())
+                counts["upserted"] += int((~exists).sum())
+                df = pd.concat([stored.loc[~stored_idx.isin(new_idx)], df])
+            else:
+                counts["skipped"] += int(exists.sum())
+                counts["inserted"] += int((~exists).sum())
+                df = pd.concat([stored, df.loc[~exists]])
+        else:
+            counts["upserted" if upsert else "inserted"] += len(df)
+
+        # Sorting by fund tightens row group statistics (i.e. pushdown on `fund_cnpj`)
+        df = df.sort_values(["fund_cnpj", "date"])
+        table = pa.Table.from_pandas(df, schema=SCHEMA, preserve_index=False)
+
+        # `.`-prefixed (i.e. partially written) files are ignored by `pyarrow.dataset`
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = os.path.join(os.path.dirname(path), f".{FILENAME}.tmp")
+        pq.write_table(table, temp_path)
+        os.replace(temp_path, path)
+
+        return counts
+
+    def read_df(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+    ) -> pd.DataFrame:
+        columns = list(columns or DEFAULT_COLUMNS)
+        if not self._partitions():
+            return pd.DataFrame(columns=columns).astype(dtype or {})
+
+        expr = ds.scalar(True)
+        if funds:
+            expr &= ds.field("fund_cnpj").isin(list(funds))
+        if start_dt:
+            start_dt = pd.to_datetime(start_dt)
+            expr &= ds.field("year") >= start_dt.year
+            expr &= ds.field("date") >= start_dt.to_pydatetime()
+        if end_dt:
+            end_dt = pd.to_datetime(end_dt)
+            expr &= ds.field("year") <= end_dt.year
+            expr &= ds.field("date") <= end_dt.to_pydatetime()
+
+        dataset = ds.dataset(
+            self.path,
+            schema=DATASET_SCHEMA,
+            format="parquet",
+            partitioning=PARTITIONING,
+            filesystem=self.filesystem,
+        )
+        with metrics.timer("read"):
+            table = dataset.to_table(
+                columns=[c for c in columns if c in SCHEMA.names], filter=expr
+            )
+            df = table.to_pandas().reindex(columns=columns)
+        if "fund_cnpj" in df.columns:
+            # Same as returned by `Manager`
+            df["fund_cnpj"] = df["fund_cnpj"].astype("category")
+        metrics.incr("rows_read", len(df))
+
+        return df.astype(dtype) if dtype else df
+
+    def last_date(self) -> Optional[datetime]:
+        partitions = self._partitions()
+        if partitions:
+            path = self._partition_path(*partitions[-1])
+            with self.filesystem.open_input_file(path) as fp:
+                dates = pq.read_table(fp, columns=["date"]).column("date")
+            return pd.Timestamp(pc.max(dates).as_py())
+
+    def _rollup_path(self, name: str) -> str:
+        return os.path.join(self.path, ROLLUPS_DIR, f"{name}.parquet")
+
+    def write_rollup(self, name: str, df: pd.DataFrame, dates: Sequence[datetime]):
+        path = self._rollup_path(name)
+        with self._lock(ROLLUPS_DIR, name):
+            if os.path.exists(path):
+                stored = pq.read_table(path).to_pandas()
+                stored = stored.loc[~stored["date"].isin(pd.DatetimeIndex(dates))]
+                df = pd.concat([stored, df]) if not df.empty else stored
+            if df.empty and not os.path.exists(path):
+                return
+
+            table = pa.Table.from_pandas(
+                df.sort_values(list(df.columns[:2])), preserve_index=False
+            )
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.tmp"
+            pq.write_table(table, temp_path)
+            os.replace(temp_path, path)
+
+    def read_rollup(
+        self,
+        name: str,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        where: Optional[Dict[str, Sequence[str]]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        path = self._rollup_path(name)
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=columns)
+
+        filters = []
+        if start_dt:
+            filters.append(("date", ">=", pd.Timestamp(start_dt)))
+        if end_dt:
+            filters.append(("date", "<=", pd.Timestamp(end_dt)))
+        for column, values in (where or {}).items():
+            filters.append((column, "in", list(values)))
+
+        # Opened once, such that footer and pages come from the same file even
+        # if a writer replaces it meanwhile
+        with self.filesystem.open_input_file(path) as fp:
+            table = pq.read_table(
+                fp,
+                columns=list(columns) if columns else None,
+                filters=filters or None,
+            )
+
+        return table.to_pandas()
+
+    def read_jobs(self, names: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        try:
+            with open(os.path.join(self.path, JOBS_FILENAME)) as fp:
+                jobs = json.load(fp)
+        except FileNotFoundError:
+            jobs = {}
+
+        if names is not None:
+            jobs = {name: jobs[name] for name in names if name in jobs}
+
+        return jobs
+
+    def write_job(self, name: str, fields: dict):
+        with self._jobs_lock():
+            jobs = self.read_jobs()
+            jobs[name] = {**jobs.get(name, {}), **fields}
+            self._write_jobs(jobs)
+
+    def claim_job(
+        self, names: Optional[Sequence[str]], worker: str, lease: float
+    ) -> Optional[Tuple[str, dict]]:
+        with self._jobs_lock():
+            jobs = self.read_jobs()
+            now = time.time()
+            for name in sorted(jobs if names is None else names):
+                job = jobs.get(name, {})
+                if job.get("queued") and (
+                    not job.get("lease_until") or job["lease_until"] < now
+                ):
+                    jobs[name] = {**job, "worker": worker, "lease_until": now + lease}
+                    self._write_jobs(jobs)
+                    return name, job
+
+    def renew_lease(self, name: str, worker: str, lease: float) -> bool:
+        with self._jobs_lock():
+            jobs = self.read_jobs()
+            job = jobs.get(name, {})
+            if not (job.get("queued") and job.get("worker") == worker):
+                return False
+            jobs[name] = {**job, "lease_until": time.time() + lease}
+            self._write_jobs(jobs)
+
+            return True
+
+    def _jobs_lock(self):
+        return self._lock("jobs")
+
+    def _write_jobs(self, jobs: Dict[str, dict]):
+        path = os.path.join(self.path, JOBS_FILENAME)
+        with open(f"{path}.tmp", "w") as fp:
+            json.dump(jobs, fp, default=str)
+        os.replace(f"{path}.tmp", path)
@@ -0,0 +1,161 @@
+"""
+bzfunds.rollups
+~~~~~~~~~~~~~~~
+
+Monthly and yearly aggregates (i.e. rollups) of stored data, both per fund and
+per `fund_type`, maintained by the storage backend as data is ingested.
+
+For each numeric field, rollups hold its `sum`, `count` (of valid observations),
+`mean` and `last` (valid) value over each period. Rollups per `fund_type` are
+computed from those per fund: `sum`, `count` and `last` are summed across funds
+(e.g. `total_equity_last` is the total equity of each type at the end of each
+period), `mean` is always `sum / count`, and `n_funds` is the # of funds. As
+NAVs are per share (i.e. not additive across funds), they are only rolled up
+per fund.
+
+Rows are dated by the start of their period (e.g. `2021-01-01` for both
+January 2021 and the year 2021).
+"""
+
+import threading
+from datetime import datetime
+from typing import Iterable, Union
+
+import pandas as pd
+
+from .storage import Storage
+
+
+__all__ = ("update_rollups",)
+
+
+# Globals
+# ----
+FIELDS = (
+    "total_portfolio",
+    "nav",
+    "total_equity",
+    "subscriptions",
+    "redemptions",
+    "n_shareholders",
+)
+TYPE_FIELDS = tuple(field for field in FIELDS if field != "nav")
+FREQS = ("monthly", "yearly")
+LEVELS = {"fund": "fund_cnpj", "fund_type": "fund_type"}
+
+# Rollups are read back while being updated (i.e. yearly from monthly)
+_LOCK = threading.Lock()
+
+
+def rollup_name(freq: str, by: str) -> str:
+    """Return the name under which a rollup is stored, e.g. `monthly_fund`"""
+    return f"{freq}_{by}"
+
+
+def _finalize(
+    df: pd.DataFrame, key: str, fields: Iterable[str] = FIELDS
+) -> pd.DataFrame:
+    """Mask empty aggregates, compute `mean` columns and sort columns of a rollup"""
+    columns = []
+    for field in fields:
+        empty = df[f"{field}_count"] == 0
+        df.loc[empty, [f"{field}_sum", f"{field}_last"]] = float("nan")
+        df[f"{field}_mean"] = df[f"{field}_sum"] / df[f"{field}_count"].where(~empty)
+        columns.extend(f"{field}_{agg}" for agg in ("sum", "count", "mean", "last"))
+
+    extra = ["fund_type"] if key == "fund_cnpj" else ["n_funds"]
+
+    return df.reset_index()[["date", key, *extra, *columns]]
+
+
+def _fund_rollup(df: pd.DataFrame, freq: str, aggs: dict) -> pd.DataFrame:
+    """Aggregate `df` per fund and period of `freq` (rows must be sorted by `date`)"""
+    dates = pd.to_datetime(df["date"]).dt.to_period(freq).dt.start_time
+    grouped = df.groupby(
+        [dates.rename("date"), df["fund_cnpj"]], sort=False, observed=True
+    )
+    res = grouped.agg(fund_type=("fund_type", "last"), **aggs)
+
+    return _finalize(res, "fund_cnpj")
+
+
+def monthly_rollup(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate daily rows (e.g. from `Storage.read_df`) into monthly rollups per fund"""
+    df = df.reindex(columns=["date", "fund_cnpj", "fund_type", *FIELDS])
+    df = df.astype({field: "float64" for field in FIELDS})
+    aggs = {}
+    for field in FIELDS:
+        aggs[f"{field}_sum"] = (field, "sum")
+        aggs[f"{field}_count"] = (field, "count")
+        aggs[f"{field}_last"] = (field, "last")
+
+    return _fund_rollup(df.sort_values("date", kind="stable"), "M", aggs)
+
+
+def yearly_rollup(monthly: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate monthly rollups per fund into yearly rollups per fund"""
+    aggs = {}
+    for field in FIELDS:
+        aggs[f"{field}_sum"] = (f"{field}_sum", "sum")
+        aggs[f"{field}_count"] = (f"{field}_count", "sum")
+        aggs[f"{field}_last"] = (f"{field}_last", "last")
+
+    return _fund_rollup(monthly.sort_values("date", kind="stable"), "Y", aggs)
+
+
+def fund_type_rollup(rollup: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate rollups per fund into rollups per `fund_type`"""
+    grouped = rollup.groupby(["date", "fund_type"], sort=False, observed=True)
+    aggs = {"n_funds": ("fund_cnpj", "size")}
+    for field in TYPE_FIELDS:
+        for agg in ("sum", "count", "last"):
+            aggs[f"{field}_{agg}"] = (f"{field}_{agg}", "sum")
+
+    return _finalize(grouped.agg(**aggs), "fund_type", TYPE_FIELDS)
+
+
+def update_rollups(manager: Storage, dates: Iterable[Union[str, datetime]]):
+    """Recompute all rollups of the months (and years) spanned by `dates`
+
+    Monthly rollups are computed from the daily rows stored in `manager`, and
+    yearly ones from the monthly rollups of each year. Called by `get_history`
+    for each month committed, but can also be used to (re)build rollups of
+    data already stored.
+
+    ...
+
+    Parameters
+    ----------
+    manager : `Storage`
+    dates : `list`
+        any dates within the months to update
+    """
+    months = pd.DatetimeIndex(pd.to_datetime(pd.Series(list(dates))).dropna())
+    months = months.to_period("M").unique().sort_values()
+    if months.empty:
+        return
+
+    columns = ["date", "fund_cnpj", "fund_type", *FIELDS]
+    with _LOCK:
+        for month in months:
+            df = manager.read_df(
+                None, month.start_time, month.end_time.normalize(), columns=columns
+            )
+            monthly = monthly_rollup(df) if not df.empty else pd.DataFrame()
+            _write_rollups(manager, "monthly", monthly, month.start_time)
+
+        for year in months.asfreq("Y").unique():
+            monthly = manager.read_rollup(
+                rollup_name("monthly", "fund"),
+                year.start_time,
+                year.end_time.normalize(),
+            )
+            yearly = yearly_rollup(monthly) if not monthly.empty else pd.DataFrame()
+            _write_rollups(manager, "yearly", yearly, year.start_time)
+
+
+def _write_rollups(manager: Storage, freq: str, rollup: pd.DataFrame, date: datetime):
+    """Replace the rollups per fund and per `fund_type` of a single period"""
+    by_type = fund_type_rollup(rollup) if not rollup.empty else rollup
+    manager.write_rollup(rollup_name(freq, "fund"), rollup, [date])
+    manager.write_rollup(rollup_name(freq, "fund_type"), by_type, [date])
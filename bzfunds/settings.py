@@ -10,8 +10,21 @@ as well).
 
 import os
 
+from .constants import API_ENDPOINT as CVM_API_ENDPOINT
 
-__all__ = ("LOGGING_LEVEL", "LOGGING_FORMAT", "MONGODB")
+
+__all__ = (
+    "LOGGING_LEVEL",
+    "LOGGING_FORMAT",
+    "API_ENDPOINT",
+    "INGESTION_CHUNKSIZE",
+    "UPDATE_LOOKBACK_MONTHS",
+    "CACHE",
+    "QUERY_CACHE",
+    "STORAGE_BACKEND",
+    "MONGODB",
+    "PARQUET",
+)
 
 
 # General
@@ -20,6 +33,46 @@ LOGGING_LEVEL = os.environ.get("LOGGING_LEVEL", "INFO")
 LOGGING_FORMAT = "%(levelname)s - bzfunds.%(module)s.%(funcName)s - %(message)s"
 
 
+# Ingestion
+# ----
+# Base `url` of raw files, e.g. a mirror or a local server (see `benchmarks/`)
+API_ENDPOINT = os.environ.get("API_ENDPOINT", CVM_API_ENDPOINT)
+
+# Max # of rows parsed and written at a time when downloading monthly files
+INGESTION_CHUNKSIZE = int(os.environ.get("INGESTION_CHUNKSIZE", 50_000))
+
+# CVM may restate recent data, so updates go back this many months before the
+# last stored date (only new or restated rows are written)
+UPDATE_LOOKBACK_MONTHS = int(os.environ.get("UPDATE_LOOKBACK_MONTHS", 1))
+
+
+# Download cache
+# ----
+# Raw files are only cached if a `path` is set (see `bzfunds.cache.DownloadCache`)
+CACHE = {
+    "path": os.environ.get("CACHE_PATH"),
+    "max_size": int(os.environ.get("CACHE_MAX_SIZE", 10 * 1024**3)),
+}
+
+
+# Query cache
+# ----
+# Results of `get_data` are only cached if `max_size` (bytes) is set, in memory
+# and optionally in `path` (see `bzfunds.cache.QueryCache`). Without a `path`,
+# results expire after `ttl` seconds, as writes by other processes go unnoticed
+QUERY_CACHE = {
+    "max_size": int(os.environ.get("QUERY_CACHE_MAX_SIZE", 0)),
+    "path": os.environ.get("QUERY_CACHE_PATH"),
+    "ttl": float(os.environ.get("QUERY_CACHE_TTL", 300)),
+}
+
+
+# Storage
+# ----
+# Either `mongodb` (see `MONGODB`) or `parquet` (see `PARQUET`)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "mongodb")
+
+
 # MongoDB
 # ----
 MONGODB = {
@@ -29,4 +82,13 @@ MONGODB = {
     "collection": "funds",
     "username": os.environ.get("MONGODB_USERNAME"),
     "password": os.environ.get("MONGODB_PASSWORD"),
+    # Either `flat` (one document per row) or `bucketed` (per fund per month)
+    "layout": os.environ.get("MONGODB_LAYOUT", "flat"),
+}
+
+
+# Parquet
+# ----
+PARQUET = {
+    "path": os.environ.get("PARQUET_PATH", os.path.expanduser("~/bzfundsDB")),
 }
@@ -0,0 +1,374 @@
+"""
+bzfunds.storage
+~~~~~~~~~~~~~~~
+
+Interface implemented by all storage backends, i.e. `bzfunds.dbm.Manager`
+(MongoDB) and `bzfunds.parquet.ParquetManager` (local Parquet dataset).
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import (
+    TYPE_CHECKING,
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import pandas as pd
+
+from .constants import API_FIRST_VALID_DATE, API_INDEX_COLUMNS, CHECKSUM_COLUMN
+
+
+if TYPE_CHECKING:
+    from .cache import QueryCache
+
+
+__all__ = ("Storage",)
+
+
+# Globals
+# ----
+DEFAULT_CHUNKSIZE = 100_000
+
+
+class Storage(ABC):
+    """Base class of storage backends
+
+    Backends store one row per (`date`, `fund_cnpj`) pair, along with its
+    `CHECKSUM_COLUMN`, and must implement `write_df`, `read_df` and `last_date`,
+    as well as `write_rollup` and `read_rollup` to store aggregates, and
+    `read_jobs`, `write_job`, `claim_job` and `renew_lease` to store a job ledger.
+
+    If a `query_cache` is attached, backends must call `_invalidate` with the
+    dates of all rows written (see `bzfunds.cache.QueryCache`).
+    """
+
+    query_cache: Optional["QueryCache"] = None
+
+    @abstractmethod
+    def write_df(
+        self, df: pd.DataFrame, *, upsert: bool = False, **kwargs
+    ) -> Dict[str, int]:
+        """Write a `DataFrame` retrieved from `get_monthly_data`
+
+        Rows are stored along with their `CHECKSUM_COLUMN` (computed if missing).
+        By default, rows already stored are skipped. If `upsert=True`, stored rows
+        are overwritten.
+
+        Returns the # of rows `inserted`, `upserted`, `modified` and `skipped`.
+        """
+
+    @abstractmethod
+    def read_df(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+    ) -> pd.DataFrame:
+        """Return stored rows matching all filters, in no particular order
+
+        ...
+
+        Parameters
+        ----------
+        funds : `list`
+        start_dt : `str` or `datetime`
+        end_dt : `str` or `datetime`
+        columns : `list`
+            columns to return. Defaults to all columns in `API_COLUMNS_MAP`
+        dtype : `dict`
+            optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+        """
+
+    def iter_df(
+        self,
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+        chunksize: int = DEFAULT_CHUNKSIZE,
+        monthly: bool = False,
+    ) -> Iterator[pd.DataFrame]:
+        """Yield stored rows matching all filters sorted by `date`, in frames of
+        up to `chunksize` rows (or one per month, if `monthly=True`)
+
+        By default, months are read (thru `read_df`) one at a time, such that
+        peak memory is bounded by a single month. Backends may override it to
+        stream rows instead.
+
+        ...
+
+        Parameters
+        ----------
+        funds : `list`
+        start_dt : `str` or `datetime`
+        end_dt : `str` or `datetime`
+        columns : `list`
+            columns to return (must include `date`). Defaults to all columns
+        dtype : `dict`
+            optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+        chunksize : `int`
+            max # of rows per frame (ignored if `monthly=True`)
+        monthly : `bool`
+            if True, will yield a single frame per calendar month
+        """
+        start_dt = pd.Timestamp(start_dt or API_FIRST_VALID_DATE)
+        end_dt = pd.Timestamp(end_dt) if end_dt else self.last_date()
+        if end_dt is None:
+            return
+
+        months = (
+            self.read_df(
+                funds,
+                max(month.start_time, start_dt),
+                min(month.end_time, pd.Timestamp(end_dt)),
+                columns=columns,
+                dtype=dtype,
+            )
+            for month in pd.period_range(start_dt, end_dt, freq="M")
+        )
+        months = (
+            df.sort_values("date", kind="stable", ignore_index=True)
+            for df in months
+            if not df.empty
+        )
+        yield from months if monthly else _rechunk(months, chunksize)
+
+    def read_snapshot(
+        self,
+        as_of: Union[str, datetime],
+        funds: Optional[Sequence[str]] = None,
+        start_dt: Optional[Union[str, datetime]] = None,
+        *,
+        columns: Optional[Sequence[str]] = None,
+        dtype: Optional[Dict[str, str]] = None,
+    ) -> pd.DataFrame:
+        """Return the last stored row of each fund dated at or before `as_of`
+        (and not before `start_dt`), i.e. one row per fund, in no particular order
+
+        By default, all rows from `start_dt` to `as_of` are read (thru `read_df`)
+        and reduced to the last of each fund. Backends may override it to
+        resolve them server-side instead.
+
+        ...
+
+        Parameters
+        ----------
+        as_of : `str` or `datetime`
+        funds : `list`
+        start_dt : `str` or `datetime`
+            earliest `date` considered, i.e. funds without any row from
+            `start_dt` to `as_of` are left out
+        columns : `list`
+            columns to return (must include `date` and `fund_cnpj`). Defaults
+            to all columns
+        dtype : `dict`
+            optional (column -> dtype) map, e.g. `{"nav": "float32"}`
+        """
+        df = self.read_df(funds, start_dt, as_of, columns=columns, dtype=dtype)
+        if df.empty:
+            return df
+
+        # Funds' last rows, i.e. the first of each after sorting by descending date
+        df = df.sort_values("date", ascending=False, kind="stable")
+
+        return df.drop_duplicates("fund_cnpj").reset_index(drop=True)
+
+    @abstractmethod
+    def last_date(self) -> Optional[datetime]:
+        """Return the most recent `date` stored, if any"""
+
+    @abstractmethod
+    def write_rollup(self, name: str, df: pd.DataFrame, dates: Sequence[datetime]):
+        """Replace all rows of rollup `name` dated any of `dates` by `df`
+
+        See `bzfunds.rollups`.
+        """
+
+    @abstractmethod
+    def read_rollup(
+        self,
+        name: str,
+        start_dt: Optional[Union[str, datetime]] = None,
+        end_dt: Optional[Union[str, datetime]] = None,
+        *,
+        where: Optional[Dict[str, Sequence[str]]] = None,
+        columns: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        """Return rows of rollup `name` matching all filters, in no particular order
+
+        ...
+
+        Parameters
+        ----------
+        name : `str`
+        start_dt : `str` or `datetime`
+        end_dt : `str` or `datetime`
+        where : `dict`
+            optional (column -> values) filters, e.g. `{"fund_type": ["FI"]}`
+        columns : `list`
+            columns to return. Defaults to all columns
+        """
+
+    @abstractmethod
+    def read_jobs(self, names: Optional[Sequence[str]] = None) -> Dict[str, dict]:
+        """Return the (name -> fields) of all jobs (or `names`) in the job ledger
+
+        See `bzfunds.backfill`.
+        """
+
+    @abstractmethod
+    def write_job(self, name: str, fields: dict):
+        """Create or update (i.e. merge `fields` into) job `name` of the job ledger"""
+
+    @abstractmethod
+    def claim_job(
+        self, names: Optional[Sequence[str]], worker: str, lease: float
+    ) -> Optional[Tuple[str, dict]]:
+        """Atomically claim any `queued` job (of `names`, if provided) which is
+        either not leased or whose lease expired, and return its name and fields
+        (as of before the claim), if any
+
+        The job's `worker` is set to `worker` and its `lease_until` (a Unix
+        timestamp) to `lease` seconds from now. Jobs currently leased (even by
+        `worker` itself, e.g. by another of its threads) are never claimed, see
+        `renew_lease`. See `bzfunds.backfill`.
+        """
+
+    @abstractmethod
+    def renew_lease(self, name: str, worker: str, lease: float) -> bool:
+        """Atomically extend the lease of job `name` to `lease` seconds from now,
+        if it is still `queued` and leased by `worker`, and return whether it was
+        """
+
+    def copy_from(
+        self, source: "Storage", *, rollups: bool = True, jobs: bool = True
+    ) -> Dict[str, int]:
+        """Copy all rows stored in `source` (e.g. of a different layout or backend)
+        into this backend, one month at a time, and return the # of rows written
+
+        Existing rows are overwritten, so interrupted copies can be resumed by
+        copying again. Rollups and the job ledger are also copied (if `rollups`
+        and `jobs`), such that this backend can replace `source`.
+
+        ...
+
+        Parameters
+        ----------
+        source : `Storage`
+        rollups : `bool`
+            if True, will also copy all rollups (see `bzfunds.rollups`)
+        jobs : `bool`
+            if True, will also copy the job ledger (see `bzfunds.backfill`)
+        """
+        from .rollups import FREQS, LEVELS, rollup_name
+
+        counts = {}
+        for df in source.iter_df(monthly=True):
+            for k, v in self.write_df(df, upsert=True).items():
+                counts[k] = counts.get(k, 0) + v
+
+        if rollups:
+            for name in (rollup_name(f, by) for f in FREQS for by in LEVELS):
+                df = source.read_rollup(name)
+                if not df.empty:
+                    self.write_rollup(name, df, df["date"].unique())
+        if jobs:
+            for name, fields in source.read_jobs().items():
+                self.write_job(name, fields)
+
+        return counts
+
+    def _invalidate(self, dates: pd.Series):
+        """Evict cached query results overlapping any month of `dates`"""
+        if self.query_cache is not None:
+            self.query_cache.invalidate(dates)
+
+    def filter_changed(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Return the rows of `df` which are either new or differ from those stored
+
+        Rows are compared thru their `CHECKSUM_COLUMN`, which is added to the
+        returned `DataFrame`.
+
+        ...
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            must have both `date` and `fund_cnpj` as columns
+        """
+        assert "date" in df.columns, "Must `reset_index()` before filtering"
+        from .utils import hash_rows
+
+        df = df.assign(**{CHECKSUM_COLUMN: hash_rows(df)})
+        if df.empty:
+            return df
+
+        # Read checksums as `object`, as missing ones would otherwise cast to `float`
+        keys = [*API_INDEX_COLUMNS, CHECKSUM_COLUMN]
+        stored = self.read_df(
+            df["fund_cnpj"].unique().tolist(),
+            df["date"].min(),
+            df["date"].max(),
+            columns=keys,
+            dtype={CHECKSUM_COLUMN: "object"},
+        )
+        stored = stored.dropna(subset=[CHECKSUM_COLUMN])
+        if stored.empty:
+            return df
+
+        # Unchanged rows match on both the unique index and their checksum
+        stored["date"] = pd.to_datetime(stored["date"]).astype(df["date"].dtype)
+        stored[CHECKSUM_COLUMN] = stored[CHECKSUM_COLUMN].astype("int64")
+        unchanged = pd.MultiIndex.from_frame(df[keys]).isin(
+            pd.MultiIndex.from_frame(stored[keys])
+        )
+
+        return df.loc[~unchanged]
+
+    def update_df(self, df: pd.DataFrame, **kwargs) -> Dict[str, int]:
+        """Write only the rows of `df` that are new or changed (i.e. a `diff`)
+
+        ...
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+        kwargs
+            forwarded to `write_df`
+        """
+        df = self.filter_changed(df)
+        if df.empty:
+            return {"inserted": 0, "upserted": 0, "modified": 0, "skipped": 0}
+
+        return self.write_df(df, upsert=True, **kwargs)
+
+
+def _rechunk(frames: Iterable[pd.DataFrame], chunksize: int) -> Iterator[pd.DataFrame]:
+    """Yield the rows of `frames` (in order) in frames of `chunksize` rows, but
+    for the last one
+    """
+    pending, n_rows = [], 0
+    for df in frames:
+        pending.append(df)
+        n_rows += len(df)
+        if n_rows >= chunksize:
+            df = pd.concat(pending, ignore_index=True)
+            n_full = n_rows - n_rows % chunksize
+            for i in range(0, n_full, chunksize):
+                yield df.iloc[i : i + chunksize].reset_index(drop=True)
+            pending = [df.iloc[n_full:]]
+            n_rows -= n_full
+
+    if n_rows:
+        yield pd.concat(pending, ignore_index=True)
@@ -0,0 +1,353 @@
+"""
+bzfunds.sync
+~~~~~~~~~~~~
+
+Long-running sync service, i.e. a resident process which keeps its HTTP
+session and storage backend (e.g. `MongoClient`) open, and polls the most
+recent monthly files for updates.
+
+Each poll sends a single `HEAD` request per file, comparing its `ETag`,
+`Last-Modified` and `Content-Length` headers against those recorded (in the
+job ledger, see `bzfunds.backfill`) when it was last committed. Only files
+which have changed are downloaded and committed, as backfill jobs (i.e. they
+are still skipped if their checksum is unchanged, and only rows that are new
+or restated are written).
+
+The service's state and metrics (see `bzfunds.metrics`) can be served over
+HTTP, at `/health` and `/metrics` (in Prometheus' text format).
+
+Usage::
+
+    python -m bzfunds sync --interval 300 --port 8000
+"""
+
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory
+from typing import List, Optional
+
+import pandas as pd
+import requests
+from typeguard import typechecked
+
+from . import metrics
+from .backfill import (
+    DEFAULT_BACKOFF,
+    DEFAULT_RETRIES,
+    DONE_STATES,
+    _run_job,
+    job_name,
+)
+from .cache import DownloadCache
+from .data import _make_session
+from .storage import Storage
+from .utils import get_url_from_date
+
+
+__all__ = ("Syncer", "sync")
+
+
+logger = logging.getLogger(__name__)
+
+
+# Globals
+# ----
+DEFAULT_INTERVAL = 300.0  # Seconds between polls
+DEFAULT_MONTHS = 2  # i.e. the current and previous months
+HEAD_TIMEOUT = 30.0
+
+
+def _utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class Syncer:
+    """Polls the monthly files of the last `months` months, committing those
+    which have changed since their last download
+
+    ...
+
+    Parameters
+    ----------
+    manager : `Storage`
+    months : `int`
+        # of months polled, up to the current one
+    cache : `DownloadCache`
+        if provided, raw files are downloaded thru (and stored in) the cache
+    retries : `int`
+        max # of retries of each download
+    backoff : `float`
+        seconds before the first retry of a download, doubled at each retry
+    rollups : `bool`
+        if True, will update `manager`'s rollups of all months committed
+    """
+
+    def __init__(
+        self,
+        manager: Storage,
+        *,
+        months: int = DEFAULT_MONTHS,
+        cache: Optional[DownloadCache] = None,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = DEFAULT_BACKOFF,
+        rollups: bool = True,
+    ):
+        if months < 1:
+            raise ValueError("`months` must be >= 1")
+
+        self.manager = manager
+        self.months = months
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.rollups = rollups
+        self.session = _make_session(months)
+
+        self.polls = 0
+        self.last_poll = None
+        self.last_change = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def _dates(self) -> List[datetime]:
+        """Return the first day of each month polled, up to the current one"""
+        current = pd.Timestamp.today().to_period("M")
+        months = [current - i for i in reversed(range(self.months))]
+
+        return [month.start_time.to_pydatetime() for month in months]
+
+    def _signature(self, url: str) -> Optional[dict]:
+        """Return the headers identifying the current version of the file at
+        `url`, or None if they are not available
+
+        Raises `requests.exceptions.HTTPError` if the file is not found.
+        """
+        res = self.session.head(url, allow_redirects=True, timeout=HEAD_TIMEOUT)
+        if res.status_code in (405, 501):  # i.e. `HEAD` not supported
+            return None
+        res.raise_for_status()
+
+        signature = {
+            "etag": res.headers.get("ETag"),
+            "last_modified": res.headers.get("Last-Modified"),
+            "size": res.headers.get("Content-Length"),
+        }
+        if not (signature["etag"] or signature["last_modified"]):
+            return None
+
+        return signature
+
+    def poll(self) -> List[str]:
+        """Check each file once, and commit those which have changed
+
+        Returns the job names of the files downloaded. Raises if any file could
+        not be checked or committed (though other files are still processed).
+        """
+        dates = self._dates()
+        names = [job_name(date, False) for date in dates]
+        ledger = self.manager.read_jobs(names)
+
+        changed, errors = [], []
+        with metrics.timer("sync.poll"), TemporaryDirectory() as temp_dir:
+            for name, date in zip(names, dates):
+                previous = ledger.get(name, {})
+                url = get_url_from_date(date)
+                try:
+                    # Headers are read *before* downloading, such that a file
+                    # published in between is downloaded again at the next poll
+                    signature = self._signature(url)
+                except requests.exceptions.HTTPError as e:
+                    if e.response is not None and e.response.status_code == 404:
+                        logger.debug(f"Job {name} - not published yet")
+                        continue
+                    errors.append(f"{name}: {e}")
+                    continue
+                except requests.exceptions.RequestException as e:
+                    errors.append(f"{name}: {e}")
+                    continue
+
+                if (
+                    signature is not None
+                    and previous.get("state") in DONE_STATES
+                    and previous.get("signature") == signature
+                ):
+                    continue
+
+                logger.info(f"Job {name} - file changed, downloading")
+                metrics.incr("sync_changes")
+                _run_job(
+                    name,
+                    date,
+                    False,
+                    manager=self.manager,
+                    previous=previous,
+                    temp_dir=temp_dir,
+                    cache=self.cache,
+                    session=self.session,
+                    retries=self.retries,
+                    backoff=self.backoff,
+                    incremental=True,
+                    rollups=self.rollups,
+                )
+                entry = self.manager.read_jobs([name]).get(name, {})
+                if entry.get("state") in DONE_STATES:
+                    self.manager.write_job(name, {"signature": signature})
+                    changed.append(name)
+                else:
+                    errors.append(f"{name}: {entry.get('error')}")
+
+        metrics.incr("sync_polls")
+        with self._lock:
+            self.polls += 1
+            self.last_poll = _utcnow()
+            if changed:
+                self.last_change = self.last_poll
+            self.last_error = "; ".join(errors) or None
+        if errors:
+            raise RuntimeError(f"Sync failed - {'; '.join(errors)}")
+
+        return changed
+
+    def run(
+        self,
+        interval: float = DEFAULT_INTERVAL,
+        *,
+        once: bool = False,
+        stop: Optional[threading.Event] = None,
+    ):
+        """Poll every `interval` seconds until `stop` is set (or only once)"""
+        stop = stop or threading.Event()
+        while True:
+            start = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                metrics.incr("sync_errors")
+                logger.error(str(e))
+                with self._lock:
+                    self.last_poll = _utcnow()
+                    self.last_error = str(e)
+            if once or stop.wait(max(interval - (time.monotonic() - start), 0)):
+                break
+
+    def health(self) -> dict:
+        with self._lock:
+            return {
+                "status": "error" if self.last_error else "ok",
+                "polls": self.polls,
+                "last_poll": self.last_poll,
+                "last_change": self.last_change,
+                "last_error": self.last_error,
+            }
+
+    def serve(self, port: int, host: str = "") -> ThreadingHTTPServer:
+        """Serve `/health` and `/metrics` on a background thread, and return
+        the server (i.e. to be `shutdown()`)
+        """
+        server = ThreadingHTTPServer((host, port), _HealthHandler)
+        server.syncer = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"Serving /health and /metrics on port {server.server_port}")
+
+        return server
+
+
+class _HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            health = self.server.syncer.health()
+            status = 200 if health["status"] == "ok" else 503
+            body, content_type = json.dumps(health).encode(), "application/json"
+        elif self.path == "/metrics":
+            status = 200
+            body = metrics.REGISTRY.to_prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args):
+        logger.debug(format % args)
+
+
+@typechecked
+def sync(
+    manager: Optional[Storage] = None,
+    *,
+    interval: float = DEFAULT_INTERVAL,
+    months: int = DEFAULT_MONTHS,
+    port: Optional[int] = None,
+    once: bool = False,
+    cache: Optional[DownloadCache] = None,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+    rollups: bool = True,
+    stop: Optional[threading.Event] = None,
+):
+    """Keep the last `months` months of data in sync with CVM, polling for
+    updates every `interval` seconds until interrupted (or `stop` is set)
+
+    Meant to run as a resident service (see `python -m bzfunds sync`), rather
+    than e.g. a `cronjob` calling `download_data(update_only=True)`, as its
+    HTTP and database connections are kept open between polls, and files are
+    only downloaded once they change.
+
+    ...
+
+    Parameters
+    ----------
+    manager : `Storage`
+        Defaults to `get_default_manager()`
+    interval : `float`
+        seconds between polls
+    months : `int`
+        # of months polled, up to the current one
+    port : `int`
+        if provided, will serve `/health` and `/metrics` on `port`
+    once : `bool`
+        if True, will poll only once
+    cache : `DownloadCache`
+        if provided, raw files are downloaded thru (and stored in) the cache
+    retries : `int`
+        max # of retries of each download
+    backoff : `float`
+        seconds before the first retry of a download, doubled at each retry
+    rollups : `bool`
+        if True, will update `manager`'s rollups of all months committed
+    stop : `threading.Event`
+        if provided, polling stops once set
+    """
+    if manager is None:
+        from .api import get_default_manager
+
+        manager = get_default_manager()
+
+    syncer = Syncer(
+        manager,
+        months=months,
+        cache=cache,
+        retries=retries,
+        backoff=backoff,
+        rollups=rollups,
+    )
+    server = syncer.serve(port) if port is not None else None
+    try:
+        syncer.run(interval, once=once, stop=stop)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        syncer.close()
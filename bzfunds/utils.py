@@ -5,15 +5,50 @@ bzfunds.utils
 General utils used within bzfunds
 """
 
+import codecs
+import io
+import os
 from datetime import datetime
-from typing import Union, TextIO
+from functools import lru_cache
+from importlib.util import find_spec
+from typing import BinaryIO, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
 
+import numpy as np
 import pandas as pd
 
-from .constants import API_COLUMNS_MAP, API_DATE_FORMAT, API_ENDPOINT, API_FILENAME_PREFIX
+from . import settings
+from .constants import (
+    API_COLUMNS_ALIASES,
+    API_COLUMNS_DTYPES,
+    API_COLUMNS_MAP,
+    API_DATE_FORMAT,
+    API_FILENAME_PREFIX,
+    API_INDEX_COLUMNS,
+)
 
 
-__all__ = ("get_url_from_date", "parse_csv")
+__all__ = (
+    "decode_cnpj",
+    "encode_cnpj",
+    "format_cnpj",
+    "get_url_from_date",
+    "hash_rows",
+    "iter_csv",
+    "parse_csv",
+)
+
+
+# Globals
+# ----
+HAS_PYARROW = find_spec("pyarrow") is not None
+
+# Raw column name -> standard (i.e. `API_COLUMNS_MAP`) raw column name
+RAW_COLUMNS = {**{c: c for c in API_COLUMNS_MAP}, **API_COLUMNS_ALIASES}
+RAW_DTYPES = {
+    raw: API_COLUMNS_DTYPES[c]
+    for raw, c in RAW_COLUMNS.items()
+    if c in API_COLUMNS_DTYPES
+}
 
 
 def get_url_from_date(date: datetime, zipped: bool = False) -> str:
@@ -22,7 +57,7 @@ def get_url_from_date(date: datetime, zipped: bool = False) -> str:
     **Note**: Because data is stored differently before and after `2016-12-31`,
     the `url` will have two different formats. In particular, dates
     before the cutoff date require downloading a zipped file for the
-    whole year.
+    whole year. Files are requested from `settings.API_ENDPOINT`.
 
     ...
 
@@ -34,18 +69,232 @@ def get_url_from_date(date: datetime, zipped: bool = False) -> str:
     date_str = date.strftime(API_DATE_FORMAT)
     if zipped:
         # Zipped folder with all monthly CSV files for that year
-        url = f"{API_ENDPOINT}/HIST/{API_FILENAME_PREFIX}{date.year}.zip"
+        url = f"{settings.API_ENDPOINT}/HIST/{API_FILENAME_PREFIX}{date.year}.zip"
     else:
         # Monthly `csv` file
-        url = f"{API_ENDPOINT}/{API_FILENAME_PREFIX}{date_str}.csv"
+        url = f"{settings.API_ENDPOINT}/{API_FILENAME_PREFIX}{date_str}.csv"
 
     return url
 
 
-def parse_csv(csv: Union[str, TextIO]) -> pd.DataFrame:
-    df = pd.read_csv(csv, sep=";")
-    df.rename(API_COLUMNS_MAP, axis=1, errors="ignore", inplace=True)
+def _format_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Rename raw columns and set a `DatetimeIndex` on a freshly read `DataFrame`"""
+    df = df.rename(RAW_COLUMNS, axis=1).rename(API_COLUMNS_MAP, axis=1)
     df = df.set_index("date")
-    df.index = pd.to_datetime(df.index, format="%Y-%m-%d")
+    if not pd.api.types.is_datetime64_any_dtype(df.index):
+        df.index = pd.to_datetime(df.index, format="%Y-%m-%d")
 
     return df
+
+
+class _Prepended(io.RawIOBase):
+    """Binary stream of `head` followed by the rest of `fp`"""
+
+    def __init__(self, head: bytes, fp: BinaryIO):
+        self._head = head
+        self._fp = fp
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._head:
+            data, self._head = self._head[: len(buffer)], self._head[len(buffer) :]
+        else:
+            data = self._fp.read(len(buffer))
+        buffer[: len(data)] = data
+
+        return len(data)
+
+
+def _read_header(
+    csv: Union[str, TextIO, BinaryIO]
+) -> Tuple[List[str], Union[str, TextIO, BinaryIO]]:
+    """Return the raw column names of `csv`, along with `csv` itself to be
+    parsed (i.e. including its header, even if it is a non-seekable stream)
+    """
+    if isinstance(csv, (str, os.PathLike)):
+        with open(csv, "rb") as fp:
+            line = fp.readline()
+    elif csv.seekable():
+        position = csv.tell()
+        line = csv.readline()
+        csv.seek(position)
+    else:
+        line = csv.readline()
+        if isinstance(line, str):
+            csv = io.StringIO(line + csv.read())
+        else:
+            csv = _Prepended(line, csv)
+
+    if isinstance(line, bytes):
+        if line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8) :]
+        line = line.decode("latin-1")
+
+    return line.lstrip("\ufeff").rstrip("\r\n").split(";"), csv
+
+
+def parse_csv(
+    csv: Union[str, TextIO, BinaryIO], *, engine: Optional[str] = None
+) -> pd.DataFrame:
+    """Parse a raw `csv` file into a formatted `DataFrame`
+
+    Only mapped columns (i.e. `API_COLUMNS_MAP`, or any of their aliases) are
+    loaded, with explicit dtypes (`API_COLUMNS_DTYPES`), and dates are parsed
+    while reading. Any other columns are ignored, as are missing ones (with
+    the `pyarrow` engine, the header is read first to select them).
+
+    ...
+
+    Parameters
+    ----------
+    csv : `str` or file-like
+    engine : `str`
+        `pd.read_csv` engine. Defaults to `pyarrow` if installed, else `c`
+    """
+    engine = engine or ("pyarrow" if HAS_PYARROW else "c")
+    if engine == "pyarrow":
+        header, csv = _read_header(csv)
+        usecols = [c for c in header if c in RAW_COLUMNS]
+        df = pd.read_csv(
+            csv,
+            sep=";",
+            engine="pyarrow",
+            usecols=usecols,
+            dtype={c: RAW_DTYPES[c] for c in usecols if c in RAW_DTYPES},
+        )
+    else:
+        df = pd.read_csv(csv, engine=engine, **_read_csv_kwargs())
+
+    return _format_df(df)
+
+
+def iter_csv(
+    csv: Union[str, TextIO, BinaryIO], chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """Lazily parse `csv`, yielding formatted `DataFrame`'s of up to `chunksize` rows
+
+    Same output as `parse_csv`, but only a single chunk is held in memory at
+    a time, which allows consuming (e.g. writing) a large file as it is read.
+
+    ...
+
+    Parameters
+    ----------
+    csv : `str` or file-like
+        path or buffer, which may be a raw (binary) HTTP response stream
+    chunksize : `int`
+        max # of rows per yielded `DataFrame`
+    """
+    with pd.read_csv(csv, chunksize=chunksize, **_read_csv_kwargs()) as reader:
+        for df in reader:
+            yield _format_df(df)
+
+
+def _read_csv_kwargs() -> dict:
+    """Fixed schema used to read raw files with `pd.read_csv`"""
+    return {
+        "sep": ";",
+        "usecols": lambda c: c in RAW_COLUMNS,
+        "dtype": RAW_DTYPES,
+        "parse_dates": ["DT_COMPTC"],
+    }
+
+
+def hash_rows(df: pd.DataFrame) -> pd.Series:
+    """Return a (signed) 64-bit fingerprint of each row's values
+
+    Only the mapped (i.e. `API_COLUMNS_MAP`) columns other than the unique index
+    (`API_INDEX_COLUMNS`) are hashed, so the fingerprint can be used to detect
+    restated values for a given (`date`, `fund_cnpj`) pair. Numeric columns are
+    normalized to `float64`, such that the fingerprint doesn't depend on how a
+    given file's dtypes were inferred.
+
+    ...
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+    """
+    columns = [c for c in API_COLUMNS_MAP.values() if c not in API_INDEX_COLUMNS]
+    values = df.reindex(columns=columns)
+    for col in columns:
+        if pd.api.types.is_numeric_dtype(values[col]):
+            values[col] = values[col].astype("float64")
+        else:
+            values[col] = values[col].astype(str)
+
+    hashes = pd.util.hash_pandas_object(values, index=False)
+
+    return pd.Series(hashes.values.view("int64"), index=df.index)
+
+
+@lru_cache(maxsize=None)
+def format_cnpj(fund_id: int) -> str:
+    """Format an integer fund id (see `encode_cnpj`) as a CNPJ, e.g. `13.001.211/0001-90`"""
+    d = f"{fund_id:014d}"
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+
+def encode_cnpj(values: Iterable[Union[str, int]], errors: str = "raise") -> np.ndarray:
+    """Return the compact (`int64`) ids of funds' CNPJ, i.e. their 14 digits
+
+    Only unique values are parsed, so encoding a (long) column is cheap. Ids
+    are passed thru.
+
+    ...
+
+    Parameters
+    ----------
+    values : iterable
+        formatted (e.g. `13.001.211/0001-90`) or unformatted (`13001211000190`) CNPJs
+    errors : `str`
+        if `raise`, values without 14 digits raise `ValueError`. If `coerce`,
+        they are encoded as -1 (i.e. matching no fund), e.g. for queries
+    """
+    if isinstance(getattr(values, "dtype", None), pd.CategoricalDtype):
+        values = pd.Categorical(values)
+        codes, uniques = values.codes, values.categories
+    else:
+        codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    if (codes < 0).any() and errors == "raise":
+        raise ValueError("Missing CNPJ")
+
+    ids = np.empty(len(uniques), dtype="int64")
+    for i, value in enumerate(uniques):
+        if isinstance(value, (int, np.integer)):
+            ids[i] = value
+            continue
+
+        digits = "".join(c for c in str(value) if c.isdigit())
+        if len(digits) == 14:
+            ids[i] = int(digits)
+        elif errors == "raise":
+            raise ValueError(f"Invalid CNPJ: {value!r}")
+        else:
+            ids[i] = -1
+
+    return np.append(ids, -1)[codes]  # Missing values (i.e. code -1) as -1
+
+
+def decode_cnpj(ids: Iterable[Union[int, str]]) -> pd.Categorical:
+    """Return funds' formatted CNPJ from their ids (see `encode_cnpj`)
+
+    Only unique ids are formatted (thru a cache), and the CNPJs are returned as
+    a (sorted) `Categorical`, i.e. a single string per fund. Strings are passed
+    thru, e.g. those stored before ids were introduced.
+    """
+    codes, uniques = pd.factorize(np.asarray(ids, dtype=object))
+    categories = np.array(
+        [v if isinstance(v, str) else format_cnpj(int(v)) for v in uniques],
+        dtype=object,
+    )
+    order = np.argsort(categories)
+    ranks = np.empty_like(order)
+    ranks[order] = np.arange(len(order))
+
+    return pd.Categorical.from_codes(
+        np.where(codes >= 0, ranks[np.maximum(codes, 0)], -1),
+        categories[order],
+    )
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+
+import pandas as pd
+import pytest
+
+from bzfunds import settings
+from bzfunds.constants import API_FILENAME_PREFIX
+
+
+# Globals
+HEADER = "TP_FUNDO;CNPJ_FUNDO;DT_COMPTC;VL_TOTAL;VL_QUOTA;VL_PATRIM_LIQ;CAPTC_DIA;RESG_DIA;NR_COTST"
+
+
+@pytest.fixture
+def sample_df():
+    """Factory of frames shaped like those parsed from raw files, i.e. one row
+    per (`date`, `fund_cnpj`) pair, over `n_days` days from `start` (or `dates`)
+    """
+
+    def make(
+        n_funds: int = 10,
+        n_days: int = 5,
+        start: str = "2021-01-04",
+        dates: Optional[Sequence[str]] = None,
+    ) -> pd.DataFrame:
+        if dates is None:
+            dates = pd.date_range(start, periods=n_days)
+        funds = [f"00.000.000/{i:04d}-00" for i in range(n_funds)]
+        index = pd.MultiIndex.from_product(
+            [pd.to_datetime(dates), funds], names=["date", "fund_cnpj"]
+        )
+        df = pd.DataFrame(index=index).reset_index()
+        df["fund_type"] = "FI"
+        df["nav"] = 1.0
+        df["total_equity"] = 1e6
+        df["n_shareholders"] = 10
+
+        return df
+
+    return make
+
+
+class LocalServer(ThreadingHTTPServer):
+    """Stand-in for CVM's server (on a random local port), serving `files`
+
+    Files are served with their hash as `ETag` (honoring `If-None-Match`), and
+    the (path, status) of every `GET` is recorded in `hits`. Responses can be
+    delayed by `delay` seconds, and failed thru `fail`.
+    """
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.url = f"http://127.0.0.1:{self.server_port}"
+        self.files = {}
+        self.hits = []
+        self.failures = defaultdict(list)
+        self.delay = 0.0
+        self.active = 0
+        self.max_active = 0  # i.e. max # of concurrent `GET`s
+        self.lock = threading.Lock()
+
+    @property
+    def paths(self) -> list:
+        return [path for path, _ in self.hits]
+
+    def add_month(self, month: str, *rows: str):
+        """Serve the monthly file of `month` (e.g. `202101`), holding `rows`"""
+        self.files[f"/{API_FILENAME_PREFIX}{month}.csv"] = "\n".join(
+            [HEADER, *rows, ""]
+        )
+
+    @staticmethod
+    def row(date: str, nav: float = 1.0, fund: str = "00.000.000/0001-00") -> str:
+        """Return a raw line of a monthly file"""
+        return f"FI;{fund};{date};1;{nav};1;0;0;1"
+
+    def fail(self, path: str, status: Optional[int] = 503, times: int = 1):
+        """Respond the next `times` requests of `path` with `status`, or drop
+        their connection midway thru the body if `status=None`
+        """
+        self.failures[path].extend([status] * times)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.active += 1
+            server.max_active = max(server.active, server.max_active)
+        try:
+            time.sleep(server.delay)
+            self._respond(send_body=True)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def _respond(self, send_body: bool):
+        body = self.server.files.get(self.path)
+        if isinstance(body, str):
+            body = body.encode()
+        etag = f'"{hash(body)}"'
+
+        status = 200 if body is not None else 404
+        if send_body and self.server.failures.get(self.path):
+            status = self.server.failures[self.path].pop(0)
+        elif status == 200 and self.headers.get("If-None-Match") == etag:
+            status = 304
+        if send_body:
+            self.server.hits.append((self.path, status))
+
+        if status is None:
+            # i.e. the connection is closed before the whole body is sent
+            self.send_response(200)
+            self.send_header("Content-Length", str(2 * len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(status)
+        if status != 200:
+            self.end_headers()
+            return
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def local_server(monkeypatch):
+    """`LocalServer` set as the `API_ENDPOINT`"""
+    server = LocalServer()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(settings, "API_ENDPOINT", server.url)
+    yield server
+    server.shutdown()
+    server.server_close()
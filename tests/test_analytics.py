@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from bzfunds.analytics import *
+
+
+# Globals
+dates = pd.bdate_range("2021-01-04", periods=6, name="date")
+nav = pd.DataFrame(
+    {
+        "a": [1.0, 1.1, np.nan, 1.21, 1.089, 1.2],
+        "b": [np.nan, 2.0, 2.0, 1.0, np.nan, 2.0],
+    },
+    index=dates,
+)
+
+
+def test_returns_skip_missing_observations():
+    res = returns(nav)
+    assert np.allclose(
+        res["a"], [np.nan, 0.1, np.nan, 0.1, -0.1, 1.2 / 1.089 - 1], equal_nan=True
+    )
+    assert np.allclose(
+        res["b"], [np.nan, np.nan, 0.0, -0.5, np.nan, 1.0], equal_nan=True
+    )
+
+
+def test_cumulative_returns():
+    res = cumulative_returns(nav)
+    assert np.isclose(res["a"].iloc[-1], 0.2)
+    assert np.isclose(res["b"].iloc[-1], 0.0)
+
+
+def test_net_flows():
+    equity = pd.DataFrame({"a": [100.0, 110.0, 120.0]})
+    subs = pd.DataFrame({"a": [0.0, 11.0, np.nan]})
+    reds = pd.DataFrame({"a": [0.0, 0.0, 22.0]})
+    res = net_flows(subs, reds, equity)
+    assert np.allclose(res["a"], [np.nan, 0.11, -0.2], equal_nan=True)
+
+
+def test_returns_from_zero_nav():
+    res = returns(pd.DataFrame({"a": [1.0, 0.0, 0.0, 1.0, 1.1]}))
+    assert np.allclose(res["a"], [np.nan, -1.0, np.nan, np.nan, 0.1], equal_nan=True)
+
+
+def test_rolling_volatility_matches_pandas():
+    rets = returns(nav)
+    res = rolling_volatility(rets, 3, min_periods=2, annualize=False)
+    expected = rets.rolling(3, min_periods=2).std()
+    assert np.allclose(res, expected, equal_nan=True)
+
+    # Windows recover from invalid values, and don't lose precision to a large mean
+    rng = np.random.default_rng(0)
+    rets = pd.DataFrame(
+        {
+            "a": [1.0, np.inf, *rng.normal(0, 0.01, 8)],
+            "b": 1000 + rng.normal(0, 1e-4, 10),
+        }
+    )
+    res = rolling_volatility(rets, 3, annualize=False)
+    expected = rets.rolling(3).std()
+    assert res["a"].notna().sum() == expected["a"].notna().sum() == 6
+    assert np.allclose(res, expected, rtol=1e-6, equal_nan=True)
+
+
+def test_max_drawdown():
+    res = max_drawdown(nav)
+    assert np.isclose(res["a"], -0.1)
+    assert np.isclose(res["b"], -0.5)
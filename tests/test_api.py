@@ -1,6 +1,10 @@
+import os
+import subprocess
+import sys
+
 import pytest
 
-from bzfunds.api import download_data, get_data
+from bzfunds.api import download_data, get_data, get_panel
 
 
 def test_download_data_raises_on_bad_arguments():
@@ -22,3 +26,41 @@ def test_get_data_success_query():
     assert df.size
     assert df.index.name == "date"
     assert "fund_cnpj" in df.columns
+
+
+def test_get_data_columns_and_dtypes():
+    df = get_data(funds="13.001.211/0001-90", columns=["nav"], dtype={"nav": "float32"})
+    assert df.index.name == "date"
+    assert list(df.columns) == ["nav"]
+    assert df["nav"].dtype == "float32"
+
+
+def test_get_panel():
+    df = get_panel("nav", funds="13.001.211/0001-90", end_dt="2021-12-31")
+    assert df.index.name == "date"
+    assert df.index.is_monotonic_increasing
+    assert list(df.columns) == ["13.001.211/0001-90"]
+
+    with pytest.raises(ValueError):
+        get_panel("fund_type")
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, bzfunds; "
+        "from bzfunds.dbm import Manager; "
+        "Manager('invalidhost', serverSelectionTimeoutMS=100); "
+        "assert 'bzfunds.api' not in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, timeout=10)
+
+
+def test_api_defers_download_dependencies():
+    # `requests` is only required to download data (i.e. not to query it)
+    code = (
+        "import sys, bzfunds.api, bzfunds.dbm; "
+        "assert 'requests' not in sys.modules; "
+        "assert 'bzfunds.data' not in sys.modules"
+    )
+    env = {k: v for k, v in os.environ.items() if k != "CACHE_PATH"}
+    subprocess.run([sys.executable, "-c", code], check=True, timeout=10, env=env)
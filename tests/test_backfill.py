@@ -0,0 +1,129 @@
+import multiprocessing
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from bzfunds import settings
+from bzfunds.backfill import backfill, enqueue, get_ledger, work
+from bzfunds.parquet import ParquetManager
+
+
+@pytest.fixture
+def endpoint(local_server):
+    """Serves January and February, failing the first request for February"""
+    local_server.add_month("202101", local_server.row("2021-01-04"))
+    local_server.add_month("202102", local_server.row("2021-02-01"))
+    local_server.fail("/inf_diario_fi_202102.csv")
+
+    return local_server
+
+
+def test_backfill_resumes_from_ledger(endpoint, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    report = backfill(
+        datetime(2021, 1, 1), datetime(2021, 3, 31), manager, n_jobs=2, backoff=0
+    )
+    assert report["state"].to_dict() == {
+        "2021-01": "committed",
+        "2021-02": "committed",
+        "2021-03": "empty",
+    }
+    assert report.loc["2021-02", "attempts"] == 1
+    assert len(manager.read_df()) == 2
+
+    # Completed jobs are skipped
+    endpoint.hits.clear()
+    backfill(datetime(2021, 1, 1), datetime(2021, 4, 30), manager, backoff=0)
+    assert endpoint.paths == ["/inf_diario_fi_202104.csv"]
+    assert get_ledger(manager)["state"].tolist()[-1] == "empty"
+
+
+def test_backfill_marks_failed_jobs(endpoint, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    report = backfill(
+        datetime(2021, 2, 1), datetime(2021, 2, 28), manager, retries=0, backoff=0
+    )
+    assert report.loc["2021-02", "state"] == "failed"
+    assert "503" in report.loc["2021-02", "error"]
+
+
+def test_backfill_commits_chunks(local_server, tmp_path, monkeypatch):
+    from bzfunds import backfill as module
+
+    rows = [local_server.row(f"2021-01-0{day}") for day in range(4, 7)]
+    local_server.add_month("202101", *rows)
+    monkeypatch.setattr(settings, "INGESTION_CHUNKSIZE", 1)
+    rollups = []
+    monkeypatch.setattr(
+        module, "update_rollups", lambda _, dates: rollups.append(dates)
+    )
+
+    manager = ParquetManager(str(tmp_path))
+    update_df = manager.update_df
+    written = []
+
+    def checked_update_df(df):
+        # Files are only checksummed (i.e. skipped later on) once committed
+        assert "checksum" not in manager.read_jobs()["2021-01"]
+        written.append(len(df))
+        return update_df(df)
+
+    monkeypatch.setattr(manager, "update_df", checked_update_df)
+    report = backfill(datetime(2021, 1, 1), datetime(2021, 1, 31), manager)
+
+    assert written == [1, 1, 1]
+    assert rollups == [[pd.Timestamp("2021-01-01")]]
+    assert report.loc["2021-01", "rows"] == 3
+    assert len(manager.read_jobs()["2021-01"]["checksum"]) == 64
+
+
+def _work(path: str, url: str):
+    settings.API_ENDPOINT = url
+    work(ParquetManager(path), backoff=0)
+
+
+def test_workers_share_queue(endpoint, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    queued = enqueue(datetime(2021, 1, 1), datetime(2021, 3, 31), manager)
+    assert queued == ["2021-01", "2021-02", "2021-03"]
+
+    ctx = multiprocessing.get_context("spawn")
+    workers = [
+        ctx.Process(target=_work, args=(str(tmp_path), endpoint.url)) for _ in range(3)
+    ]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join(60)
+    assert [p.exitcode for p in workers] == [0, 0, 0]
+
+    ledger = get_ledger(manager)
+    assert ledger["state"].tolist() == ["committed", "committed", "empty"]
+    assert not ledger["queued"].any()
+    assert endpoint.paths.count("/inf_diario_fi_202101.csv") == 1
+    assert len(manager.read_df()) == 2
+
+
+def test_work_takes_over_expired_leases(endpoint, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    enqueue(datetime(2021, 1, 1), datetime(2021, 1, 31), manager)
+    assert manager.claim_job(None, "crashed", lease=0)[0] == "2021-01"
+    assert manager.claim_job(None, "other", lease=60)[0] == "2021-01"
+    assert manager.claim_job(None, "crashed", lease=60) is None
+
+    manager.write_job("2021-01", {"lease_until": 0})  # i.e. expired
+    assert work(manager, worker="crashed", backoff=0) == ["2021-01"]
+    assert get_ledger(manager).loc["2021-01", "state"] == "committed"
+    assert work(manager) == []
+
+
+def test_work_runs_each_job_once_across_threads(endpoint, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    enqueue(datetime(2021, 1, 1), datetime(2021, 3, 31), manager)
+
+    assert work(manager, n_jobs=3, backoff=0) == ["2021-01", "2021-02", "2021-03"]
+    assert endpoint.paths.count("/inf_diario_fi_202101.csv") == 1
+    assert not manager.renew_lease("2021-01", "other", lease=60)
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from bzfunds.buckets import *
+
+
+@pytest.fixture
+def rows(sample_df) -> pd.DataFrame:
+    """Rows of 2 funds (by id) over 3 days, spanning 2 months"""
+    df = sample_df(n_funds=2, dates=["2021-01-28", "2021-01-29", "2021-02-01"])
+
+    return df[["date"]].assign(
+        fund_cnpj=[1, 2] * 3, nav=[1.0, 2.0, 1.1, 2.1, 1.2, 2.2], checksum=range(6)
+    )
+
+
+def test_iter_buckets(rows):
+    batches = list(iter_buckets(rows, batch_size=3))
+    buckets = [bucket for batch in batches for bucket in batch]
+    assert len(batches) == 2
+
+    keys = [key for key, _ in buckets]
+    assert keys == [
+        (1, datetime(2021, 1, 1)),
+        (2, datetime(2021, 1, 1)),
+        (1, datetime(2021, 2, 1)),
+        (2, datetime(2021, 2, 1)),
+    ]
+    assert buckets[0][1]["nav"] == [1.0, 1.1]
+    assert buckets[0][1]["date"] == [datetime(2021, 1, 28), datetime(2021, 1, 29)]
+
+
+def test_merge_bucket():
+    rows = {"date": [1, 3], "nav": [1.0, 3.0], "checksum": [1, 3]}
+    doc, counts = merge_bucket(None, rows, upsert=False)
+    assert counts["inserted"] == 2
+
+    new = {"date": [2, 3], "nav": [2.0, 3.3], "checksum": [2, 33]}
+    merged, counts = merge_bucket(doc, new, upsert=False)
+    assert (counts["inserted"], counts["skipped"]) == (1, 1)
+    assert merged["date"] == [1, 2, 3]
+    assert merged["nav"] == [1.0, 2.0, 3.0]
+
+    merged, counts = merge_bucket(merged, new, upsert=True)
+    assert (counts["upserted"], counts["modified"]) == (0, 1)
+    assert merged["nav"] == [1.0, 2.0, 3.3]
+    assert merge_bucket(merged, new, upsert=True)[0] is None
+
+
+def test_buckets_to_df(rows):
+    docs = [
+        {"fund_cnpj": fund, "month": month, **rows}
+        for batch in iter_buckets(rows, batch_size=10)
+        for (fund, month), rows in batch
+    ]
+    df = buckets_to_df(docs, ["date", "fund_cnpj", "nav"], {}, "2021-01-29")
+    assert list(df.columns) == ["date", "fund_cnpj", "nav"]
+    assert len(df) == 4
+    assert df["date"].min() == pd.Timestamp("2021-01-29")
+    assert sorted(df["nav"]) == [1.1, 1.2, 2.1, 2.2]
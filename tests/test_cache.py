@@ -0,0 +1,116 @@
+import time
+
+import pandas as pd
+import pytest
+
+from bzfunds.cache import DownloadCache, QueryCache
+
+
+# Globals
+FILES = {"/a.csv": b"a" * 100, "/b.csv": b"b" * 100, "/c.csv": b"c" * 100}
+
+
+@pytest.fixture
+def server(local_server):
+    local_server.files.update(FILES)
+
+    return local_server
+
+
+def test_cache_revalidates_with_conditional_requests(server, tmp_path):
+    cache = DownloadCache(str(tmp_path))
+
+    path = cache.fetch(f"{server.url}/a.csv")
+    assert open(path, "rb").read() == FILES["/a.csv"]
+    assert cache.fetch(f"{server.url}/a.csv") == path
+    assert server.hits == [("/a.csv", 200), ("/a.csv", 304)]
+
+
+def test_cache_skips_requests_for_immutable_files(server, tmp_path):
+    cache = DownloadCache(str(tmp_path))
+
+    cache.fetch(f"{server.url}/a.csv", immutable=True)
+    cache.fetch(f"{server.url}/a.csv", immutable=True)
+    assert server.hits == [("/a.csv", 200)]
+
+
+def test_cache_evicts_least_recently_used(server, tmp_path):
+    cache = DownloadCache(str(tmp_path), max_size=250)
+
+    cache.fetch(f"{server.url}/a.csv")
+    cache.fetch(f"{server.url}/b.csv")
+    cache.fetch(f"{server.url}/a.csv")  # `b` is now the least recently used
+    cache.fetch(f"{server.url}/c.csv")
+    assert cache.get_entry(f"{server.url}/a.csv") is not None
+    assert cache.get_entry(f"{server.url}/b.csv") is None
+    assert cache.get_entry(f"{server.url}/c.csv") is not None
+
+
+def test_query_cache_invalidates_overlapping_months():
+    cache = QueryCache()
+    df = pd.DataFrame({"nav": [1.0, 2.0]})
+    jan = cache.make_key(["b", "a"], "2021-01-01", "2021-01-31")
+    feb = cache.make_key(None, "2021-02-01", None)
+
+    for key in (jan, feb):
+        cache.put(key, df, cache.snapshot())
+    assert cache.get(cache.make_key(["a", "b"], "2021-01-01", "2021-01-31")) is df
+
+    cache.invalidate(pd.Series(pd.to_datetime(["2021-03-15"])))
+    assert cache.get(jan) is df
+    assert cache.get(feb) is None
+
+    # Results read before an overlapping write are never stored
+    token = cache.snapshot()
+    cache.invalidate(["2021-01-10"])
+    cache.put(jan, df, token)
+    assert cache.get(jan) is None
+
+
+def test_query_cache_expires_results_in_memory():
+    df = pd.DataFrame({"nav": [1.0, 2.0]})
+    key = QueryCache.make_key(None, "2021-01-01", "2021-01-31")
+
+    # i.e. writes by other processes can't be detected without a `path`
+    cache = QueryCache(ttl=60)
+    now = time.time_ns()
+    cache.put(key, df, (0, now))
+    assert cache.get(key) is df
+
+    cache.put(key, df, (0, now - 61 * 10**9))
+    assert cache.get(key) is None
+    assert not cache._entries
+
+    cache = QueryCache(ttl=None)
+    cache.put(key, df, (0, 0))
+    assert cache.get(key) is df
+
+
+def test_query_cache_persists_results(tmp_path):
+    df = pd.DataFrame({"nav": [1.0, 2.0]})
+    key = QueryCache.make_key(None, "2021-01-01", "2021-01-31")
+
+    QueryCache(path=str(tmp_path)).put(key, df, (0, 0))
+    cache = QueryCache(path=str(tmp_path))
+    pd.testing.assert_frame_equal(cache.get(key), df)
+
+    # Invalidated by another instance sharing the same `path`
+    cache.clear()
+    QueryCache(path=str(tmp_path)).put(key, df, QueryCache().snapshot())
+    QueryCache(path=str(tmp_path)).invalidate(["2021-01-10"])
+    assert cache.get(key) is None
+
+
+def test_query_cache_checks_results_in_memory_against_other_processes(tmp_path):
+    df = pd.DataFrame({"nav": [1.0, 2.0]})
+    key = QueryCache.make_key(None, "2021-01-01", "2021-01-31")
+
+    cache = QueryCache(path=str(tmp_path))
+    cache.put(key, df, cache.snapshot())
+    assert cache.get(key) is df
+
+    # e.g. a separate `download_data` process writing into January
+    QueryCache(path=str(tmp_path)).invalidate(["2021-02-10"])
+    assert cache.get(key) is df
+    QueryCache(path=str(tmp_path)).invalidate(["2021-01-10"])
+    assert cache.get(key) is None
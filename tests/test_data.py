@@ -1,4 +1,6 @@
+import zipfile
 from functools import partial
+from io import BytesIO
 
 import pandas as pd
 import pytest
@@ -8,6 +10,7 @@ import requests
 
 from bzfunds import constants
 from bzfunds.data import *
+from bzfunds.data import _select_zip_members
 from bzfunds.dbm import *
 from bzfunds.utils import get_url_from_date
 
@@ -52,3 +55,107 @@ def test_get_history_date_range():
     d3, d4 = pd.to_datetime(["2110-1-1", "2110-3-1"])
     assert get_history(d1, d2) is None
     assert get_history(d3, d4) is None
+
+
+def test_select_zip_members_only_reads_requested_month():
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for month in range(1, 13):
+            archive.writestr(f"inf_diario_fi_2010{month:02d}.csv", "")
+
+    with zipfile.ZipFile(buffer) as archive:
+        d = pd.to_datetime("2010-03-01")
+        assert _select_zip_members(archive, d, False) == ["inf_diario_fi_201003.csv"]
+        assert len(_select_zip_members(archive, d, True)) == 12
+
+
+def test_get_monthly_data_handles_dropped_connections(local_server):
+    path = "/inf_diario_fi_202101.csv"
+    local_server.files[path] = "TP_FUNDO;CNPJ_FUNDO;DT_COMPTC\nFI;00.000.000/0001-00;"
+    local_server.fail(path, None, times=2)
+
+    assert get_monthly_data(date, commit=False) is None
+    assert get_monthly_data(date, commit=False, chunksize=10) is None
+
+
+def test_get_history_pipeline_throttles_downloads(local_server, monkeypatch):
+    import threading
+    import time
+
+    from bzfunds import data
+
+    for month in range(1, 13):
+        local_server.add_month(
+            f"2021{month:02d}", local_server.row(f"2021-{month:02d}-01")
+        )
+
+    # Writing is blocked until released
+    release = threading.Event()
+    consume_frames = data._consume_frames
+
+    def blocked_consume_frames(*args, **kwargs):
+        release.wait(30)
+        return consume_frames(*args, **kwargs)
+
+    monkeypatch.setattr(data, "_consume_frames", blocked_consume_frames)
+    try:
+        results = []
+        runner = threading.Thread(
+            target=lambda: results.append(
+                data.get_history(
+                    pd.Timestamp("2021-01-01").to_pydatetime(),
+                    pd.Timestamp("2021-12-31").to_pydatetime(),
+                    commit=False,
+                    n_jobs=2,
+                    parse_processes=1,
+                    queue_size=1,
+                )
+            )
+        )
+        runner.start()
+        time.sleep(3)
+        assert len(local_server.hits) < 12
+
+        release.set()
+        runner.join(60)
+        assert len(results[0]) == 12
+    finally:
+        release.set()
+
+
+def test_get_history_only_limits_requests_per_host(local_server, monkeypatch):
+    import threading
+
+    from bzfunds import data
+
+    for month in range(1, 5):
+        local_server.add_month(
+            f"2021{month:02d}", local_server.row(f"2021-{month:02d}-01")
+        )
+    local_server.delay = 0.1
+
+    # Writing is blocked until all files are downloaded, which requires that
+    # writes don't hold the per-host limit
+    downloaded = threading.Event()
+    waits = []
+    consume_frames = data._consume_frames
+
+    def blocked_consume_frames(frames, *args, **kwargs):
+        frames = list(frames)
+        if len(local_server.hits) == 4:
+            downloaded.set()
+        waits.append(downloaded.wait(5))
+        return consume_frames(frames, *args, **kwargs)
+
+    monkeypatch.setattr(data, "_consume_frames", blocked_consume_frames)
+    df = data.get_history(
+        pd.Timestamp("2021-01-01").to_pydatetime(),
+        pd.Timestamp("2021-04-30").to_pydatetime(),
+        commit=False,
+        n_jobs=4,
+        max_per_host=1,
+    )
+
+    assert len(df) == 4
+    assert all(waits)
+    assert local_server.max_active == 1
@@ -1,19 +1,146 @@
 import unittest
 
+import pandas as pd
 import pymongo
 import pytest
 
-from bzfunds.dbm import Manager
+from bzfunds.dbm import Manager, _columns_to_df
 
 
 class TestDBM(unittest.TestCase):
+    @pytest.fixture(autouse=True)
+    def _fixtures(self, sample_df):
+        self.sample_df = sample_df
+
     def setUp(self):
         self.dbm = Manager()
+        self.test_dbm = Manager(collection="test_funds")
 
     def tearDown(self):
-        pass
+        self.test_dbm.collection.drop()
 
     def test_manager_connection(self):
         with pytest.raises(pymongo.errors.ServerSelectionTimeoutError):
             dbm = Manager("invalidhost", serverSelectionTimeoutMS=100)
             _ = dbm.client.list_databases()
+
+    def test_write_df_in_batches(self):
+        df = self.sample_df()
+        res = self.test_dbm.write_df(df, batch_size=7, n_threads=3)
+        assert res["inserted"] == len(df)
+
+        res = self.test_dbm.write_df(df, batch_size=7)
+        assert res["skipped"] == len(df)
+
+    def test_update_df_only_writes_changed_rows(self):
+        df = self.sample_df()
+        self.test_dbm.write_df(df)
+
+        restated = df.copy()
+        restated.loc[0, "nav"] = 1.01
+        assert len(self.test_dbm.filter_changed(restated)) == 1
+
+        res = self.test_dbm.update_df(restated)
+        assert res["modified"] == 1
+        assert self.test_dbm.filter_changed(restated).empty
+
+    def test_indexes_serve_query_patterns(self):
+        self.test_dbm.collection.create_index("fund_cnpj")
+        self.test_dbm.ensure_indexes()
+        assert "fund_cnpj_1" not in self.test_dbm.collection.index_information()
+
+        report = self.test_dbm.check_indexes()
+        assert all(r["indexed"] for r in report.values())
+
+    def test_covered_indexes(self):
+        dbm = Manager(collection="test_funds", covered_indexes=[["nav"]])
+        dbm.write_df(self.sample_df())
+
+        assert dbm.check_indexes()["covered_nav"]["covered"]
+
+    def test_funds_are_stored_by_id(self):
+        df = self.sample_df()
+        self.test_dbm.write_df(df)
+
+        doc = self.test_dbm.collection.find_one()
+        assert isinstance(doc["fund_cnpj"], int)
+
+        res = self.test_dbm.read_df([df["fund_cnpj"][0]])
+        assert res["fund_cnpj"].unique().tolist() == [df["fund_cnpj"][0]]
+
+    def test_migrate_fund_ids(self):
+        self.test_dbm.collection.insert_many(
+            [
+                {"date": pd.Timestamp("2021-01-04"), "fund_cnpj": cnpj}
+                for cnpj in ("00.000.000/0001-00", "not a cnpj")
+            ]
+        )
+
+        # Malformed CNPJs don't fail the whole conversion
+        assert self.test_dbm.migrate_fund_ids() == 1
+        assert self.test_dbm.migrate_fund_ids() == 0
+        stored = {doc["fund_cnpj"] for doc in self.test_dbm.collection.find()}
+        assert stored == {100, "not a cnpj"}
+
+    def test_iter_df(self):
+        df = self.sample_df(n_days=40)
+        self.test_dbm.write_df(df)
+
+        chunks = list(self.test_dbm.iter_df(chunksize=150))
+        assert [len(c) for c in chunks] == [150, 150, 100]
+        assert pd.concat(chunks)["date"].is_monotonic_increasing
+
+        chunks = list(self.test_dbm.iter_df(monthly=True))
+        assert [len(c) for c in chunks] == [280, 120]
+
+    def test_read_snapshot(self):
+        df = self.sample_df()
+        df = df[
+            (df["fund_cnpj"] != "00.000.000/0009-00") | (df["date"] <= "2021-01-05")
+        ]
+        self.test_dbm.write_df(df.assign(nav=df["date"].dt.day.astype(float)))
+
+        res = self.test_dbm.read_snapshot(
+            "2021-01-07", columns=["date", "fund_cnpj", "nav"]
+        )
+        assert len(res) == 10
+        assert res.set_index("fund_cnpj")["nav"].sort_index().tolist() == [7.0] * 9 + [
+            5.0
+        ]
+
+        res = self.test_dbm.read_snapshot("2021-01-07", None, "2021-01-06")
+        assert len(res) == 9
+
+    def test_bucketed_layout(self):
+        df = self.sample_df(n_days=40)
+        dbm = Manager(collection="test_funds", layout="bucketed")
+        assert dbm.write_df(df, batch_size=100)["inserted"] == len(df)
+        assert dbm.collection.count_documents({}) == 20  # 10 funds x 2 months
+        assert dbm.last_date() == df["date"].max()
+
+        res = dbm.read_df(df["fund_cnpj"][:2].tolist(), "2021-01-30", "2021-02-02")
+        assert len(res) == 8
+
+        assert dbm.update_df(df.assign(nav=2.0))["modified"] == len(df)
+        assert (dbm.read_df()["nav"] == 2.0).all()
+
+        flat = Manager(collection="test_funds_flat")
+        flat.copy_from(dbm, rollups=False, jobs=False)
+        assert len(flat.read_df()) == len(df)
+        flat.collection.drop()
+
+
+def test_columns_to_df():
+    docs = [
+        {"_id": {"part": 0}, "nav": [1.0, 2.0], "n_shareholders": [None, None]},
+        {"_id": {"part": 1}, "nav": [3.0], "n_shareholders": [10]},
+    ]
+    df = _columns_to_df(docs, ["nav", "n_shareholders"], {"nav": "float32"}, 2)
+    assert df["nav"].tolist() == [1.0, 2.0, 3.0]
+    assert df["nav"].dtype == "float32"
+    # Batches missing a column don't turn it into `object`
+    assert df["n_shareholders"].dtype == "float64"
+    assert df["n_shareholders"].isna().tolist() == [True, True, False]
+
+    df = _columns_to_df([], ["nav", "n_shareholders"], {}, 2)
+    assert df.empty and (df.dtypes == "float64").all()
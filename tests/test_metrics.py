@@ -0,0 +1,42 @@
+import io
+
+from bzfunds import metrics
+from bzfunds.data import _parse_stream
+
+
+def test_collect_run_report():
+    events = []
+    hook = lambda *args: events.append(args)
+    metrics.add_hook(hook)
+    try:
+        with metrics.collect() as run:
+            metrics.incr("rows_inserted", 10)
+            with metrics.timer("write"):
+                pass
+            with metrics.timer("write"):
+                pass
+    finally:
+        metrics.remove_hook(hook)
+    metrics.incr("rows_inserted")  # Outside of the run
+
+    report = run.report()
+    assert report["counters"] == {"rows_inserted": 10}
+    assert report["timers"]["write"]["count"] == 2
+    assert [e[:2] for e in events] == [
+        ("counter", "rows_inserted"),
+        *[("timer", "write")] * 2,
+    ]
+
+    text = run.to_prometheus()
+    assert "bzfunds_rows_inserted_total 10" in text
+    assert "bzfunds_write_seconds_count 2" in text
+
+
+def test_parse_stream_metrics():
+    csv = "TP_FUNDO;CNPJ_FUNDO;DT_COMPTC;VL_QUOTA\n" + "FI;1;2021-01-04;1.0\n" * 5
+    with metrics.collect() as run:
+        frames = list(_parse_stream(io.BytesIO(csv.encode()), chunksize=2))
+
+    report = run.report()
+    assert report["counters"]["rows_parsed"] == 5
+    assert report["timers"]["parse"]["count"] == len(frames) + 1
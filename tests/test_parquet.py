@@ -0,0 +1,156 @@
+from functools import partial
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from bzfunds.cache import QueryCache
+from bzfunds.parquet import ParquetManager
+
+
+@pytest.fixture
+def sample_df(sample_df):
+    """Frames of 4 funds over 3 days from Jan 30th, i.e. spanning 2 months"""
+    return partial(sample_df, n_funds=4, n_days=3, start="2021-01-30")
+
+
+def test_parquet_write_df(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    df = sample_df()
+
+    counts = manager.write_df(df)
+    assert counts["inserted"] == len(df)
+    partitions = [p.name for p in tmp_path.iterdir() if not p.name.startswith("_")]
+    assert partitions == ["year=2021"]
+    assert manager.last_date() == df["date"].max()
+
+    # Insert skips existing rows, upsert overwrites them
+    assert manager.write_df(df)["skipped"] == len(df)
+    counts = manager.write_df(df.assign(nav=2.0), upsert=True)
+    assert counts["modified"] == len(df)
+
+    stored = manager.read_df()
+    assert len(stored) == len(df)
+    assert (stored["nav"] == 2.0).all()
+
+
+def test_parquet_read_df(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    assert manager.read_df().empty
+    assert manager.last_date() is None
+
+    df = sample_df()
+    manager.write_df(df)
+
+    fund = df["fund_cnpj"].iloc[0]
+    res = manager.read_df(
+        [fund], "2021-02-01", None, columns=["date", "nav"], dtype={"nav": "float32"}
+    )
+    assert list(res.columns) == ["date", "nav"]
+    assert res["nav"].dtype == "float32"
+    assert len(res) == 1
+
+    res = manager.read_df([fund], columns=["fund_cnpj", "date"])
+    assert isinstance(res["fund_cnpj"].dtype, pd.CategoricalDtype)
+
+
+def test_parquet_keeps_fractional_n_shareholders(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    df = sample_df().assign(n_shareholders=1.5)
+    df.loc[0, "n_shareholders"] = float("nan")
+    manager.write_df(df)
+
+    res = manager.read_df(columns=["n_shareholders"])
+    assert res["n_shareholders"].dtype == "float64"
+    assert res["n_shareholders"].isna().sum() == 1
+    assert (res["n_shareholders"].dropna() == 1.5).all()
+
+
+def test_parquet_update_df(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    df = sample_df()
+    manager.write_df(df)
+
+    assert manager.filter_changed(df).empty
+
+    df.loc[0, "nav"] = 1.5
+    counts = manager.update_df(df)
+    assert counts["modified"] == 1
+    assert (
+        manager.read_df([df.loc[0, "fund_cnpj"]], df.loc[0, "date"], df.loc[0, "date"])[
+            "nav"
+        ].item()
+        == 1.5
+    )
+
+
+def test_parquet_invalidates_query_cache(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    manager.query_cache = QueryCache()
+    key = manager.query_cache.make_key(None, "2021-02-01", None)
+    manager.query_cache.put(key, pd.DataFrame(), manager.query_cache.snapshot())
+
+    manager.write_df(sample_df())
+    assert manager.query_cache.get(key) is None
+
+
+def test_get_data_returns_copies_of_cached_results(tmp_path, sample_df):
+    from bzfunds.api import get_data
+
+    manager = ParquetManager(str(tmp_path))
+    manager.query_cache = QueryCache()
+    manager.write_df(sample_df())
+
+    for _ in range(2):
+        df = get_data(manager=manager, columns=["nav"])
+        df["nav"] = 0.0
+    assert (get_data(manager=manager, columns=["nav"])["nav"] == 1.0).all()
+
+
+def test_parquet_iter_df(tmp_path, sample_df):
+    manager = ParquetManager(str(tmp_path))
+    df = sample_df(n_days=5)  # Spans 2 months
+    manager.write_df(df)
+
+    chunks = list(manager.iter_df(chunksize=7))
+    assert [len(c) for c in chunks] == [7, 7, 6]
+    assert pd.concat(chunks)["date"].is_monotonic_increasing
+
+    chunks = list(manager.iter_df(start_dt="2021-01-31", monthly=True))
+    assert [c["date"].dt.month.unique().tolist() for c in chunks] == [[1], [2]]
+    assert [len(c) for c in chunks] == [4, 12]
+
+
+def test_parquet_copy_from(tmp_path, sample_df):
+    source = ParquetManager(str(tmp_path / "source"))
+    df = sample_df()
+    source.write_df(df)
+    source.write_rollup(
+        "monthly_fund_type", pd.DataFrame({"date": [df["date"][0]]}), []
+    )
+    source.write_job("2021-01", {"state": "committed"})
+
+    manager = ParquetManager(str(tmp_path / "copy"))
+    assert manager.copy_from(source)["upserted"] == len(df)
+    assert len(manager.read_df()) == len(df)
+    assert len(manager.read_rollup("monthly_fund_type")) == 1
+    assert manager.read_jobs() == source.read_jobs()
+
+
+def test_parquet_read_snapshot(tmp_path, sample_df):
+    from bzfunds.api import get_snapshot
+
+    manager = ParquetManager(str(tmp_path))
+    df = sample_df(n_days=5)
+    # The last fund stops reporting on Jan 31st
+    df = df[(df["fund_cnpj"] != "00.000.000/0003-00") | (df["date"] <= "2021-01-31")]
+    manager.write_df(df.assign(nav=df["date"].dt.day.astype(float)))
+
+    res = get_snapshot("2021-02-02", manager=manager, columns=["nav"])
+    assert list(res.columns) == ["date", "nav"]
+    assert len(res) == 4
+    assert res["nav"].tolist() == [2.0, 2.0, 2.0, 31.0]
+
+    res = get_snapshot("2021-02-02", "00.000.000/0003-00", manager, lookback=1)
+    assert res is None
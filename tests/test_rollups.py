@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from bzfunds.parquet import ParquetManager
+from bzfunds.rollups import monthly_rollup, update_rollups
+
+
+@pytest.fixture
+def rows(sample_df) -> pd.DataFrame:
+    """Rows of 2 funds (of different types) over 3 days, spanning 2 months"""
+    df = sample_df(n_funds=2, dates=["2021-01-29", "2021-02-01", "2021-02-02"])
+
+    return df.assign(
+        fund_type=["FI", "FIF"] * 3,
+        nav=np.arange(len(df), dtype=float),
+        total_equity=100.0,
+        subscriptions=1.0,
+        redemptions=[np.nan, 1.0] * 3,
+    )
+
+
+def test_monthly_rollup(rows):
+    res = monthly_rollup(rows).set_index(["date", "fund_cnpj"])
+    row = res.loc[(pd.Timestamp("2021-02-01"), "00.000.000/0000-00")]
+
+    assert row["nav_sum"] == 2 + 4
+    assert row["nav_mean"] == 3
+    assert row["nav_last"] == 4
+    assert row["redemptions_count"] == 0
+    assert np.isnan(row["redemptions_sum"])
+
+
+def test_update_rollups(tmp_path, rows):
+    manager = ParquetManager(str(tmp_path))
+    manager.write_df(rows)
+    update_rollups(manager, ["2021-01-29", "2021-02-01"])
+
+    monthly = manager.read_rollup("monthly_fund_type", where={"fund_type": ["FI"]})
+    assert monthly["subscriptions_sum"].tolist() == [1.0, 2.0]
+    assert not any(c.startswith("nav_") for c in monthly.columns)
+
+    yearly = manager.read_rollup("yearly_fund", "2021-01-01", "2021-12-31")
+    assert yearly["subscriptions_sum"].tolist() == [3.0, 3.0]
+    assert yearly["nav_last"].tolist() == [4.0, 5.0]
+
+    # Only rollups of updated months (and their years) are replaced
+    manager.write_df(rows.assign(subscriptions=2.0), upsert=True)
+    update_rollups(manager, ["2021-02-01"])
+    yearly = manager.read_rollup("yearly_fund_type", columns=["subscriptions_sum"])
+    assert yearly["subscriptions_sum"].sum() == 2 * (1 + 4)
+
+
+def test_unchanged_months_skip_rollups(tmp_path, local_server, monkeypatch):
+    from bzfunds import data
+
+    manager = ParquetManager(str(tmp_path))
+    local_server.add_month("202101", local_server.row("2021-01-04"))
+    updated = []
+    monkeypatch.setattr(
+        data, "update_rollups", lambda manager, dates: updated.extend(dates)
+    )
+
+    date = pd.Timestamp("2021-01-01").to_pydatetime()
+    for _ in range(2):
+        data.get_monthly_data(date, manager=manager, incremental=True, rollups=True)
+    assert updated == [pd.Timestamp("2021-01-01")]
@@ -0,0 +1,63 @@
+import json
+import urllib.request
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from bzfunds.backfill import get_ledger
+from bzfunds.parquet import ParquetManager
+from bzfunds.sync import Syncer
+
+
+# Globals
+MONTH = pd.Timestamp.today().to_period("M") - 1
+
+
+def _publish(server, month: pd.Period, nav: float):
+    date = month.start_time.strftime("%Y-%m-%d")
+    server.add_month(month.strftime("%Y%m"), server.row(date, nav))
+
+
+def test_poll_only_downloads_changes(local_server, tmp_path):
+    manager = ParquetManager(str(tmp_path))
+    syncer = Syncer(manager, backoff=0)
+
+    # Current month not published yet
+    _publish(local_server, MONTH, 1.0)
+    name = MONTH.strftime("%Y-%m")
+    assert syncer.poll() == [name]
+    assert get_ledger(manager).loc[name, "state"] == "committed"
+
+    local_server.hits.clear()
+    assert syncer.poll() == []
+    assert local_server.hits == []
+
+    _publish(local_server, MONTH, 2.0)
+    assert syncer.poll() == [name]
+    assert manager.read_df()["nav"].tolist() == [2.0]
+
+    _publish(local_server, MONTH + 1, 1.0)
+    assert syncer.poll() == [(MONTH + 1).strftime("%Y-%m")]
+    assert len(manager.read_df()) == 2
+    assert syncer.health()["status"] == "ok"
+    syncer.close()
+
+
+def test_health_endpoint(local_server, tmp_path):
+    syncer = Syncer(ParquetManager(str(tmp_path)), backoff=0)
+    syncer.run(once=True)
+    server = syncer.serve(0, "127.0.0.1")
+    url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        with urllib.request.urlopen(f"{url}/health") as res:
+            health = json.load(res)
+        assert health["status"] == "ok"
+        assert health["polls"] == 1
+
+        with urllib.request.urlopen(f"{url}/metrics") as res:
+            assert "bzfunds_sync_polls" in res.read().decode()
+    finally:
+        server.shutdown()
+        syncer.close()
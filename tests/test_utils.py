@@ -1,10 +1,13 @@
 import glob
+import io
 from io import StringIO
 
 import pandas as pd
+import pytest
 
 from bzfunds.constants import API_DATE_FORMAT, ROOT_DIR
 from bzfunds.utils import *
+from bzfunds.utils import HAS_PYARROW
 
 
 def test_get_url_from_date():
@@ -21,3 +24,95 @@ def test_parse_csv():
         assert df.index.name == "date"
         assert "fund_cnpj" in df.columns
         assert "total_portfolio" in df.columns
+
+
+def test_iter_csv():
+    csv = (
+        "TP_FUNDO;CNPJ_FUNDO;DT_COMPTC;VL_QUOTA\n"
+        "FI;00.017.024/0001-53;2021-01-04;29.51\n"
+        "FI;00.017.024/0001-53;2021-01-05;29.52\n"
+        "FI;00.017.024/0001-53;2021-01-06;29.53\n"
+    )
+    chunks = list(iter_csv(StringIO(csv), chunksize=2))
+    assert [len(df) for df in chunks] == [2, 1]
+    assert all(df.index.name == "date" for df in chunks)
+    assert pd.concat(chunks).equals(parse_csv(StringIO(csv)))
+
+
+def test_hash_rows():
+    df = pd.DataFrame(
+        {
+            "date": pd.to_datetime(["2021-01-04", "2021-01-04", "2021-01-05"]),
+            "fund_cnpj": ["a", "b", "a"],
+            "nav": [1.0, 1.0, 1.0],
+            "n_shareholders": [10, 10, 10],
+        }
+    )
+    hashes = hash_rows(df)
+    assert hashes.dtype == "int64"
+    assert hashes.nunique() == 1  # Keys aren't hashed
+
+    restated = df.assign(nav=[1.0, 1.01, 1.0])
+    assert (hash_rows(restated) != hashes).tolist() == [False, True, False]
+    assert hash_rows(df.astype({"n_shareholders": float})).equals(hashes)
+
+
+def test_parse_csv_schema():
+    csv = (
+        "TP_FUNDO_CLASSE;CNPJ_FUNDO_CLASSE;ID_SUBCLASSE;DT_COMPTC;VL_QUOTA;NR_COTST\n"
+        "FI;00.017.024/0001-53;;2021-01-04;29.51;10\n"
+        "FI;00.017.024/0001-53;;2021-01-05;29.52;11\n"
+    )
+    for engine in ("c", "pyarrow") if HAS_PYARROW else ("c",):
+        df = parse_csv(StringIO(csv), engine=engine)
+        assert df.index.name == "date"
+        assert pd.api.types.is_datetime64_any_dtype(df.index)
+        assert list(df.columns) == ["fund_type", "fund_cnpj", "nav", "n_shareholders"]
+        assert df["fund_cnpj"].dtype == "category"
+        assert df["nav"].dtype == "float64"
+        assert df["n_shareholders"].dtype == "float64"
+
+
+def test_parse_csv_streams():
+    csv = (
+        "\ufeffTP_FUNDO;CNPJ_FUNDO;DT_COMPTC;VL_QUOTA;NR_COTST;UNKNOWN\r\n"
+        "FI;00.017.024/0001-53;2021-01-04;29.51;;x\r\n"
+        "FI;00.017.024/0001-53;2021-01-05;29.52;11;y\r\n"
+    ).encode("utf-8")
+
+    class Stream(io.RawIOBase):
+        """Non-seekable stream, e.g. `requests.Response.raw`"""
+
+        def __init__(self):
+            self._fp = io.BytesIO(csv)
+
+        def readable(self):
+            return True
+
+        def readinto(self, buffer):
+            return self._fp.readinto(buffer)
+
+    for engine in ("c", "pyarrow") if HAS_PYARROW else ("c",):
+        df = parse_csv(Stream(), engine=engine)
+        assert list(df.columns) == ["fund_type", "fund_cnpj", "nav", "n_shareholders"]
+        assert df["nav"].tolist() == [29.51, 29.52]
+
+    # Chunks share dtypes, whether or not they have missing values
+    chunks = list(iter_csv(io.BytesIO(csv), chunksize=1))
+    assert [df["n_shareholders"].dtype for df in chunks] == ["float64", "float64"]
+
+
+def test_encode_cnpj():
+    funds = pd.Categorical(["13.001.211/0001-90", "00.000.000/0000-01"] * 2)
+    ids = encode_cnpj(funds)
+    assert ids.dtype == "int64"
+    assert ids.tolist() == [13001211000190, 1] * 2
+    assert encode_cnpj(["13001211000190", 1]).tolist() == [13001211000190, 1]
+
+    decoded = decode_cnpj(ids)
+    assert list(decoded) == list(funds)
+    assert list(decoded.categories) == sorted(funds.categories)
+
+    with pytest.raises(ValueError):
+        encode_cnpj(["13.001.211/0001"])
+    assert encode_cnpj(["123456", 1], errors="coerce").tolist() == [-1, 1]